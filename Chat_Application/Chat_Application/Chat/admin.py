@@ -1,16 +1,26 @@
 from django.contrib import admin
 from .models import Group, Message
+from .search import text_match
 
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'owner', 'created_at')
-    search_fields = ('name', 'owner__username')
+    search_fields = ('name', 'owner__name')
     filter_horizontal = ('members',)
+    list_select_related = ('owner',)
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'sender', 'to_user', 'to_group', 'created_at', 'reaction', 'is_deleted', 'attachment')
-    search_fields = ('text', 'sender__username')
+    list_display = ('id', 'sender', 'to_user', 'to_group', 'created_at', 'is_deleted', 'attachment')
+    search_fields = ('sender__name',)
     list_filter = ('to_group', 'sender', 'is_deleted')
+    list_select_related = ('sender', 'to_user', 'to_group')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Text goes through the full-text index instead of a LIKE '%term%' scan
+        by_sender, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not search_term:
+            return by_sender, may_have_duplicates
+        return by_sender | queryset.filter(text_match(search_term)), may_have_duplicates
@@ -0,0 +1,123 @@
+"""
+Hot and cold message tiers.
+
+``Chat_message`` (hot) keeps recent history; ``archive_old`` moves live
+messages created before the horizon (``CHAT_ARCHIVE_AFTER_DAYS``) into
+``ArchivedMessage`` (cold), which has a single index on
+``(conversation, created_at, id)``, and ``purge_deleted`` drops soft-deleted
+messages once ``CHAT_DELETED_RETENTION_DAYS`` have passed. The hot table and
+its indexes therefore only grow with recent traffic.
+
+Reads stay transparent: within a conversation every archived message is older
+than every hot one (the newest message, the inbox preview, is never archived),
+so a history page reads both tiers with the same cursor and puts the cold rows
+after the hot ones, and exports read the archive first. Archived messages are
+read-only: they can no longer be edited, deleted or reacted to, and search
+covers the hot tier only.
+
+The command ``python manage.py archive_messages`` runs both steps, once or
+every ``--every`` seconds.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ARCHIVED_FIELDS, ArchivedMessage, Blob, ConversationSummary, Message, Reaction
+from .pagination import keyset_after, keyset_before
+
+
+def _previews():
+    return ConversationSummary.objects.filter(last_message__isnull=False).values('last_message_id')
+
+
+def _keep_references(messages):
+    """Deleting the hot rows releases their files; the archived copies still use them."""
+    uses = Counter(name for message in messages for name in message.stored_files())
+    by_count = defaultdict(list)
+    for name, count in uses.items():
+        by_count[count].append(name)
+    for count, names in by_count.items():
+        Blob.objects.filter(name__in=names).update(ref_count=F('ref_count') + count)
+
+
+def archive_batch(before, batch_size=1000):
+    """Move up to ``batch_size`` live messages created before ``before``; returns how many moved."""
+    with transaction.atomic():
+        ids = list(Message.objects.filter(created_at__lt=before, is_deleted=False).exclude(
+            id__in=_previews(),
+        ).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        messages = list(Message.objects.select_for_update().filter(id__in=ids))
+        reactions = defaultdict(dict)
+        for message_id, emoji, user_id in Reaction.objects.filter(message_id__in=ids).order_by('id').values_list(
+            'message_id', 'emoji', 'user_id',
+        ):
+            reactions[message_id].setdefault(emoji, []).append(user_id)
+        ArchivedMessage.objects.bulk_create([
+            ArchivedMessage(
+                **{name: getattr(message, name) for name in ARCHIVED_FIELDS}, reactions=reactions[message.id],
+            )
+            for message in messages
+        ])
+        Message.objects.filter(id__in=ids).delete()
+        _keep_references(messages)
+    return len(ids)
+
+
+def archive_old(before, batch_size=1000):
+    """Archive everything live created before ``before``, one transaction per batch."""
+    moved = 0
+    while count := archive_batch(before, batch_size):
+        moved += count
+    return moved
+
+
+def purge_deleted(before, batch_size=1000):
+    """Hard-delete messages soft-deleted before ``before``; clients syncing from older cursors miss them."""
+    purged = 0
+    while True:
+        ids = list(Message.objects.filter(is_deleted=True, updated_at__lt=before).exclude(
+            id__in=_previews(),
+        ).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        Message.objects.filter(id__in=ids).delete()
+        purged += len(ids)
+
+
+def horizon(days):
+    return timezone.now() - timedelta(days=days)
+
+
+def archived_page(conversation, plan):
+    """
+    Cold rows for a history page planned by ``PagePlan``: the same cursor
+    and size, in the same order. None for ``since`` pages.
+    """
+    if plan.since:
+        # Archived rows never change, so they are never part of a sync
+        return None
+    rows = ArchivedMessage.objects.filter(conversation=conversation).select_related('sender')
+    if plan.after:
+        rows = rows.filter(keyset_after('created_at', *plan.after_position)).order_by('created_at', 'id')
+    else:
+        if plan.before:
+            rows = rows.filter(keyset_before('created_at', *plan.before_position))
+        rows = rows.order_by('-created_at', '-id')
+    return rows[:plan.limit + 1]
+
+
+def as_messages(rows, custom_user):
+    """History rows from either tier as ``Message`` instances."""
+    return [row.as_message(custom_user) if isinstance(row, ArchivedMessage) else row for row in rows]
+
+
+def archived_export(conversation):
+    """The archived messages of ``conversation`` for an export, oldest first."""
+    return ArchivedMessage.objects.filter(conversation=conversation).order_by('created_at', 'id').select_related(
+        'sender', 'to_user', 'to_group',
+    )
@@ -0,0 +1,85 @@
+"""
+ASGI-native variants of the hot read endpoints.
+
+They answer the same requests as their counterparts in ``views.py`` but run
+on the event loop with Django's async ORM, so a slow history fetch does not
+hold a worker thread. Writes are delegated to the sync views, which run
+their own authentication, permissions and throttles on the request.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from adrf.views import APIView
+from rest_framework import permissions, status
+from rest_framework.response import Response
+
+from . import caching, directory, history
+from .auth import aget_chat_user
+from .pagination import InvalidCursor, apaginate_messages
+from .receipts import aload_receipts
+from .views import GroupListCreateView, MessageListCreateView, conversation_messages, parse_conversation
+
+
+def _missing_chat_user():
+    return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncUserListView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request):
+        custom_user = await aget_chat_user(request)
+        if not custom_user:
+            return _missing_chat_user()
+        try:
+            page = directory.DirectoryPage(custom_user, request.query_params)
+        except InvalidCursor as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if not page.shared:
+            return Response(await directory.adirectory_page(page))
+        version = await caching.ausers_version()
+        tag = page.etag(version)
+        if caching.fresh(request, tag):
+            return caching.tagged(tag)
+        return caching.tagged(tag, await directory.adirectory_page(page, version))
+
+
+class AsyncGroupListCreateView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request):
+        custom_user = await aget_chat_user(request)
+        if not custom_user:
+            return _missing_chat_user()
+        version = await caching.agroups_version(custom_user)
+        tag = caching.etag('groups', version, custom_user)
+        if caching.fresh(request, tag):
+            return caching.tagged(tag)
+        return caching.tagged(tag, await caching.agroup_list(custom_user, version))
+
+    async def post(self, request):
+        return await sync_to_async(GroupListCreateView.as_view())(request._request)
+
+
+class AsyncMessageListCreateView(APIView):
+    # Sends are throttled by MessageListCreateView, which post() hands them to
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def get(self, request):
+        custom_user = await aget_chat_user(request)
+        if not custom_user:
+            return _missing_chat_user()
+        key, group_id = parse_conversation(custom_user, request.query_params)
+        qs = history.page_rows(await sync_to_async(conversation_messages)(custom_user, key, group_id))
+        try:
+            rows, meta = await apaginate_messages(qs, request.query_params, cold=partial(history.archived_rows, key))
+        except InvalidCursor as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        reactions = await history.aload_reactions(rows, custom_user)
+        watermarks = await aload_receipts(key)
+        return Response(history.page_response(
+            rows, meta, watermarks, reactions, request, history.wants_compact(request.query_params),
+        ))
+
+    async def post(self, request):
+        return await sync_to_async(MessageListCreateView.as_view())(request._request)
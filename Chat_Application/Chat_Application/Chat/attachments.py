@@ -0,0 +1,199 @@
+"""
+Background processing for message attachments.
+
+Uploads are saved as-is inside the request; the heavy work (sniffing the real
+content type, reading dimensions, rendering JPEG/WebP thumbnails and video
+poster frames) runs on a small worker pool once the message is committed.
+
+The pool lives in the server process, so attachments it still held when the
+process stopped stay ``pending``; ``python manage.py requeue_media`` finds
+those and processes them (see ``process_stale``).
+"""
+import logging
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Message
+from .realtime import MESSAGE_UPDATED, publish_message_event
+from .serializers import MessageSerializer
+from .storage import add_reference, release
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'CHAT_MEDIA_WORKERS', 2),
+            thread_name_prefix='chat-media',
+        )
+    return _executor
+
+
+def schedule_processing(message):
+    """Queue ``message``'s attachment for processing once the transaction commits."""
+    if not message.attachment:
+        return
+    # update() skips auto_now; without updated_at, since= syncs would miss the change
+    Message.objects.filter(id=message.id).update(media_status=Message.MEDIA_PENDING, updated_at=timezone.now())
+    message.media_status = Message.MEDIA_PENDING
+    if getattr(settings, 'CHAT_MEDIA_PROCESS_INLINE', False):
+        transaction.on_commit(lambda: process_attachment(message.id))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, message.id))
+
+
+def _run_in_worker(message_id):
+    try:
+        process_attachment(message_id)
+    except Exception:
+        logger.exception('Processing attachment of message %s failed', message_id)
+    finally:
+        # Worker threads own their connections; don't leak them
+        close_old_connections()
+
+
+def _render(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, format=fmt, quality=80, optimize=fmt == 'JPEG')
+    return buffer.getvalue()
+
+
+def _thumbnails(image):
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(getattr(settings, 'CHAT_THUMBNAIL_SIZE', (320, 320)))
+    return _render(image, 'JPEG'), _render(image, 'WEBP')
+
+
+def _video_poster(path):
+    """First frame after one second, as a PIL image, or None without ffmpeg."""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        poster = os.path.join(tmp, 'poster.png')
+        for offset in ('1', '0'):
+            result = subprocess.run(
+                [ffmpeg, '-loglevel', 'error', '-ss', offset, '-i', path, '-frames:v', '1', poster],
+                capture_output=True, timeout=60,
+            )
+            if result.returncode == 0 and os.path.exists(poster):
+                with Image.open(poster) as image:
+                    return image.copy()
+    return None
+
+
+MEDIA_FIELDS = [
+    'attachment_content_type', 'attachment_size', 'attachment_width', 'attachment_height',
+    'thumbnail', 'thumbnail_webp', 'media_status',
+]
+
+
+def _reuse_twin(message):
+    """
+    Copy the results from another message with the same (deduplicated) file,
+    so a forwarded photo is not decoded and thumbnailed again.
+    """
+    twin = Message.objects.filter(
+        attachment=message.attachment.name, media_status=Message.MEDIA_READY
+    ).exclude(id=message.id).only(*MEDIA_FIELDS).first()
+    if twin is None:
+        return False
+    stale = [message.thumbnail.name, message.thumbnail_webp.name]
+    for field in MEDIA_FIELDS:
+        setattr(message, field, getattr(twin, field))
+    add_reference(message.thumbnail.name)
+    add_reference(message.thumbnail_webp.name)
+    message.save(update_fields=MEDIA_FIELDS + ['updated_at'])
+    release(*stale)
+    return True
+
+
+def process_attachment(message_id):
+    message = Message.objects.filter(id=message_id).first()
+    if message is None or not message.attachment:
+        return
+    if _reuse_twin(message):
+        _announce(message)
+        return
+    attachment = message.attachment
+    stem = os.path.splitext(os.path.basename(attachment.name))[0]
+    message.attachment_size = attachment.size
+    message.attachment_content_type = mimetypes.guess_type(attachment.name)[0] or 'application/octet-stream'
+    frame = None
+    try:
+        with attachment.open('rb') as f:
+            with Image.open(f) as image:
+                message.attachment_content_type = Image.MIME.get(image.format, message.attachment_content_type)
+                message.attachment_width, message.attachment_height = image.size
+                jpeg, webp = _thumbnails(image)
+    except UnidentifiedImageError:
+        jpeg = webp = None
+        if message.attachment_content_type.startswith('video/'):
+            try:
+                frame = _video_poster(attachment.path)
+            except (NotImplementedError, OSError, subprocess.SubprocessError):
+                # Remote storages have no local path; posters need a local file
+                frame = None
+        if frame is not None:
+            message.attachment_width, message.attachment_height = frame.size
+            jpeg, webp = _thumbnails(frame)
+    except (OSError, Image.DecompressionBombError):
+        logger.warning('Could not read attachment of message %s', message_id, exc_info=True)
+        Message.objects.filter(id=message_id).update(media_status=Message.MEDIA_FAILED, updated_at=timezone.now())
+        return
+
+    stale = [message.thumbnail.name, message.thumbnail_webp.name]
+    if jpeg:
+        message.thumbnail.save(f'{stem}.jpg', ContentFile(jpeg), save=False)
+        message.thumbnail_webp.save(f'{stem}.webp', ContentFile(webp), save=False)
+    message.media_status = Message.MEDIA_READY
+    message.save(update_fields=MEDIA_FIELDS + ['updated_at'])
+    release(*stale)
+    _announce(message)
+
+
+def _announce(message):
+    publish_message_event(MESSAGE_UPDATED, message, MessageSerializer(message).data)
+
+
+def stale_pending(older_than):
+    """Messages whose attachment has been ``pending`` for more than ``older_than`` seconds."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return Message.objects.filter(media_status=Message.MEDIA_PENDING, updated_at__lt=cutoff)
+
+
+def process_stale(older_than):
+    """
+    Process, in this thread, the attachments left ``pending`` for more than
+    ``older_than`` seconds. One that raises is marked failed rather than
+    retried on every run. Returns ``(processed, failed)`` counts.
+    """
+    processed = failed = 0
+    for message_id in stale_pending(older_than).values_list('id', flat=True).iterator():
+        try:
+            process_attachment(message_id)
+        except Exception:
+            logger.exception('Processing attachment of message %s failed', message_id)
+            Message.objects.filter(id=message_id).update(media_status=Message.MEDIA_FAILED, updated_at=timezone.now())
+            failed += 1
+        else:
+            processed += 1
+    return processed, failed
@@ -0,0 +1,121 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User as CustomUser
+
+
+CHAT_USER_CLAIM = 'chat_user_id'
+
+
+class ChatUserCache:
+    """
+    Process-local LRU of auth user id -> ``Chat.User``, with a TTL. Every
+    ``get`` returns a copy, so requests running at the same time never share
+    (or see each other's changes to) one instance.
+    """
+
+    def __init__(self, maxsize=4096, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            chat_user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(chat_user)
+
+    def set(self, key, chat_user):
+        with self._lock:
+            self._entries[key] = (copy.copy(chat_user), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_chat_user(self, chat_user_id):
+        with self._lock:
+            stale = [key for key, (chat_user, _) in self._entries.items() if chat_user.id == chat_user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+chat_user_cache = ChatUserCache(
+    maxsize=getattr(settings, 'CHAT_USER_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'CHAT_USER_CACHE_TTL', 300),
+)
+
+
+def _lookup_chat_user(request):
+    user = request.user
+    token = getattr(request, 'auth', None)
+    chat_user_id = token.get(CHAT_USER_CLAIM) if hasattr(token, 'get') else None
+    # Always the primary: a replica may not have the profile of someone who just signed up
+    chat_users = CustomUser.objects.using('default')
+    if chat_user_id is not None:
+        # The claim outlives an email change; only trust it while it still matches.
+        # Still one query: the profile itself has to be loaded
+        chat_user = chat_users.filter(id=chat_user_id, email=user.email).first()
+        if chat_user is not None:
+            return chat_user
+    return chat_users.filter(email=user.email).first()
+
+
+def get_chat_user(request):
+    """
+    The ``Chat.User`` behind ``request.user``, resolved at most once per
+    request and cached across requests for ``CHAT_USER_CACHE_TTL`` seconds;
+    a cache miss costs one query (two with a stale ``chat_user_id`` claim).
+    Returns None when the account has no chat profile.
+    """
+    if hasattr(request, '_chat_user'):
+        return request._chat_user
+    chat_user = None
+    if request.user and request.user.is_authenticated:
+        chat_user = chat_user_cache.get(request.user.pk)
+        if chat_user is None:
+            chat_user = _lookup_chat_user(request)
+            if chat_user is not None:
+                chat_user_cache.set(request.user.pk, chat_user)
+    request._chat_user = chat_user
+    return chat_user
+
+
+async def aget_chat_user(request):
+    """Async ``get_chat_user``; only a cache miss leaves the event loop."""
+    if hasattr(request, '_chat_user'):
+        return request._chat_user
+    chat_user = chat_user_cache.get(request.user.pk) if request.user.is_authenticated else None
+    if chat_user is not None:
+        request._chat_user = chat_user
+        return chat_user
+    return await sync_to_async(get_chat_user)(request)
+
+
+def tokens_for(user):
+    """JWT pair for ``user`` carrying the chat user id, so later lookups skip the email join."""
+    refresh = RefreshToken.for_user(user)
+    chat_user = CustomUser.objects.filter(email=user.email).only('id').first()
+    if chat_user is not None:
+        refresh[CHAT_USER_CLAIM] = chat_user.id
+    return refresh
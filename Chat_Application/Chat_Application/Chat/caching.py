@@ -0,0 +1,137 @@
+"""
+Cached responses for the user and group lists.
+
+Both are read on every page load and rarely change, so their serialized
+payloads live in the ``default`` cache under versioned keys:
+``chat:users:<version>:<page>`` holds a page of the user directory (see
+Chat/directory.py) and ``chat:groups:<user>:<version>`` the groups of one
+user. Nothing is ever deleted; the model signals in ``signals.py`` move a
+version on and the next read misses, while the stale entries expire after
+``CHAT_LIST_CACHE_TTL``.
+
+The version is also the list's ETag, so a client revalidating with
+``If-None-Match`` gets a 304 without the list being loaded at all.
+
+Signals do not fire for ``bulk_create`` or ``QuerySet.update``; code that
+writes users or memberships that way calls ``invalidate_users`` or
+``invalidate_groups`` itself.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Group
+from .serializers import GroupSerializer
+
+USERS_VERSION = 'chat:users:version'
+
+
+def groups_version_key(user_id):
+    return f'chat:groups:version:{user_id}'
+
+
+def list_ttl():
+    return getattr(settings, 'CHAT_LIST_CACHE_TTL', 300)
+
+
+def _version(key):
+    """The version under ``key``, starting one if it was never set (or was evicted)."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def _aversion(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def _bump(keys):
+    def move_on():
+        cache.set_many({key: time.time_ns() for key in keys}, timeout=None)
+
+    move_on()
+    if connection.in_atomic_block:
+        # A list read before the commit would otherwise be cached under the new version
+        transaction.on_commit(move_on)
+
+
+def invalidate_users():
+    _bump([USERS_VERSION])
+
+
+def invalidate_groups(user_ids):
+    if user_ids:
+        _bump([groups_version_key(user_id) for user_id in user_ids])
+
+
+def users_version():
+    return _version(USERS_VERSION)
+
+
+def groups_version(custom_user):
+    return _version(groups_version_key(custom_user.id))
+
+
+async def ausers_version():
+    return await _aversion(USERS_VERSION)
+
+
+async def agroups_version(custom_user):
+    return await _aversion(groups_version_key(custom_user.id))
+
+
+def etag(name, version, custom_user):
+    return quote_etag(f'{name}-{custom_user.id}-{version}')
+
+
+def fresh(request, tag):
+    """Whether the client already holds the version ``tag`` names (``If-None-Match``)."""
+    return tag in parse_etags(request.headers.get('If-None-Match', ''))
+
+
+def tagged(tag, data=None):
+    """The list ``data`` under ``tag``, or a bodiless 304 when there is none to send."""
+    if data is None:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(data)
+    response['ETag'] = tag
+    # Browsers keep the list but ask again, with If-None-Match, every time
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def _member_groups(custom_user):
+    return Group.objects.filter(members=custom_user).distinct().prefetch_related('members')
+
+
+def group_list(custom_user, version):
+    """``custom_user``'s groups, as ``GroupSerializer`` data."""
+    key = f'chat:groups:{custom_user.id}:{version}'
+    groups = cache.get(key)
+    if groups is None:
+        groups = GroupSerializer(_member_groups(custom_user), many=True).data
+        cache.set(key, groups, list_ttl())
+    return groups
+
+
+async def agroup_list(custom_user, version):
+    key = f'chat:groups:{custom_user.id}:{version}'
+    groups = await cache.aget(key)
+    if groups is None:
+        groups = GroupSerializer([g async for g in _member_groups(custom_user)], many=True).data
+        await cache.aset(key, groups, list_ttl())
+    return groups
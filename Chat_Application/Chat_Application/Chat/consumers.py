@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Group, User as CustomUser, dm_conversation_key, group_conversation_key
+from .realtime import RECEIPTS_UPDATED, group_channel_group, user_channel_group
+from .receipts import ack_buffer
+
+logger = logging.getLogger(__name__)
+
+# Close code for a client that stopped reading; it reconnects and catches up with ``since``
+SLOW_CONSUMER = 4008
+
+
+@database_sync_to_async
+def _user_for_token(raw_token):
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    return get_user_model().objects.filter(id=token.get('user_id')).first()
+
+
+class JWTQueryAuthMiddleware(BaseMiddleware):
+    """Authenticate sockets with ``?token=<access>`` when no session is present."""
+
+    async def __call__(self, scope, receive, send):
+        params = parse_qs(scope.get('query_string', b'').decode())
+        token = params.get('token', [None])[0]
+        if token:
+            user = await _user_for_token(token)
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes message events for the caller's DMs and groups.
+
+    Group subscriptions follow membership: adding or removing someone (see
+    Chat/signals.py) sends ``chat.subscribe``/``chat.unsubscribe`` to their
+    ``user.<id>`` channel group, so open sockets join or leave at once.
+
+    Events wait in a per-connection outbox of ``CHAT_WS_OUTBOX_SIZE`` that a
+    writer task drains. A client that lets the outbox fill up, or takes longer
+    than ``CHAT_WS_SEND_TIMEOUT`` seconds to accept one frame, is disconnected
+    with ``SLOW_CONSUMER`` rather than having its events pile up in memory.
+    """
+
+    async def connect(self):
+        self.subscriptions = []
+        self.writer = None
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.chat_user = await CustomUser.objects.filter(email=user.email).afirst()
+        if not self.chat_user:
+            await self.close(code=4403)
+            return
+        await self.subscribe(user_channel_group(self.chat_user.id))
+        group_ids = Group.objects.filter(members=self.chat_user).values_list('id', flat=True)
+        async for group_id in group_ids:
+            await self.subscribe(group_channel_group(group_id))
+        await self.accept()
+        self.open_outbox()
+
+    async def disconnect(self, code):
+        if getattr(self, 'writer', None):
+            self.writer.cancel()
+        for name in getattr(self, 'subscriptions', []):
+            await self.channel_layer.group_discard(name, self.channel_name)
+
+    async def subscribe(self, name):
+        if name in self.subscriptions:
+            return
+        await self.channel_layer.group_add(name, self.channel_name)
+        self.subscriptions.append(name)
+
+    async def unsubscribe(self, name):
+        if name not in self.subscriptions:
+            return
+        await self.channel_layer.group_discard(name, self.channel_name)
+        self.subscriptions.remove(name)
+
+    def open_outbox(self):
+        self.dropped = False
+        self.outbox = asyncio.Queue(maxsize=getattr(settings, 'CHAT_WS_OUTBOX_SIZE', 256))
+        self.writer = asyncio.create_task(self.drain())
+
+    async def push(self, content):
+        """Queue ``content`` for the client without waiting for the socket."""
+        if self.dropped:
+            return
+        try:
+            self.outbox.put_nowait(content)
+        except asyncio.QueueFull:
+            await self.drop('outbox full')
+
+    async def drain(self):
+        timeout = getattr(settings, 'CHAT_WS_SEND_TIMEOUT', 10)
+        while True:
+            content = await self.outbox.get()
+            try:
+                await asyncio.wait_for(self.send_json(content), timeout)
+            except asyncio.TimeoutError:
+                await self.drop('send timed out')
+                return
+
+    async def drop(self, reason):
+        self.dropped = True
+        logger.info('Disconnecting slow WebSocket client %s: %s', getattr(self, 'chat_user', None), reason)
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            # The close frame queues behind everything else; don't wait on it forever either
+            await asyncio.wait_for(self.close(code=SLOW_CONSUMER), getattr(settings, 'CHAT_WS_SEND_TIMEOUT', 10))
+        except asyncio.TimeoutError:
+            pass
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'ping':
+            await self.push({'type': 'pong'})
+        elif content.get('type') == 'ack':
+            await self.acknowledge(content)
+
+    async def acknowledge(self, content):
+        """
+        ``{"type": "ack", "user_id"|"group_id": ..., "read": id, "delivered": id}``:
+        watermarks go to the shared buffer, which only ever moves the
+        caller's own summary rows, so no membership check is needed here.
+        """
+        try:
+            if content.get('group_id'):
+                key = group_conversation_key(int(content['group_id']))
+            else:
+                key = dm_conversation_key(self.chat_user.id, content['user_id'])
+            read = int(content.get('read') or 0)
+            delivered = int(content.get('delivered') or 0)
+        except (KeyError, TypeError, ValueError):
+            return
+        await database_sync_to_async(ack_buffer.add)(self.chat_user.id, key, delivered=delivered, read=read)
+
+    async def chat_event(self, event):
+        await self.push({'type': event['event'], 'message': event['message']})
+
+    async def chat_receipts(self, event):
+        await self.push({
+            'type': RECEIPTS_UPDATED, 'conversation': event['conversation'], 'receipts': event['receipts'],
+        })
+
+    async def chat_subscribe(self, event):
+        await self.subscribe(group_channel_group(event['group_id']))
+        await self.push({'type': 'group.joined', 'group_id': event['group_id']})
+
+    async def chat_unsubscribe(self, event):
+        await self.unsubscribe(group_channel_group(event['group_id']))
+        await self.push({'type': 'group.left', 'group_id': event['group_id']})
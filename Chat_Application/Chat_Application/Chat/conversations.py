@@ -0,0 +1,196 @@
+"""
+Per-user conversation summaries behind the inbox (``/api/conversations/``).
+
+Every participant of a DM or group has a ``ConversationSummary`` row holding
+the last message, when the conversation was last active and how many messages
+they have not read yet. The rows are maintained here, inside the transaction
+that writes or reads the message, so listing the inbox is a single indexed
+query on ``(user, last_activity_at)`` however long the histories are.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, F, PositiveIntegerField, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import ConversationSummary, Group, Message, group_conversation_key
+from .reactions import prefetch_reactions
+
+
+def participant_ids(message):
+    """Chat users who see ``message`` in their inbox."""
+    if message.to_group_id:
+        members = Group.members.through.objects.filter(group_id=message.to_group_id)
+        return set(members.values_list('user_id', flat=True)) | {message.sender_id}
+    return {message.sender_id, message.to_user_id}
+
+
+def _new_summary(message, user_id):
+    """``user_id``'s summary of ``message``'s conversation as it was before ``message``: empty."""
+    if message.to_group_id:
+        peer_id = None
+    else:
+        peer_id = message.to_user_id if user_id == message.sender_id else message.sender_id
+    return ConversationSummary(
+        user_id=user_id, conversation=message.conversation, peer_id=peer_id, group_id=message.to_group_id,
+        last_activity_at=message.created_at,
+    )
+
+
+def record_message(message):
+    """
+    Make a newly created ``message`` the last one of its conversation: one
+    more unread message for everyone but the sender, who has read up to it.
+    Call inside the transaction that saved the message.
+    """
+    members = participant_ids(message)
+    rows = ConversationSummary.objects.filter(conversation=message.conversation, user_id__in=members)
+    own = {'user_id': message.sender_id}
+    counter = PositiveIntegerField()
+    changes = {
+        'last_message': message,
+        'last_activity_at': message.created_at,
+        'unread_count': Case(When(**own, then=Value(0)), default=F('unread_count') + 1, output_field=counter),
+        'last_read_id': Case(When(**own, then=Value(message.id)), default=F('last_read_id'), output_field=counter),
+        'last_delivered_id': Case(
+            When(**own, then=Value(message.id)), default=F('last_delivered_id'), output_field=counter,
+        ),
+    }
+    updated = rows.update(**changes)
+    if updated < len(members):
+        # First message of a DM, or members added since the group was created.
+        # The rows are created empty and updated like the others, so one that a
+        # concurrent first message inserted first (and we skip) still counts this one
+        missing = members - set(rows.values_list('user_id', flat=True))
+        ConversationSummary.objects.bulk_create(
+            [_new_summary(message, user_id) for user_id in missing], ignore_conflicts=True,
+        )
+        rows.filter(user_id__in=missing).update(**changes)
+
+
+def _advance(row, batch):
+    """Apply ``batch`` (one conversation, oldest first) to ``row`` as ``record_message`` would, one by one."""
+    for message in batch:
+        if message.sender_id == row.user_id:
+            row.unread_count = 0
+            row.last_read_id = row.last_delivered_id = message.id
+        else:
+            row.unread_count += 1
+    row.last_message = batch[-1]
+    row.last_activity_at = batch[-1].created_at
+
+
+def record_messages(messages):
+    """
+    ``record_message`` for many messages saved together (``bulk_create``):
+    one query for group members, one locking the existing summaries, a bulk
+    insert and a second lock for the missing ones, then one batched update,
+    whatever the number of conversations.
+    Call inside the transaction that saved the messages.
+    """
+    batches = defaultdict(list)
+    for message in sorted(messages, key=lambda message: message.id):
+        batches[message.conversation].append(message)
+    members = defaultdict(set)
+    group_ids = {message.to_group_id for message in messages if message.to_group_id}
+    if group_ids:
+        for group_id, user_id in Group.members.through.objects.filter(group_id__in=group_ids).values_list(
+            'group_id', 'user_id',
+        ):
+            members[group_id].add(user_id)
+    locked = ConversationSummary.objects.select_for_update()
+    existing = {(row.conversation, row.user_id): row for row in locked.filter(conversation__in=list(batches))}
+    wanted = {}
+    for key, batch in batches.items():
+        last = batch[-1]
+        if last.to_group_id:
+            users = members[last.to_group_id] | {message.sender_id for message in batch}
+        else:
+            users = {last.sender_id, last.to_user_id}
+        wanted.update({(key, user_id): last for user_id in users})
+    missing = wanted.keys() - existing.keys()
+    if missing:
+        # Created empty, then locked and advanced like the others, so rows a
+        # concurrent first message inserted first (and we skip) still count these
+        ConversationSummary.objects.bulk_create(
+            [_new_summary(wanted[key], key[1]) for key in missing], ignore_conflicts=True,
+        )
+        existing.update(
+            ((row.conversation, row.user_id), row)
+            for row in locked.filter(conversation__in={key for key, _ in missing})
+            if (row.conversation, row.user_id) in missing
+        )
+    changed = []
+    for key, user_id in wanted:
+        row = existing[key, user_id]
+        _advance(row, batches[key])
+        changed.append(row)
+    write_back(changed)
+
+
+SUMMARY_FIELDS = ['last_message', 'last_activity_at', 'unread_count', 'last_read_id', 'last_delivered_id']
+
+
+def write_back(rows, fields=SUMMARY_FIELDS):
+    """
+    Save ``fields`` of the summaries ``rows``: the same UPDATE per row, sent
+    with executemany. ``bulk_update`` would send one CASE branch per row and
+    field instead, which Django builds and the database evaluates in
+    quadratic time.
+    """
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    columns = [ConversationSummary._meta.get_field(name) for name in fields]
+    assignments = ', '.join(f'{qn(field.column)} = %s' for field in columns)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {qn(ConversationSummary._meta.db_table)} SET {assignments} WHERE id = %s',
+            [
+                (*(field.get_db_prep_value(getattr(row, field.attname), connection) for field in columns), row.pk)
+                for row in rows
+            ],
+        )
+
+
+def record_deletion(message):
+    """
+    Take a soft-deleted ``message`` out of the summaries: it no longer counts
+    as unread, and the previous live message becomes the preview.
+    """
+    rows = ConversationSummary.objects.filter(conversation=message.conversation)
+    rows.filter(last_read_id__lt=message.id, unread_count__gt=0).exclude(user_id=message.sender_id).update(
+        unread_count=F('unread_count') - 1,
+    )
+    previous = Message.objects.filter(
+        conversation=message.conversation, is_deleted=False,
+    ).order_by('-created_at', '-id').values('id')[:1]
+    rows.filter(last_message=message).update(last_message=Subquery(previous))
+
+
+def mark_read(custom_user, conversation):
+    """Everything in ``conversation`` is read by ``custom_user``; returns whether they have a summary."""
+    top = Coalesce(F('last_message_id'), Value(0))
+    return bool(ConversationSummary.objects.filter(user=custom_user, conversation=conversation).update(
+        unread_count=0,
+        last_read_id=Greatest(F('last_read_id'), top, output_field=PositiveIntegerField()),
+        last_delivered_id=Greatest(F('last_delivered_id'), top, output_field=PositiveIntegerField()),
+    ))
+
+
+def open_group(group):
+    """Give every member of a new ``group`` an (empty) summary, so it shows in their inbox."""
+    key = group_conversation_key(group.id)
+    ConversationSummary.objects.bulk_create([
+        ConversationSummary(user_id=user_id, conversation=key, group=group, last_activity_at=group.created_at)
+        for user_id in group.members.values_list('id', flat=True)
+    ], ignore_conflicts=True)
+
+
+def inbox(custom_user):
+    """``custom_user``'s conversations, most recently active first, with what the sidebar renders."""
+    return ConversationSummary.objects.filter(user=custom_user).select_related(
+        'peer', 'group', 'last_message__sender',
+    ).prefetch_related(
+        prefetch_reactions(custom_user, 'last_message__reaction_counts'),
+    ).order_by('-last_activity_at', '-id')
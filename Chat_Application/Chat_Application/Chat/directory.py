@@ -0,0 +1,134 @@
+"""
+The user directory behind ``/api/users/``.
+
+People are listed by case-folded name, a page at a time, and walked with a
+keyset cursor on ``(name_key, id)``, which ``user_name_key_idx`` serves in
+order. ``q`` keeps those whose name or email starts with it, in any case.
+It is a range over the ``name_key``/``email_key`` indexes (``name_key >=
+'ann' AND name_key < 'ano'``), not a ``LIKE``. The keys are folded in Python
+when a user is saved (``models.fold``) and ``q`` is folded the same way:
+SQLite's ``LOWER()`` only folds ASCII, so comparing it with a Python-folded
+prefix would miss names like "Élise". ``contacts=1`` keeps the people the
+caller has a DM with or shares a group with.
+
+Everyone sees the same directory pages, so these are cached under the users
+version (see Chat/caching.py) with each caller's own row dropped afterwards;
+a page therefore fetches two rows more than it returns. Contacts pages
+depend on the caller's conversations and are read every time.
+"""
+import base64
+import hashlib
+import sys
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import caching
+from .models import ConversationSummary, Group, User as CustomUser, fold
+from .pagination import InvalidCursor, parse_limit
+from .serializers import ChatUserSerializer
+
+MAX_QUERY_LENGTH = 100
+
+Membership = Group.members.through
+
+
+def encode_cursor(name_key, pk):
+    return base64.urlsafe_b64encode(f'{name_key}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        name_key, _, pk = base64.urlsafe_b64decode(padded).decode().rpartition('|')
+        return name_key, int(pk)
+    except ValueError:
+        raise InvalidCursor('Invalid cursor')
+
+
+def _prefix(field, prefix):
+    # Everything from 'ann' up to, not including, 'ano'. The last code point has
+    # no successor, so trailing ones are dropped and the character before moves up
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return Q(**{f'{field}__gte': prefix})
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': stem[:-1] + chr(ord(stem[-1]) + 1)})
+
+
+def contacts_of(custom_user):
+    """Ids of everyone ``custom_user`` has a DM with or shares a group with, as a subquery each."""
+    peers = ConversationSummary.objects.filter(user=custom_user, peer__isnull=False).values('peer_id')
+    groups = Membership.objects.filter(user=custom_user).values('group_id')
+    mates = Membership.objects.filter(group_id__in=groups).values('user_id')
+    return Q(id__in=peers) | Q(id__in=mates)
+
+
+class DirectoryPage:
+    """One directory page, split so sync and async views can evaluate it."""
+
+    def __init__(self, custom_user, params):
+        self.custom_user = custom_user
+        self.limit = parse_limit(params.get('limit'))
+        self.prefix = fold((params.get('q') or '').strip())[:MAX_QUERY_LENGTH]
+        self.contacts = params.get('contacts', '').lower() in ('1', 'true')
+        self.after = params.get('after') or ''
+        qs = CustomUser.objects.all()
+        if self.prefix:
+            qs = qs.filter(_prefix('name_key', self.prefix) | _prefix('email_key', self.prefix))
+        if self.contacts:
+            qs = qs.filter(contacts_of(custom_user))
+        if self.after:
+            name_key, pk = decode_cursor(self.after)
+            qs = qs.filter(Q(name_key__gt=name_key) | Q(name_key=name_key, id__gt=pk))
+        # One row may be the caller, one more tells whether there is another page
+        self.queryset = qs.order_by('name_key', 'id')[:self.limit + 2]
+
+    @property
+    def shared(self):
+        return not self.contacts
+
+    def digest(self):
+        return hashlib.sha256(f'{self.prefix}|{self.after}|{self.limit}'.encode()).hexdigest()[:32]
+
+    def etag(self, version):
+        return caching.etag(f'users-{self.digest()}', version, self.custom_user)
+
+    def cache_key(self, version):
+        return f'chat:users:{version}:{self.digest()}'
+
+    def rows(self, users):
+        """``(name_key, ChatUserSerializer data)`` pairs, what the cache keeps."""
+        return list(zip([user.name_key for user in users], ChatUserSerializer(users, many=True).data))
+
+    def finish(self, rows):
+        rows = [(name_key, user) for name_key, user in rows if user['id'] != self.custom_user.id]
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        return {
+            'results': [user for _, user in rows],
+            'has_more': has_more,
+            'next_cursor': encode_cursor(rows[-1][0], rows[-1][1]['id']) if has_more else None,
+        }
+
+
+def directory_page(page, version=None):
+    """The page's body; pages of everyone are read through the cache under ``version``."""
+    if not page.shared:
+        return page.finish(page.rows(list(page.queryset)))
+    key = page.cache_key(version)
+    rows = cache.get(key)
+    if rows is None:
+        rows = page.rows(list(page.queryset))
+        cache.set(key, rows, caching.list_ttl())
+    return page.finish(rows)
+
+
+async def adirectory_page(page, version=None):
+    if not page.shared:
+        return page.finish(page.rows([user async for user in page.queryset]))
+    key = page.cache_key(version)
+    rows = await cache.aget(key)
+    if rows is None:
+        rows = page.rows([user async for user in page.queryset])
+        await cache.aset(key, rows, caching.list_ttl())
+    return page.finish(rows)
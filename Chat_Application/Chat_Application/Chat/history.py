@@ -0,0 +1,175 @@
+"""
+Read-only fast path for message history pages.
+
+``MessageSerializer`` builds every message through DRF's per-field
+machinery: a model instance per row, a nested serializer per sender, a
+``build_absolute_uri`` per file and the attachment flags worked out from the
+file name each time they are read. History pages skip all of that. Rows are
+read with ``values_list(named=True)`` (the sender joined in), and
+``serialize_page`` turns them into the same JSON ``MessageSerializer``
+produces:
+
+- file URLs are made absolute by prepending the request's origin, worked out
+  once per page;
+- the attachment flags are computed once per row;
+- every sender is serialized once per page and shared by their messages.
+
+With ``compact`` the rows carry the sender's id and the page a ``users``
+table keyed by id, so each sender is also sent once.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .archive import archived_page
+from .models import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, Message, User as CustomUser
+from .reactions import prefetch_reactions
+
+SENDER_COLUMNS = ('sender__name', 'sender__email', 'sender__profile_photo')
+# What a history row reads from the hot table, and from the archive (which keeps its reactions inline)
+COLUMNS = (
+    'id', 'sender_id', 'to_user_id', 'to_group_id', 'text', 'attachment', 'attachment_name', 'media_status',
+    'attachment_content_type', 'attachment_size', 'attachment_width', 'attachment_height', 'thumbnail',
+    'thumbnail_webp', 'is_deleted', 'created_at', 'updated_at', *SENDER_COLUMNS,
+)
+ARCHIVED_COLUMNS = tuple(column for column in COLUMNS if column != 'is_deleted') + ('reactions',)
+
+_files = Message._meta.get_field('attachment').storage
+_photos = CustomUser._meta.get_field('profile_photo').storage
+
+
+def wants_compact(params):
+    return params.get('compact', '').lower() in ('1', 'true')
+
+
+def page_rows(qs):
+    """``qs`` (messages of one conversation) as history rows."""
+    return qs.values_list(*COLUMNS, named=True)
+
+
+def archived_rows(conversation, plan):
+    """``archived_page`` as history rows, for ``paginate_messages(cold=...)``."""
+    page = archived_page(conversation, plan)
+    return None if page is None else page.values_list(*ARCHIVED_COLUMNS, named=True)
+
+
+def _counts(rows, custom_user):
+    ids = [row.id for row in rows if not hasattr(row, 'reactions')]
+    if not ids:
+        return None
+    fields = ('message_id', 'emoji', 'count') + (('me',) if custom_user is not None else ())
+    return prefetch_reactions(custom_user).queryset.filter(message_id__in=ids).values_list(*fields)
+
+
+def _reaction_table(rows, counts, custom_user):
+    table = defaultdict(list)
+    for message_id, emoji, count, *me in counts:
+        table[message_id].append({'emoji': emoji, 'count': count, 'me': bool(me and me[0])})
+    for row in rows:
+        if hasattr(row, 'reactions'):
+            table[row.id] = [
+                {'emoji': emoji, 'count': len(users), 'me': custom_user is not None and custom_user.id in users}
+                for emoji, users in row.reactions.items()
+            ]
+    return table
+
+
+def load_reactions(rows, custom_user):
+    """``{message id: [{'emoji', 'count', 'me'}]}`` for a page, in one query (none for an archived page)."""
+    counts = _counts(rows, custom_user)
+    return _reaction_table(rows, () if counts is None else counts, custom_user)
+
+
+async def aload_reactions(rows, custom_user):
+    counts = _counts(rows, custom_user)
+    return _reaction_table(rows, [count async for count in counts] if counts is not None else (), custom_user)
+
+
+def _absolute(request):
+    """Makes a storage URL absolute the way ``build_absolute_uri`` does, without parsing the request each time."""
+    if request is None:
+        return lambda url: url
+    origin = request.build_absolute_uri('/')[:-1]
+
+    def absolute(url):
+        if url.startswith('/') and not url.startswith('//'):
+            return origin + url
+        return request.build_absolute_uri(url)
+
+    return absolute
+
+
+def _datetime(value, zone):
+    # As DRF's DateTimeField renders it
+    value = value.astimezone(zone).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def serialize_page(rows, request=None, reactions=None, receipts=None, compact=False):
+    """
+    ``(results, users)``: the rows in ``MessageSerializer``'s shape and the
+    senders by id. ``reactions`` comes from ``load_reactions``, ``receipts``
+    from ``load_receipts``.
+    """
+    absolute = _absolute(request)
+    zone = timezone.get_current_timezone()
+    reactions = reactions or {}
+    users = {}
+    results = []
+    for row in rows:
+        sender = users.get(row.sender_id)
+        if sender is None:
+            photo = row.sender__profile_photo
+            sender = users[row.sender_id] = {
+                'id': row.sender_id,
+                'name': row.sender__name,
+                'email': row.sender__email,
+                'profile_photo': absolute(_photos.url(photo)) if photo else None,
+            }
+        name = row.attachment
+        if name:
+            url = absolute(_files.url(name))
+            content_type = row.attachment_content_type
+            if content_type:
+                is_image, is_video = content_type.startswith('image/'), content_type.startswith('video/')
+            else:
+                extension = name.rsplit('.', 1)[-1].lower()
+                is_image, is_video = extension in IMAGE_EXTENSIONS, extension in VIDEO_EXTENSIONS
+            file_name = row.attachment_name or name.rsplit('/', 1)[-1]
+        else:
+            url = file_name = None
+            is_image = is_video = False
+        results.append({
+            'id': row.id,
+            'sender': row.sender_id if compact else sender,
+            'to_user': row.to_user_id,
+            'to_group': row.to_group_id,
+            'text': row.text,
+            'attachment': url,
+            'attachment_url': url,
+            'file_name': file_name,
+            'is_image': is_image,
+            'is_video': is_video,
+            'thumbnail_url': absolute(_files.url(row.thumbnail)) if row.thumbnail else None,
+            'thumbnail_webp_url': absolute(_files.url(row.thumbnail_webp)) if row.thumbnail_webp else None,
+            'media_status': row.media_status,
+            'attachment_content_type': row.attachment_content_type,
+            'attachment_size': row.attachment_size,
+            'attachment_width': row.attachment_width,
+            'attachment_height': row.attachment_height,
+            'reactions': reactions.get(row.id, []),
+            'is_deleted': getattr(row, 'is_deleted', False),
+            'created_at': _datetime(row.created_at, zone),
+            'updated_at': _datetime(row.updated_at, zone),
+            'receipt': receipts.for_message(row) if receipts else None,
+        })
+    return results, users
+
+
+def page_response(rows, meta, watermarks, reactions, request, compact):
+    """The body of a history response."""
+    results, users = serialize_page(rows, request, reactions, watermarks, compact)
+    body = {'results': results, **meta, 'watermarks': watermarks.as_dict()}
+    if compact:
+        body['users'] = users
+    return body
@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from Chat import archive
+from Chat.models import Message
+
+
+class Command(BaseCommand):
+    help = ('Move messages older than CHAT_ARCHIVE_AFTER_DAYS to the archive table and purge messages '
+            'soft-deleted more than CHAT_DELETED_RETENTION_DAYS ago.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Archive messages created more than this many days ago '
+                                 '(default: CHAT_ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--deleted-retention', type=int, default=None,
+                            help='Purge messages soft-deleted more than this many days ago '
+                                 '(default: CHAT_DELETED_RETENTION_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Messages moved per transaction (default: CHAT_ARCHIVE_BATCH_SIZE).')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running and repeat every this many seconds, as a scheduler.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved or purged.')
+
+    def handle(self, *args, older_than=None, deleted_retention=None, batch_size=None, every=0, dry_run=False,
+               **options):
+        if older_than is None:
+            older_than = getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 180)
+        if deleted_retention is None:
+            deleted_retention = getattr(settings, 'CHAT_DELETED_RETENTION_DAYS', 30)
+        if batch_size is None:
+            batch_size = getattr(settings, 'CHAT_ARCHIVE_BATCH_SIZE', 1000)
+        while True:
+            self.run_once(older_than, deleted_retention, batch_size, dry_run)
+            if not every:
+                return
+            close_old_connections()
+            time.sleep(every)
+
+    def run_once(self, older_than, deleted_retention, batch_size, dry_run):
+        archive_before = archive.horizon(older_than)
+        purge_before = archive.horizon(deleted_retention)
+        if dry_run:
+            moved = Message.objects.filter(created_at__lt=archive_before, is_deleted=False).count()
+            purged = Message.objects.filter(is_deleted=True, updated_at__lt=purge_before).count()
+        else:
+            purged = archive.purge_deleted(purge_before, batch_size)
+            moved = archive.archive_old(archive_before, batch_size)
+        archived, dropped = ('Would archive', 'would purge') if dry_run else ('Archived', 'purged')
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} {moved} message(s) older than {older_than} day(s); '
+            f'{dropped} {purged} deleted more than {deleted_retention} day(s) ago.'
+        ))
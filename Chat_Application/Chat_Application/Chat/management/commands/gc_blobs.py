@@ -0,0 +1,93 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from Chat.models import ArchivedMessage, Blob, Message
+from Chat.storage import BLOB_PREFIX, blob_storage, is_blob
+
+
+class Command(BaseCommand):
+    help = 'Delete attachment blobs no message references, and report the space deduplication saves.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=3600,
+                            help='Keep unreferenced blobs touched within this many seconds (default 3600), '
+                                 'so files of messages still being saved survive.')
+        parser.add_argument('--recount', action='store_true',
+                            help='Recompute reference counts from the messages table before collecting.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+        parser.add_argument('--report', action='store_true', help='Only print the storage savings report.')
+
+    def handle(self, *args, grace=3600, recount=False, dry_run=False, report=False, **options):
+        if report:
+            self.report()
+            return
+        if recount:
+            self.recount()
+        cutoff = timezone.now() - timedelta(seconds=grace)
+        dead = Blob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff)
+        removed = freed = 0
+        for blob in dead.iterator():
+            if not dry_run:
+                with transaction.atomic():
+                    # A message may have picked the blob up again since we listed it
+                    if not Blob.objects.filter(name=blob.name, ref_count__lte=0).delete()[0]:
+                        continue
+                    blob_storage.delete(blob.name)
+            removed += 1
+            freed += blob.size
+        removed_files, freed_files = self.sweep_untracked(cutoff, dry_run)
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {removed} unreferenced blob(s) and {removed_files} untracked file(s), '
+            f'{(freed + freed_files) / 1024 / 1024:.1f} MB.'
+        ))
+
+    def recount(self):
+        counts = Counter()
+        for model in (Message, ArchivedMessage):
+            for field in ('attachment', 'thumbnail', 'thumbnail_webp'):
+                names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+                counts.update(name for name in names.values_list(field, flat=True).iterator() if is_blob(name))
+        changed = 0
+        for blob in Blob.objects.only('name', 'ref_count').iterator():
+            if blob.ref_count != counts.get(blob.name, 0):
+                Blob.objects.filter(name=blob.name).update(ref_count=counts.get(blob.name, 0))
+                changed += 1
+        self.stdout.write(f'Corrected {changed} reference count(s).')
+
+    def sweep_untracked(self, cutoff, dry_run):
+        """Files under blobs/ without a Blob row, e.g. left by a crash mid-save."""
+        root = blob_storage.path(BLOB_PREFIX)
+        known = set(Blob.objects.values_list('name', flat=True))
+        removed = freed = 0
+        for directory, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, blob_storage.location).replace(os.sep, '/')
+                stat = os.stat(path)
+                if name in known or stat.st_mtime >= cutoff.timestamp():
+                    continue
+                if not dry_run:
+                    os.remove(path)
+                removed += 1
+                freed += stat.st_size
+        return removed, freed
+
+    def report(self):
+        totals = Blob.objects.filter(ref_count__gt=0).aggregate(
+            blobs=Count('name'), stored=Sum('size'), referenced=Sum(F('size') * F('ref_count')),
+        )
+        stored = totals['stored'] or 0
+        referenced = totals['referenced'] or 0
+        saved = referenced - stored
+        self.stdout.write(
+            f'{totals["blobs"] or 0} blobs, {stored / 1024 / 1024:.1f} MB stored for '
+            f'{referenced / 1024 / 1024:.1f} MB referenced: saved {saved / 1024 / 1024:.1f} MB '
+            f'({(saved / referenced * 100) if referenced else 0:.1f}%).'
+        )
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from Chat import uploads
+from Chat.models import Upload
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that have seen no activity for CHAT_UPLOAD_EXPIRY seconds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Idle seconds before an upload is dropped (default: CHAT_UPLOAD_EXPIRY).')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+
+    def handle(self, *args, older_than=None, dry_run=False, **options):
+        if older_than is None:
+            older_than = getattr(settings, 'CHAT_UPLOAD_EXPIRY', 24 * 60 * 60)
+        stale = Upload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=older_than))
+        count = 0
+        for upload in stale.iterator():
+            if not dry_run:
+                uploads.discard(upload)
+            count += 1
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} stale upload(s).'))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from Chat import attachments
+
+
+class Command(BaseCommand):
+    help = ('Process attachments left pending by a worker pool that stopped (a restart or crash); '
+            'run it at startup and from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Seconds an attachment must have been pending '
+                                 '(default: CHAT_MEDIA_PENDING_GRACE).')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be processed.')
+
+    def handle(self, *args, older_than=None, dry_run=False, **options):
+        if older_than is None:
+            older_than = getattr(settings, 'CHAT_MEDIA_PENDING_GRACE', 10 * 60)
+        if dry_run:
+            count = attachments.stale_pending(older_than).count()
+            self.stdout.write(self.style.SUCCESS(f'Would process {count} pending attachment(s).'))
+            return
+        processed, failed = attachments.process_stale(older_than)
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} pending attachment(s), {failed} failed.'
+        ))
@@ -0,0 +1,213 @@
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from Chat import caching
+from Chat.models import ConversationSummary, Group, Message, User as CustomUser, dm_conversation_key, group_conversation_key
+
+WORDS = (
+    'hey hi hello thanks ok sure yes no maybe later today tomorrow tonight meeting call lunch coffee project '
+    'deadline review deploy release bug fix test build ship merge branch design doc draft slides budget '
+    'invoice client demo launch weekend holiday photo video link file update status ready done soon great '
+    'awesome sorry please check again agree plan idea question answer team office remote travel flight'
+).split()
+
+# Content type, extension and whether it has pixel dimensions
+ATTACHMENTS = (
+    ('image/jpeg', 'jpg', True), ('image/png', 'png', True), ('video/mp4', 'mp4', True),
+    ('application/pdf', 'pdf', False),
+)
+
+COLUMNS = (
+    'sender_id', 'to_user_id', 'to_group_id', 'text', 'created_at', 'updated_at', 'is_deleted', 'conversation',
+    'attachment', 'attachment_name', 'attachment_content_type', 'attachment_size', 'attachment_width',
+    'attachment_height', 'media_status',
+)
+
+# Inbox rows for the seeded conversations, all of it counted as read (as the
+# 0008 backfill does for existing data), restricted to the new users and groups
+LATEST = """
+    SELECT conversation, MAX(id) AS last_id FROM {message}
+    WHERE NOT is_deleted AND conversation != '' AND sender_id >= %s GROUP BY conversation
+"""
+SUMMARY_COLUMNS = """
+    INSERT INTO {summary}
+        (user_id, conversation, peer_id, group_id, last_message_id, last_activity_at, unread_count, last_read_id,
+         last_delivered_id)
+"""
+SUMMARIES = [
+    f"""{SUMMARY_COLUMNS}
+        SELECT m.sender_id, m.conversation, m.to_user_id, NULL, m.id, m.created_at, 0, m.id, m.id
+        FROM ({LATEST}) latest JOIN {{message}} m ON m.id = latest.last_id
+        WHERE m.to_group_id IS NULL""",
+    f"""{SUMMARY_COLUMNS}
+        SELECT m.to_user_id, m.conversation, m.sender_id, NULL, m.id, m.created_at, 0, m.id, m.id
+        FROM ({LATEST}) latest JOIN {{message}} m ON m.id = latest.last_id
+        WHERE m.to_group_id IS NULL AND m.to_user_id != m.sender_id""",
+    f"""{SUMMARY_COLUMNS}
+        SELECT gm.user_id, 'g:' || gm.group_id, NULL, gm.group_id, m.id, COALESCE(m.created_at, g.created_at), 0,
+               COALESCE(m.id, 0), COALESCE(m.id, 0)
+        FROM {{membership}} gm
+        JOIN {{group}} g ON g.id = gm.group_id
+        LEFT JOIN ({LATEST}) latest ON latest.conversation = 'g:' || gm.group_id
+        LEFT JOIN {{message}} m ON m.id = latest.last_id
+        WHERE gm.group_id >= %s""",
+]
+
+
+def zipf_weights(count, exponent):
+    """Cumulative weights where the item at rank ``i`` is picked in proportion to ``1 / (i + 1) ** exponent``."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic users, groups and messages for load tests and benchmarks: activity and group '
+            'sizes follow a Zipf distribution, a share of the messages carry attachment metadata.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--messages', type=int, default=100_000)
+        parser.add_argument('--group-share', type=float, default=0.5, help='Share of messages sent to groups.')
+        parser.add_argument('--attachment-share', type=float, default=0.05,
+                            help='Share of messages with attachment metadata (the files themselves are not written).')
+        parser.add_argument('--deleted-share', type=float, default=0.02, help='Share of soft-deleted messages.')
+        parser.add_argument('--max-group-size', type=int, default=500)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent for how active users and groups are, and how big groups get.')
+        parser.add_argument('--days', type=int, default=365, help='Spread the messages over this many days.')
+        parser.add_argument('--accounts', type=int, default=10,
+                            help='Give the most active users a login with --password.')
+        parser.add_argument('--password', default='seed-password')
+        parser.add_argument('--prefix', default='seed', help='Names and emails of the new users start with this.')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, so runs are reproducible.')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2.')
+        if CustomUser.objects.filter(email__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users named {prefix}-* already exist; pick another --prefix.')
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            people = self.seed_users(prefix, options['users'], options['accounts'], options['password'])
+            rooms, members = self.seed_groups(rng, prefix, people, options['groups'], options['max_group_size'],
+                                              options['skew'])
+            self.seed_messages(rng, people, rooms, members, options)
+            self.seed_summaries(people[0].id, rooms[0].id if rooms else None)
+        caching.invalidate_users()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(people)} users ({min(options["accounts"], len(people))} with logins, e.g. '
+            f'{people[0].email} / {options["password"]}), {len(rooms)} groups and {options["messages"]} messages '
+            f'in {time.perf_counter() - started:.1f}s.'
+        ))
+
+    def seed_users(self, prefix, count, accounts, password):
+        people = [
+            CustomUser(name=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password='!') for i in range(count)
+        ]
+        for person in people:
+            # bulk_create skips save(), which normally fills these in
+            person.assign_keys()
+        CustomUser.objects.bulk_create(people)
+        hashed = make_password(password)  # one hash for all of them; hashing is deliberately slow
+        get_user_model().objects.bulk_create([
+            get_user_model()(username=person.email, email=person.email, first_name=person.name, password=hashed)
+            for person in people[:accounts]
+        ])
+        return people
+
+    def seed_groups(self, rng, prefix, people, count, max_size, skew):
+        """Groups whose sizes fall off with rank, joined mostly by the most active users."""
+        if not count:
+            return [], {}
+        rooms = Group.objects.bulk_create([
+            Group(name=f'{prefix}-group-{i}', owner=people[i % len(people)]) for i in range(count)
+        ])
+        popularity = zipf_weights(len(people), skew)
+        members = {}
+        for rank, room in enumerate(rooms):
+            size = max(2, min(len(people), int(max_size / (rank + 1) ** skew)))
+            chosen = {people[rank % len(people)].id}
+            while len(chosen) < size:
+                chosen.update(person.id for person in rng.choices(people, cum_weights=popularity, k=size - len(chosen)))
+            members[room.id] = sorted(chosen)
+        Membership = Group.members.through
+        Membership.objects.bulk_create([
+            Membership(group_id=room_id, user_id=user_id) for room_id, ids in members.items() for user_id in ids
+        ], batch_size=10_000)
+        return rooms, members
+
+    def seed_messages(self, rng, people, rooms, members, options):
+        total, batch_size = options['messages'], options['batch_size']
+        ids = [person.id for person in people]
+        position = {user_id: i for i, user_id in enumerate(ids)}
+        activity = zipf_weights(len(ids), options['skew'])
+        room_ids = [room.id for room in rooms]
+        room_activity = zipf_weights(len(room_ids), options['skew']) if rooms else None
+        group_share = options['group_share'] if rooms else 0
+        start = timezone.now() - timedelta(days=options['days'])
+        step = timedelta(days=options['days']) / max(total, 1)
+        sql = (
+            f'INSERT INTO {connection.ops.quote_name(Message._meta.db_table)} ({", ".join(COLUMNS)}) '
+            f'VALUES ({", ".join(["%s"] * len(COLUMNS))})'
+        )
+        with connection.cursor() as cursor:
+            for offset in range(0, total, batch_size):
+                count = min(batch_size, total - offset)
+                senders = rng.choices(ids, cum_weights=activity, k=count)
+                partners = rng.choices(ids, cum_weights=activity, k=count)
+                targets = rng.choices(room_ids, cum_weights=room_activity, k=count) if rooms else [None] * count
+                rows = []
+                for i in range(count):
+                    n = offset + i
+                    created = connection.ops.adapt_datetimefield_value(start + step * n)
+                    if rng.random() < group_share:
+                        room = targets[i]
+                        sender, to_user, to_group = rng.choice(members[room]), None, room
+                        key = group_conversation_key(room)
+                    else:
+                        sender, to_user = senders[i], partners[i]
+                        if to_user == sender:
+                            to_user = ids[(position[sender] + 1) % len(ids)]
+                        to_group, key = None, dm_conversation_key(sender, to_user)
+                    text = ' '.join(rng.choices(WORDS, k=rng.randint(1, 20)))
+                    rows.append((sender, to_user, to_group, text, created, created,
+                                 rng.random() < options['deleted_share'], key,
+                                 *self.attachment(rng, n, options['attachment_share'])))
+                cursor.executemany(sql, rows)
+
+    def attachment(self, rng, n, share):
+        if rng.random() >= share:
+            return None, '', '', None, None, None, ''
+        content_type, extension, sized = rng.choice(ATTACHMENTS)
+        width, height = (rng.choice(((1920, 1080), (1080, 1920), (1280, 960), (640, 640))) if sized else (None, None))
+        size = int(rng.lognormvariate(12.5, 1.2))  # a few hundred KB, with a long tail
+        return (f'message_attachments/seed/{n}.{extension}', f'file-{n}.{extension}', content_type, size,
+                width, height, Message.MEDIA_READY)
+
+    def seed_summaries(self, first_user_id, first_group_id):
+        names = {
+            'message': connection.ops.quote_name(Message._meta.db_table),
+            'summary': connection.ops.quote_name(ConversationSummary._meta.db_table),
+            'membership': connection.ops.quote_name(Group.members.through._meta.db_table),
+            'group': connection.ops.quote_name(Group._meta.db_table),
+        }
+        dm_only, with_groups = SUMMARIES[:2], SUMMARIES[2]
+        with connection.cursor() as cursor:
+            for statement in dm_only:
+                cursor.execute(statement.format(**names), [first_user_id])
+            if first_group_id is not None:
+                cursor.execute(with_groups.format(**names), [first_user_id, first_group_id])
+            cursor.execute('ANALYZE' if connection.vendor == 'sqlite' else f'ANALYZE {names["message"]}')
@@ -0,0 +1,240 @@
+"""
+Serving ``MEDIA_URL``: attachments, thumbnails and profile photos.
+
+Message files are only served to the people in their conversation: the
+sender and recipient of a DM, or the members of the group, through any live
+or archived message that points at the file (deduplicated blobs may be
+shared by several). Profile photos are served to anyone signed in, and the
+site's own artwork at the top of ``MEDIA_ROOT`` to everybody. Anything else,
+including files the caller may not read, is a 404.
+
+Responses carry ``ETag``/``Last-Modified`` and answer conditional requests
+with 304, and a single ``Range: bytes=...`` with 206 (``If-Range``
+respected), which is what lets video seek. Blobs are named after their
+SHA-256 and never change, so their ETag is that digest and they may be
+cached for a year. Files are streamed in chunks, asynchronously under ASGI.
+
+With ``CHAT_MEDIA_OFFLOAD`` set, the check runs here and the bytes are left
+to the front server: ``nginx`` answers with ``X-Accel-Redirect`` to
+``CHAT_MEDIA_ACCEL_PREFIX`` (an ``internal`` location aliased to
+``MEDIA_ROOT``), ``sendfile`` with ``X-Sendfile`` (Apache mod_xsendfile,
+lighttpd). The server then does ranges and revalidation itself.
+"""
+import asyncio
+import mimetypes
+import os
+from stat import S_ISREG
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+
+from .auth import get_chat_user
+from .models import ArchivedMessage, Group, Message
+from .storage import is_blob
+
+CHUNK_SIZE = 256 * 1024
+IMMUTABLE = 365 * 24 * 60 * 60
+
+# Where each kind of upload lives, see the upload_to of the model fields
+MESSAGE_DIRS = ('blobs/', 'message_attachments/', 'message_thumbnails/')
+PROFILE_DIRS = ('profile_photos/',)
+
+Membership = Group.members.through
+
+
+class Unsatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)``, inclusive, for a single ``bytes=`` range of a
+    ``size``-byte file; None when the whole file should be sent (no range,
+    several ranges or one we cannot read, all of which a server may ignore).
+    Raises Unsatisfiable when the range starts past the end.
+    """
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise Unsatisfiable
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise Unsatisfiable
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith(('"', 'W/')):
+        # Only a strong, exact match allows a partial response
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def etag_for(name, stat):
+    if is_blob(name):
+        digest = os.path.splitext(os.path.basename(name))[0]
+        return quote_etag(digest)
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+def cache_control(name):
+    if is_blob(name):
+        return f'private, max-age={IMMUTABLE}, immutable'
+    scope = 'public' if '/' not in name else 'private'
+    return f'{scope}, max-age={settings.CHAT_MEDIA_MAX_AGE}'
+
+
+def content_type_for(name):
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    # Anything a browser could run on our origin (HTML, SVG, ...) is downloaded, not shown
+    inline = content_type.split('/')[0] in ('image', 'video', 'audio') and content_type != 'image/svg+xml'
+    return content_type, 'inline' if inline else 'attachment'
+
+
+def can_read(custom_user, name):
+    """Whether ``custom_user`` is in the conversation of a message holding the file ``name``."""
+    files = Q(attachment=name) | Q(thumbnail=name) | Q(thumbnail_webp=name)
+    groups = Membership.objects.filter(user=custom_user).values('group_id')
+    visible = Q(sender=custom_user) | Q(to_user=custom_user) | Q(to_group_id__in=groups)
+    return (
+        Message.objects.filter(files, visible, is_deleted=False).exists()
+        or ArchivedMessage.objects.filter(files, visible).exists()
+    )
+
+
+def _check_access(request, name):
+    if name.startswith(MESSAGE_DIRS):
+        custom_user = get_chat_user(request)
+        if custom_user is None or not can_read(custom_user, name):
+            raise Http404
+    elif name.startswith(PROFILE_DIRS):
+        if not request.user or not request.user.is_authenticated:
+            raise Http404
+    elif '/' in name or name.startswith('.'):
+        raise Http404
+
+
+def _read_chunks(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+async def _aread_chunks(path, start, length):
+    # Each read leaves the event loop; a sync iterator would be read whole into memory under ASGI
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _offloaded(name, path, mode):
+    response = HttpResponse()
+    if mode == 'nginx':
+        response['X-Accel-Redirect'] = settings.CHAT_MEDIA_ACCEL_PREFIX + quote(name)
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def serve_file(request, name, path):
+    """The response for ``path`` (``MEDIA_ROOT/name``), honouring conditional and range headers."""
+    content_type, disposition = content_type_for(name)
+    mode = settings.CHAT_MEDIA_OFFLOAD
+    if mode:
+        # The front server stats, revalidates and slices the file
+        response = _offloaded(name, path, mode)
+    else:
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404
+        if not S_ISREG(stat.st_mode):
+            raise Http404
+        etag = etag_for(name, stat)
+        last_modified = int(stat.st_mtime)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = _ranged(request, path, stat.st_size, etag, last_modified)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+    if response.status_code in (200, 206):
+        response['Content-Type'] = content_type
+        response['Content-Disposition'] = disposition
+    response['Cache-Control'] = cache_control(name)
+    return response
+
+
+def _ranged(request, path, size, etag, last_modified):
+    start, end, status = 0, size - 1, 200
+    if 'Range' in request.headers and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except Unsatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            (start, end), status = byte_range, 206
+    length = end - start + 1
+    if request.method == 'HEAD' or length == 0:
+        response = HttpResponse(status=status)
+    else:
+        chunks = _aread_chunks if isinstance(request._request, ASGIRequest) else _read_chunks
+        response = StreamingHttpResponse(chunks(path, start, length), status=status)
+    response['Content-Length'] = str(length)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+class MediaView(APIView):
+    """``MEDIA_URL<name>``; session or JWT authenticated, see the module docstring for who may read what."""
+    permission_classes = [AllowAny]
+    http_method_names = ['get', 'head']
+
+    def get(self, request, name):
+        try:
+            path = safe_join(settings.MEDIA_ROOT, name)
+        except SuspiciousFileOperation:
+            raise Http404
+        _check_access(request, name)
+        return serve_file(request, name, path)
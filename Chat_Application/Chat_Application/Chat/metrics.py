@@ -0,0 +1,317 @@
+"""
+Per-endpoint request metrics and on-demand profiling.
+
+``MetricsMiddleware`` records, for every request, under the route pattern it
+matched (``api/messages/<int:pk>/``), the method and the status: a request
+count, a latency histogram, how many SQL queries it issued and how long they
+took, and the response size. Streamed responses are measured until their
+last chunk is sent. It is sync and async capable, so under ASGI the async
+views keep running on the event loop. ``/metrics`` serves the numbers in the
+Prometheus text format to staff, to holders of ``CHAT_METRICS_TOKEN`` and to
+the networks in ``CHAT_METRICS_ALLOWED_IPS`` (none by default: behind a
+reverse proxy every request comes from the proxy's address); they are per
+process, so scrape every worker.
+
+The same middleware profiles a request with cProfile when it carries
+``X-Chat-Profile: <CHAT_PROFILE_TOKEN>`` or is drawn at
+``CHAT_PROFILE_SAMPLE_RATE``, and writes the ``.prof`` dump (pstats format,
+which snakeviz and flameprof read) to ``CHAT_PROFILE_DIR``; the response
+names the file in ``X-Chat-Profile``. With no token and a rate of 0, as
+shipped, this costs one settings lookup per request.
+"""
+import cProfile
+import hmac
+import ipaddress
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+UNMATCHED = '<unmatched>'
+PROFILE_HEADER = 'X-Chat-Profile'
+METRICS_PATH = '/metrics'
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """``(le, cumulative count)`` pairs, ending with ``+Inf``."""
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield bound, total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Metrics:
+    """Counters and histograms for this process, keyed by route and method."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.requests = defaultdict(int)  # (route, method, status) -> count
+            self.durations = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+            self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+            self.query_seconds = defaultdict(float)
+            self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+
+    def observe(self, route, method, status, seconds, queries, query_seconds, size):
+        key = (route, method)
+        with self._lock:
+            self.requests[(route, method, status)] += 1
+            self.durations[key].observe(seconds)
+            self.queries[key].observe(queries)
+            self.query_seconds[key] += query_seconds
+            self.sizes[key].observe(size)
+
+    def render(self):
+        """Everything recorded so far, in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                '# HELP chat_http_requests_total Requests handled, by route, method and status.',
+                '# TYPE chat_http_requests_total counter',
+            ]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'chat_http_requests_total{_labels(route=route, method=method, status=status)} {count}')
+            histograms = (
+                ('chat_http_request_duration_seconds', 'Time to produce the whole response.', self.durations),
+                ('chat_http_db_queries', 'SQL queries issued per request.', self.queries),
+                ('chat_http_response_size_bytes', 'Response body size.', self.sizes),
+            )
+            for name, help_text, series in histograms:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (route, method), histogram in sorted(series.items()):
+                    for bound, total in histogram.samples():
+                        labels = _labels(route=route, method=method, le=bound)
+                        lines.append(f'{name}_bucket{labels} {total}')
+                    labels = _labels(route=route, method=method)
+                    lines.append(f'{name}_sum{labels} {histogram.sum:g}')
+                    lines.append(f'{name}_count{labels} {sum(histogram.counts)}')
+            lines += [
+                '# HELP chat_http_db_query_seconds_total Time spent in SQL queries.',
+                '# TYPE chat_http_db_query_seconds_total counter',
+            ]
+            for (route, method), seconds in sorted(self.query_seconds.items()):
+                lines.append(f'chat_http_db_query_seconds_total{_labels(route=route, method=method)} {seconds:g}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class QueryTimer:
+    """Counts and times the queries issued while it is the current timer (see ``_timed``)."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+# The request's timer. A context variable, because under ASGI the queries run
+# on sync_to_async threads, whose connections the middleware never sees, and
+# the context is carried over to them.
+_current_timer = ContextVar('chat_query_timer', default=None)
+
+
+def _timed(execute, sql, params, many, context):
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _timed not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed)
+
+
+connection_created.connect(_install)
+
+
+def _profile_requested(request):
+    token = getattr(settings, 'CHAT_PROFILE_TOKEN', '')
+    if token and hmac.compare_digest(request.headers.get(PROFILE_HEADER, ''), token):
+        return True
+    rate = getattr(settings, 'CHAT_PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def _save_profile(profiler, request, seconds):
+    directory = str(getattr(settings, 'CHAT_PROFILE_DIR', 'profiles'))
+    os.makedirs(directory, exist_ok=True)
+    route = _route(request).strip('/').replace('/', '_').replace('<', '').replace('>', '').replace(':', '-')
+    stamp = time.strftime('%Y%m%dT%H%M%S')
+    name = f'{stamp}-{request.method}-{route or "root"}-{seconds * 1000:.0f}ms-{os.getpid()}.prof'
+    profiler.dump_stats(os.path.join(directory, name))
+    return name
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else UNMATCHED
+
+
+class MetricsMiddleware:
+    """Outermost middleware, so the numbers cover everything below it; sync or async, like the stack below."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if request.path == METRICS_PATH:
+            return self.get_response(request)
+        # Connections opened before this module was imported have no wrapper yet
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+        profiler = self._start_profiler(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        token = _current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+            if profiler is not None:
+                profiler.disable()
+        return self.finish(request, response, profiler, timer, started)
+
+    async def __acall__(self, request):
+        if request.path == METRICS_PATH:
+            return await self.get_response(request)
+        # Profiles the event loop thread, so other requests served meanwhile show up too
+        profiler = self._start_profiler(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        token = _current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+            if profiler is not None:
+                profiler.disable()
+        return self.finish(request, response, profiler, timer, started)
+
+    def _start_profiler(self, request):
+        if not _profile_requested(request):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is already running on this thread
+            return None
+        return profiler
+
+    def finish(self, request, response, profiler, timer, started):
+        if profiler is not None:
+            response[PROFILE_HEADER] = _save_profile(profiler, request, time.perf_counter() - started)
+        if response.streaming:
+            measure = self._ameasure_stream if response.is_async else self._measure_stream
+            response.streaming_content = measure(request, response, response.streaming_content, timer, started)
+        else:
+            self.record(request, response, timer, started, len(response.content))
+        return response
+
+    def _measure_stream(self, request, response, content, timer, started):
+        size = 0
+        token = _current_timer.set(timer)
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            _current_timer.reset(token)
+            self.record(request, response, timer, started, size)
+
+    async def _ameasure_stream(self, request, response, content, timer, started):
+        size = 0
+        token = _current_timer.set(timer)
+        try:
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            _current_timer.reset(token)
+            self.record(request, response, timer, started, size)
+
+    def record(self, request, response, timer, started, size):
+        method = request.method if request.method in METHODS else 'OTHER'
+        metrics.observe(
+            _route(request), method, str(response.status_code), time.perf_counter() - started,
+            timer.count, timer.seconds, size,
+        )
+
+
+def _allowed_address(request):
+    networks = getattr(settings, 'CHAT_METRICS_ALLOWED_IPS', ())
+    if not networks:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in networks)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for staff, ``Authorization: Bearer
+    <CHAT_METRICS_TOKEN>`` and addresses in ``CHAT_METRICS_ALLOWED_IPS``;
+    everyone else gets a 403.
+    """
+    token = getattr(settings, 'CHAT_METRICS_TOKEN', '')
+    allowed = (
+        getattr(request.user, 'is_staff', False)
+        or (bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'))
+        or _allowed_address(request)
+    )
+    if not allowed:
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
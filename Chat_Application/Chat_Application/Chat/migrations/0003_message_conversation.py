@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+
+def backfill_conversation(apps, schema_editor):
+    """Fill the conversation key for existing rows with two set-based UPDATEs"""
+    Message = apps.get_model('Chat', 'Message')
+    Message.objects.filter(to_group__isnull=False).update(
+        conversation=Concat(Value('g:'), Cast('to_group_id', CharField()))
+    )
+    Message.objects.filter(to_group__isnull=True, to_user__isnull=False).update(
+        conversation=Concat(
+            Value('u:'),
+            Cast(Least('sender_id', 'to_user_id'), CharField()),
+            Value(':'),
+            Cast(Greatest('sender_id', 'to_user_id'), CharField()),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0002_user_alter_message_options_message_attachment_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='text',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(backfill_conversation, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['conversation', 'created_at', 'id'], name='message_conversation_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'updated_at', 'id'], name='message_conversation_sync_idx'),
+        ),
+    ]
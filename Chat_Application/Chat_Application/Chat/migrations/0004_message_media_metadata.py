@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0003_message_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attachment_content_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='media_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='message_thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thumbnail_webp',
+            field=models.ImageField(blank=True, null=True, upload_to='message_thumbnails/'),
+        ),
+    ]
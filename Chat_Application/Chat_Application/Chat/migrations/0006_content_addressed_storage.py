@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+import Chat.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0005_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, storage=Chat.storage.ContentAddressedStorage(), upload_to='message_attachments/'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=Chat.storage.ContentAddressedStorage(), upload_to='message_thumbnails/'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='thumbnail_webp',
+            field=models.ImageField(blank=True, null=True, storage=Chat.storage.ContentAddressedStorage(), upload_to='message_thumbnails/'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['attachment'], name='message_attachment_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+"""
+Full-text index over live message text: an FTS5 table kept in sync by
+triggers on SQLite, a GIN expression index on PostgreSQL. See Chat/search.py.
+"""
+from django.db import migrations
+
+FTS_TABLE = 'chat_message_fts'
+
+SQLITE_SCHEMA = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"text, content='Chat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='3 4')",
+    f"INSERT INTO {FTS_TABLE}(rowid, text) SELECT id, text FROM Chat_message WHERE is_deleted = 0 AND text != ''",
+]
+# Also replayed after every migrate by Chat.search.ensure_search_triggers:
+# SQLite drops a table's triggers when a migration rebuilds it
+SQLITE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON Chat_message
+        WHEN new.is_deleted = 0 AND new.text != '' BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON Chat_message
+        WHEN old.is_deleted = 0 AND old.text != '' BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF text, is_deleted ON Chat_message
+        WHEN old.text IS NOT new.text OR old.is_deleted IS NOT new.is_deleted BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+                SELECT 'delete', old.id, old.text WHERE old.is_deleted = 0 AND old.text != '';
+            INSERT INTO {FTS_TABLE}(rowid, text)
+                SELECT new.id, new.text WHERE new.is_deleted = 0 AND new.text != '';
+        END""",
+]
+SQLITE_TEARDOWN = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_insert',
+    'DROP TRIGGER IF EXISTS chat_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chat_message_fts_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+POSTGRES_SCHEMA = [
+    'CREATE INDEX IF NOT EXISTS message_text_search_idx ON "Chat_message" '
+    "USING gin (to_tsvector('simple', text)) WHERE NOT is_deleted",
+]
+POSTGRES_TEARDOWN = ['DROP INDEX IF EXISTS message_text_search_idx']
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in SQLITE_SCHEMA + SQLITE_TRIGGERS if vendor == 'sqlite' else POSTGRES_SCHEMA if vendor == 'postgresql' else []:
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in SQLITE_TEARDOWN if vendor == 'sqlite' else POSTGRES_TEARDOWN if vendor == 'postgresql' else []:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0006_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
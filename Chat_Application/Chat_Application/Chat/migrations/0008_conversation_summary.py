@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# One summary per participant of every existing conversation, all of it counted
+# as read. Set-based, so it does not load millions of messages into Python
+LATEST = """
+    SELECT conversation, MAX(id) AS last_id FROM "Chat_message"
+    WHERE NOT is_deleted AND conversation != '' GROUP BY conversation
+"""
+COLUMNS = """
+    INSERT INTO "Chat_conversationsummary"
+        (user_id, conversation, peer_id, group_id, last_message_id, last_activity_at, unread_count, last_read_id)
+"""
+BACKFILL = [
+    # Both sides of every DM, from its last live message
+    f"""{COLUMNS}
+        SELECT m.sender_id, m.conversation, m.to_user_id, NULL, m.id, m.created_at, 0, m.id
+        FROM ({LATEST}) latest JOIN "Chat_message" m ON m.id = latest.last_id
+        WHERE m.to_group_id IS NULL AND m.to_user_id IS NOT NULL""",
+    f"""{COLUMNS}
+        SELECT m.to_user_id, m.conversation, m.sender_id, NULL, m.id, m.created_at, 0, m.id
+        FROM ({LATEST}) latest JOIN "Chat_message" m ON m.id = latest.last_id
+        WHERE m.to_group_id IS NULL AND m.to_user_id IS NOT NULL AND m.to_user_id != m.sender_id""",
+    # Every group member, including groups nobody has written in yet
+    f"""{COLUMNS}
+        SELECT gm.user_id, 'g:' || gm.group_id, NULL, gm.group_id, m.id, COALESCE(m.created_at, g.created_at), 0,
+               COALESCE(m.id, 0)
+        FROM "Chat_group_members" gm
+        JOIN "Chat_group" g ON g.id = gm.group_id
+        LEFT JOIN ({LATEST}) latest ON latest.conversation = 'g:' || gm.group_id
+        LEFT JOIN "Chat_message" m ON m.id = latest.last_id""",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0007_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation', models.CharField(max_length=64)),
+                ('last_activity_at', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_read_id', models.PositiveIntegerField(default=0)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='Chat.group')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Chat.message')),
+                ('peer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Chat.user')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='Chat.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_activity_at', '-id'], name='conversation_inbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'user'), name='conversation_summary_unique')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
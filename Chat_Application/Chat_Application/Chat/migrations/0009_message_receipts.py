@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0008_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='last_delivered_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Whatever was read has been delivered
+        migrations.RunSQL(
+            'UPDATE "Chat_conversationsummary" SET last_delivered_id = last_read_id',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The old single reaction becomes a reaction by the message's sender, who was
+# the only one allowed to set it
+COPY_REACTIONS = [
+    """INSERT INTO "Chat_reaction" (message_id, user_id, emoji, created_at)
+       SELECT id, sender_id, SUBSTR(reaction, 1, 32), updated_at FROM "Chat_message"
+       WHERE reaction IS NOT NULL AND reaction != ''""",
+    """INSERT INTO "Chat_reactioncount" (message_id, emoji, count)
+       SELECT id, SUBSTR(reaction, 1, 32), 1 FROM "Chat_message"
+       WHERE reaction IS NOT NULL AND reaction != ''""",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0009_message_receipts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reactions', to='Chat.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reactions', to='Chat.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('message', 'user', 'emoji'), name='reaction_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReactionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reaction_counts', to='Chat.message')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('message', 'emoji'), name='reaction_count_unique')],
+            },
+        ),
+        migrations.RunSQL(COPY_REACTIONS, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='reaction',
+        ),
+    ]
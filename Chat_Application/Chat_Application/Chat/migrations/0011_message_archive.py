@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:31
+
+import Chat.storage
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0010_reactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('conversation', models.CharField(max_length=64)),
+                ('text', models.TextField(blank=True)),
+                ('attachment', models.FileField(blank=True, null=True, storage=Chat.storage.ContentAddressedStorage(), upload_to='message_attachments/')),
+                ('attachment_name', models.CharField(blank=True, default='', max_length=255)),
+                ('media_status', models.CharField(blank=True, default='', max_length=10)),
+                ('attachment_content_type', models.CharField(blank=True, default='', max_length=100)),
+                ('attachment_size', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('attachment_width', models.PositiveIntegerField(blank=True, null=True)),
+                ('attachment_height', models.PositiveIntegerField(blank=True, null=True)),
+                ('thumbnail', models.ImageField(blank=True, null=True, storage=Chat.storage.ContentAddressedStorage(), upload_to='message_thumbnails/')),
+                ('thumbnail_webp', models.ImageField(blank=True, null=True, storage=Chat.storage.ContentAddressedStorage(), upload_to='message_thumbnails/')),
+                ('reactions', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Chat.user')),
+                ('to_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Chat.group')),
+                ('to_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Chat.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation', 'created_at', 'id'], name='archive_conversation_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0012_user_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['attachment'], name='archive_attachment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['thumbnail'], name='archive_thumbnail_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['thumbnail_webp'], name='archive_thumbnail_webp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thumbnail'], name='message_thumbnail_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thumbnail_webp'], name='message_thumbnail_webp_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+"""
+PostgreSQL search folds accents like SQLite's FTS5 tokenizer does, so "cafe"
+finds "café" on both: a ``chat_search`` text search configuration (``simple``
+plus ``unaccent``) replaces ``simple`` in the GIN index. Nothing changes on
+SQLite. See Chat/search.py.
+"""
+from django.db import migrations
+
+POSTGRES_SCHEMA = [
+    # unaccent is a trusted extension (PostgreSQL 13+): the database owner may create it
+    'CREATE EXTENSION IF NOT EXISTS unaccent',
+    'DROP TEXT SEARCH CONFIGURATION IF EXISTS chat_search',
+    'CREATE TEXT SEARCH CONFIGURATION chat_search (COPY = simple)',
+    'ALTER TEXT SEARCH CONFIGURATION chat_search ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple',
+    'DROP INDEX IF EXISTS message_text_search_idx',
+    'CREATE INDEX message_text_search_idx ON "Chat_message" '
+    "USING gin (to_tsvector('chat_search', text)) WHERE NOT is_deleted",
+]
+POSTGRES_TEARDOWN = [
+    'DROP INDEX IF EXISTS message_text_search_idx',
+    'CREATE INDEX message_text_search_idx ON "Chat_message" '
+    "USING gin (to_tsvector('simple', text)) WHERE NOT is_deleted",
+    'DROP TEXT SEARCH CONFIGURATION IF EXISTS chat_search',
+]
+
+
+def fold_accents(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRES_SCHEMA:
+            schema_editor.execute(sql)
+
+
+def keep_accents(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRES_TEARDOWN:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0013_media_file_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_accents, keep_accents),
+    ]
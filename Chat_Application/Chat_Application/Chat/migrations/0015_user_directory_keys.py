@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:34
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def fold(text):
+    # Chat.models.fold as of this migration
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def fill_keys(apps, schema_editor):
+    """Fold the name and email of existing users, a thousand rows per UPDATE batch"""
+    User = apps.get_model('Chat', 'User')
+    users = []
+    for user in User.objects.only('name', 'email').iterator(chunk_size=1000):
+        user.name_key, user.email_key = fold(user.name), fold(user.email)
+        users.append(user)
+    User.objects.bulk_update(users, ['name_key', 'email_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0014_search_unaccent'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_name_lower_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_email_lower_idx',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='email_key',
+            field=models.CharField(default='', editable=False, max_length=762),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=450),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['name_key', 'id'], name='user_name_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email_key'], name='user_email_key_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0015_user_directory_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('media_status', 'pending')), fields=['updated_at'], name='message_media_pending_idx'),
+        ),
+    ]
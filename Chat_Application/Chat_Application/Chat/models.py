@@ -1,15 +1,58 @@
+import os
+import unicodedata
+import uuid
+from types import SimpleNamespace
+
 from django.db import models
 
+from .storage import blob_storage
+
 # Create your models here.
+def fold(text, accents=True):
+    """
+    ``text`` for case-insensitive comparison, folded in Python the same way on
+    every database. ``accents=False`` also drops diacritics, as the FTS5
+    tokenizer behind message search (Chat/search.py) does.
+    """
+    if text.isascii():
+        return text.lower()
+    if accents:
+        return unicodedata.normalize('NFKC', text).casefold()
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
 class User(models.Model):
     name = models.CharField(max_length=150, unique=True)
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=128)
     profile_photo = models.ImageField(upload_to='profile_photos/', null=True, blank=True)
+    # fold() of name and email, for the directory (Chat/directory.py); a fold
+    # can be up to three times longer than what it folds ('ß' -> 'ss')
+    name_key = models.CharField(max_length=450, editable=False, default='')
+    email_key = models.CharField(max_length=762, editable=False, default='')
 
     def __str__(self):
         return self.name
 
+    def assign_keys(self):
+        self.name_key = fold(self.name)
+        self.email_key = fold(self.email)
+
+    def save(self, *args, **kwargs):
+        self.assign_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'email'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'name_key', 'email_key'}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # The directory's order and its case-insensitive prefix search (Chat/directory.py)
+            models.Index(fields=['name_key', 'id'], name='user_name_key_idx'),
+            models.Index(fields=['email_key'], name='user_email_key_idx'),
+        ]
+
 class Group(models.Model):
     name = models.CharField(max_length=150, unique=True)
     members = models.ManyToManyField(User, related_name='groups')
@@ -19,17 +62,50 @@ class Group(models.Model):
     def __str__(self):
         return self.name
     
+def dm_conversation_key(user_a_id, user_b_id):
+    low, high = sorted((int(user_a_id), int(user_b_id)))
+    return f'u:{low}:{high}'
+
+
+def group_conversation_key(group_id):
+    return f'g:{group_id}'
+
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp']
+VIDEO_EXTENSIONS = ['mp4', 'webm', 'ogg', 'mov', 'avi']
+
+
 class Message(models.Model):
+    MEDIA_PENDING = 'pending'
+    MEDIA_READY = 'ready'
+    MEDIA_FAILED = 'failed'
+    MEDIA_STATUS_CHOICES = [
+        (MEDIA_PENDING, 'Pending'),
+        (MEDIA_READY, 'Ready'),
+        (MEDIA_FAILED, 'Failed'),
+    ]
+
     id = models.AutoField(primary_key=True)
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='messages')
     to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages', null=True, blank=True)
     to_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='messages',null=True, blank=True)
     text = models.TextField(blank=True)
-    attachment = models.FileField(upload_to='message_attachments/', null=True, blank=True)
+    attachment = models.FileField(upload_to='message_attachments/', storage=blob_storage, null=True, blank=True)
+    # The name it was uploaded under; the stored name is its content hash
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    # Filled in by the background media pipeline (Chat/attachments.py)
+    media_status = models.CharField(max_length=10, choices=MEDIA_STATUS_CHOICES, blank=True, default='')
+    attachment_content_type = models.CharField(max_length=100, blank=True, default='')
+    attachment_size = models.PositiveBigIntegerField(null=True, blank=True)
+    attachment_width = models.PositiveIntegerField(null=True, blank=True)
+    attachment_height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.ImageField(upload_to='message_thumbnails/', storage=blob_storage, null=True, blank=True)
+    thumbnail_webp = models.ImageField(upload_to='message_thumbnails/', storage=blob_storage, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    reaction = models.CharField(max_length=50, null=True, blank=True)
     is_deleted = models.BooleanField(default=False)
+    # Ordered user pair ("u:3:7") or group ("g:12"), so one index serves a whole conversation
+    conversation = models.CharField(max_length=64, editable=False, default='')
 
     def __str__(self):
         if self.to_group:
@@ -38,24 +114,44 @@ class Message(models.Model):
             return f'Message from {self.sender.name} to {self.to_user.name} at {self.created_at}'
         return f'Message from {self.sender.name} at {self.created_at}'
     
+    def assign_conversation(self):
+        if self.to_group_id:
+            self.conversation = group_conversation_key(self.to_group_id)
+        elif self.to_user_id:
+            self.conversation = dm_conversation_key(self.sender_id, self.to_user_id)
+
+    def save(self, *args, **kwargs):
+        self.assign_conversation()
+        if self.attachment and not self.attachment._committed:
+            self.attachment_name = os.path.basename(self.attachment.name)
+        super().save(*args, **kwargs)
+
+    def stored_files(self):
+        """Storage names of every file this message references."""
+        return [f.name for f in (self.attachment, self.thumbnail, self.thumbnail_webp) if f]
+
     @property
     def is_image(self):
         if not self.attachment:
             return False
+        if self.attachment_content_type:
+            return self.attachment_content_type.startswith('image/')
         ext = self.attachment.name.split('.')[-1].lower()
-        return ext in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp']
+        return ext in IMAGE_EXTENSIONS
     
     @property
     def is_video(self):
         if not self.attachment:
             return False
+        if self.attachment_content_type:
+            return self.attachment_content_type.startswith('video/')
         ext = self.attachment.name.split('.')[-1].lower()
-        return ext in ['mp4', 'webm', 'ogg', 'mov', 'avi']
+        return ext in VIDEO_EXTENSIONS
     
     @property
     def file_name(self):
         if self.attachment:
-            return self.attachment.name.split('/')[-1]
+            return self.attachment_name or self.attachment.name.split('/')[-1]
         return None
     
     class Meta:
@@ -64,4 +160,180 @@ class Message(models.Model):
             models.Index(fields=['to_user']),
             models.Index(fields=['to_group']),
             models.Index(fields=['created_at']),
-        ]
\ No newline at end of file
+            models.Index(
+                fields=['conversation', 'created_at', 'id'],
+                condition=models.Q(is_deleted=False),
+                name='message_conversation_live_idx',
+            ),
+            models.Index(fields=['conversation', 'updated_at', 'id'], name='message_conversation_sync_idx'),
+            # Finds an already-processed copy of a deduplicated file
+            models.Index(fields=['attachment'], name='message_attachment_idx'),
+            # With the one above, find who may read a file (see Chat/media.py)
+            models.Index(fields=['thumbnail'], name='message_thumbnail_idx'),
+            models.Index(fields=['thumbnail_webp'], name='message_thumbnail_webp_idx'),
+            # Attachments a stopped worker pool left behind (requeue_media); few rows at any time
+            models.Index(
+                fields=['updated_at'], condition=models.Q(media_status='pending'), name='message_media_pending_idx',
+            ),
+        ]
+
+
+# Columns an archived message keeps from the hot row (by attribute name)
+ARCHIVED_FIELDS = (
+    'id', 'sender_id', 'to_user_id', 'to_group_id', 'conversation', 'text', 'attachment', 'attachment_name',
+    'media_status', 'attachment_content_type', 'attachment_size', 'attachment_width', 'attachment_height',
+    'thumbnail', 'thumbnail_webp', 'created_at', 'updated_at',
+)
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of the hot table by ``archive_messages`` (see
+    Chat/archive.py): same id and content, its reactions frozen into
+    ``reactions`` (``{emoji: [user ids]}``). Read back through ``as_message``.
+    """
+    id = models.IntegerField(primary_key=True)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    to_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    conversation = models.CharField(max_length=64)
+    text = models.TextField(blank=True)
+    attachment = models.FileField(upload_to='message_attachments/', storage=blob_storage, null=True, blank=True)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    media_status = models.CharField(max_length=10, blank=True, default='')
+    attachment_content_type = models.CharField(max_length=100, blank=True, default='')
+    attachment_size = models.PositiveBigIntegerField(null=True, blank=True)
+    attachment_width = models.PositiveIntegerField(null=True, blank=True)
+    attachment_height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail = models.ImageField(upload_to='message_thumbnails/', storage=blob_storage, null=True, blank=True)
+    thumbnail_webp = models.ImageField(upload_to='message_thumbnails/', storage=blob_storage, null=True, blank=True)
+    reactions = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Archived message {self.id} in {self.conversation}'
+
+    def stored_files(self):
+        return [f.name for f in (self.attachment, self.thumbnail, self.thumbnail_webp) if f]
+
+    def as_message(self, custom_user=None):
+        """An unsaved ``Message`` carrying this row, so serializers and exports treat both tiers alike."""
+        message = Message(**{name: getattr(self, name) for name in ARCHIVED_FIELDS})
+        for relation in ('sender', 'to_user', 'to_group'):
+            if ArchivedMessage._meta.get_field(relation).is_cached(self):
+                setattr(message, relation, getattr(self, relation))
+        message.reaction_summary = [
+            SimpleNamespace(emoji=emoji, count=len(users), me=custom_user is not None and custom_user.id in users)
+            for emoji, users in self.reactions.items()
+        ]
+        return message
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'created_at', 'id'], name='archive_conversation_idx'),
+            models.Index(fields=['attachment'], name='archive_attachment_idx'),
+            models.Index(fields=['thumbnail'], name='archive_thumbnail_idx'),
+            models.Index(fields=['thumbnail_webp'], name='archive_thumbnail_webp_idx'),
+        ]
+
+
+class Reaction(models.Model):
+    """One user's emoji on a message; a user may put several different ones on it."""
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reactions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reactions')
+    emoji = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user} reacted {self.emoji} to message {self.message_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'user', 'emoji'], name='reaction_unique'),
+        ]
+
+
+class ReactionCount(models.Model):
+    """
+    How many users put ``emoji`` on ``message``, kept next to the Reaction
+    rows by Chat/reactions.py with in-database increments. Rows are never
+    deleted, a count of 0 just stops showing.
+    """
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reaction_counts')
+    emoji = models.CharField(max_length=32)
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.emoji} x{self.count} on message {self.message_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'emoji'], name='reaction_count_unique'),
+        ]
+
+
+class Upload(models.Model):
+    """A chunked attachment upload in progress; see Chat/uploads.py."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    size = models.PositiveBigIntegerField()
+    # Bytes [0, received) are on disk and verified
+    received = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.received}/{self.size})'
+
+    @property
+    def is_complete(self):
+        return self.received >= self.size
+
+
+class Blob(models.Model):
+    """One stored file in the content-addressed storage; see Chat/storage.py."""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    # Message file fields pointing at this blob; 0 means gc_blobs may remove it
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} refs)'
+
+
+class ConversationSummary(models.Model):
+    """
+    One row per user and conversation they take part in: what the inbox shows,
+    kept up to date by Chat/conversations.py as messages are written and read.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    conversation = models.CharField(max_length=64)
+    # The other side of a DM, or the group
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='summaries', null=True, blank=True)
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    last_activity_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+    # Watermarks: ids of the newest message this user has seen, and has
+    # received on some device; everything at or below them is read/delivered
+    last_read_id = models.PositiveIntegerField(default=0)
+    last_delivered_id = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user} in {self.conversation} ({self.unread_count} unread)'
+
+    class Meta:
+        constraints = [
+            # Conversation first, so it also serves the per-conversation updates
+            models.UniqueConstraint(fields=['conversation', 'user'], name='conversation_summary_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at', '-id'], name='conversation_inbox_idx'),
+        ]
@@ -0,0 +1,177 @@
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    raw = f'{timestamp.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn an opaque cursor back into its ``(timestamp, id)`` position."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        timestamp = datetime.fromisoformat(timestamp)
+        pk = int(pk)
+    except ValueError:
+        raise InvalidCursor('Invalid cursor')
+    if timezone.is_naive(timestamp):
+        raise InvalidCursor('Invalid cursor')
+    return timestamp, pk
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_after(field, timestamp, pk):
+    return Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk})
+
+
+def keyset_before(field, timestamp, pk):
+    return Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk})
+
+
+def _sync_cursor_query(qs):
+    return qs.order_by('-updated_at', '-id').values_list('updated_at', 'id')
+
+
+# Where an empty conversation's sync starts: before anything it will ever hold.
+# Not "now", which would skip a message committed later with an earlier timestamp.
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def high_water(timestamp, pk):
+    """
+    The cursor to poll ``since`` from once the change at ``(timestamp, pk)``
+    has been seen. ``updated_at`` is stamped before commit, so a transaction
+    still open at the poll can later commit a row stamped behind it; the
+    ``CHAT_SYNC_OVERLAP`` seconds before the change are read again for
+    those. Clients apply results by id, so the repeats are harmless.
+    """
+    overlap = getattr(settings, 'CHAT_SYNC_OVERLAP', 10)
+    if not overlap:
+        return encode_cursor(timestamp, pk)
+    return encode_cursor(timestamp - timedelta(seconds=overlap), 0)
+
+
+def _encode_sync_cursor(last):
+    if last is None:
+        return encode_cursor(EPOCH, 0)
+    return high_water(*last)
+
+
+def sync_cursor(qs):
+    """High-water mark of every change in ``qs``, for a later ``since=``."""
+    return _encode_sync_cursor(_sync_cursor_query(qs).first())
+
+
+async def async_sync_cursor(qs):
+    return _encode_sync_cursor(await _sync_cursor_query(qs).afirst())
+
+
+class PagePlan:
+    """
+    Keyset pagination over a conversation, split so the same plan can be
+    evaluated by sync and async views.
+
+    ``qs`` must contain every message of the conversation, soft-deleted ones
+    included: ``since`` hands those back so clients can drop them locally.
+    """
+
+    def __init__(self, qs, params):
+        self.limit = parse_limit(params.get('limit'))
+        self.since = params.get('since')
+        self.before = params.get('before')
+        self.after = params.get('after')
+        self.before_position = self.after_position = None
+        if self.since:
+            timestamp, pk = decode_cursor(self.since)
+            self.queryset = qs.filter(keyset_after('updated_at', timestamp, pk)).order_by('updated_at', 'id')
+        elif self.after:
+            self.after_position = decode_cursor(self.after)
+            self.queryset = qs.filter(is_deleted=False).filter(
+                keyset_after('created_at', *self.after_position)
+            ).order_by('created_at', 'id')
+        else:
+            page = qs.filter(is_deleted=False)
+            if self.before:
+                self.before_position = decode_cursor(self.before)
+                page = page.filter(keyset_before('created_at', *self.before_position))
+            self.queryset = page.order_by('-created_at', '-id')
+        # One extra row tells us whether there is another page
+        self.queryset = self.queryset[:self.limit + 1]
+
+    def merge(self, hot, cold):
+        """
+        Join hot rows with the archived ``cold`` ones (all older); None
+        means the cold tier was not read. ``after`` pages read cold first.
+        """
+        if cold is None:
+            return hot
+        return (cold + hot if self.after else hot + cold)[:self.limit + 1]
+
+    def finish(self, rows, sync=None):
+        """Trim the fetched rows and build the cursor metadata, page oldest first."""
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if self.since:
+            if not rows:
+                cursor = self.since
+            elif has_more:
+                # Mid-catch-up: continue exactly where this page stopped
+                cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+            else:
+                cursor = high_water(rows[-1].updated_at, rows[-1].id)
+            return rows, {'has_more': has_more, 'sync_cursor': cursor}
+        if self.after:
+            has_older, has_newer = True, has_more
+        else:
+            rows = rows[::-1]
+            has_older, has_newer = has_more, bool(self.before)
+        return rows, {
+            'has_more': has_more,
+            'before_cursor': encode_cursor(rows[0].created_at, rows[0].id) if rows and has_older else None,
+            'after_cursor': encode_cursor(rows[-1].created_at, rows[-1].id) if rows and has_newer else None,
+            'sync_cursor': sync,
+        }
+
+
+def paginate_messages(qs, params, cold=None):
+    """
+    Returns the page (oldest first) and the cursor metadata for the response.
+    ``cold(plan)`` gives the archived rows the page may continue into (see
+    Chat/archive.py), read with the same cursor, so every page costs the same
+    number of queries wherever it falls.
+    """
+    plan = PagePlan(qs, params)
+    cold_rows = cold(plan) if cold else None
+    rows = plan.merge(list(plan.queryset), None if cold_rows is None else list(cold_rows))
+    return plan.finish(rows, None if plan.since else sync_cursor(qs))
+
+
+async def apaginate_messages(qs, params, cold=None):
+    plan = PagePlan(qs, params)
+    cold_rows = cold(plan) if cold else None
+    hot = [row async for row in plan.queryset]
+    rows = plan.merge(hot, None if cold_rows is None else [row async for row in cold_rows])
+    return plan.finish(rows, None if plan.since else await async_sync_cursor(qs))
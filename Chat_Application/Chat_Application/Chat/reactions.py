@@ -0,0 +1,58 @@
+"""
+Message reactions.
+
+Each user's emoji is a ``Reaction`` row; ``ReactionCount`` keeps the total per
+message and emoji so lists never aggregate. Counts only change through
+``UPDATE ... SET count = count + 1`` (or - 1) in the transaction that adds or
+removes the Reaction row, so concurrent reactions never overwrite each other
+the way reading a count, adding one and saving it back would.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch
+
+from .models import Reaction, ReactionCount
+
+MAX_EMOJI_LENGTH = 32
+
+
+def add_reaction(message, custom_user, emoji):
+    """Put ``emoji`` on ``message`` for ``custom_user``; False if it was already there."""
+    try:
+        with transaction.atomic():
+            Reaction.objects.create(message=message, user=custom_user, emoji=emoji)
+            # A concurrent first reaction may create the row too; either way it exists afterwards
+            ReactionCount.objects.bulk_create([ReactionCount(message=message, emoji=emoji)], ignore_conflicts=True)
+            ReactionCount.objects.filter(message=message, emoji=emoji).update(count=F('count') + 1)
+    except IntegrityError:
+        return False
+    return True
+
+
+def remove_reaction(message, custom_user, emoji):
+    """Take ``custom_user``'s ``emoji`` off ``message``; False if it was not there."""
+    with transaction.atomic():
+        deleted, _ = Reaction.objects.filter(message=message, user=custom_user, emoji=emoji).delete()
+        if deleted:
+            ReactionCount.objects.filter(message=message, emoji=emoji, count__gt=0).update(count=F('count') - 1)
+    return bool(deleted)
+
+
+def prefetch_reactions(custom_user, lookup='reaction_counts'):
+    """
+    ``Prefetch`` loading the reaction counts of every message in a page, each
+    flagged with whether ``custom_user`` is among them: one query per page.
+    ``lookup`` reaches the counts from another model, e.g. through a foreign key.
+    """
+    mine = Reaction.objects.filter(message=OuterRef('message'), emoji=OuterRef('emoji'), user=custom_user)
+    counts = ReactionCount.objects.filter(count__gt=0).order_by('id')
+    if custom_user is not None:
+        counts = counts.annotate(me=Exists(mine))
+    return Prefetch(lookup, queryset=counts, to_attr='reaction_summary')
+
+
+def summarize(message, custom_user=None):
+    """``[{'emoji', 'count', 'me'}]`` for ``message``, from the prefetch when there is one."""
+    counts = getattr(message, 'reaction_summary', None)
+    if counts is None:
+        counts = prefetch_reactions(custom_user).queryset.filter(message=message)
+    return [{'emoji': c.emoji, 'count': c.count, 'me': getattr(c, 'me', False)} for c in counts]
@@ -0,0 +1,80 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+
+MESSAGE_CREATED = 'message.created'
+MESSAGE_UPDATED = 'message.updated'
+MESSAGE_DELETED = 'message.deleted'
+MESSAGE_REACTED = 'message.reacted'
+RECEIPTS_UPDATED = 'receipts.updated'
+
+
+def user_channel_group(user_id):
+    return f'user.{user_id}'
+
+
+def group_channel_group(group_id):
+    return f'group.{group_id}'
+
+
+def message_channel_groups(message):
+    """Channel groups that should hear about a change to ``message``."""
+    if message.to_group_id:
+        return [group_channel_group(message.to_group_id)]
+    groups = [user_channel_group(message.sender_id)]
+    if message.to_user_id and message.to_user_id != message.sender_id:
+        groups.append(user_channel_group(message.to_user_id))
+    return groups
+
+
+def conversation_channel_groups(conversation):
+    """Channel groups of everyone in the DM or group with key ``conversation``."""
+    kind, _, ids = conversation.partition(':')
+    if kind == 'g':
+        return [group_channel_group(ids)]
+    return [user_channel_group(user_id) for user_id in dict.fromkeys(ids.split(':'))]
+
+
+def _group_send(group, payload):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(group, payload)
+
+
+def publish_message_event(event, message, data):
+    """Fan out a serialized message to every connected participant."""
+    for group in message_channel_groups(message):
+        _group_send(group, {'type': 'chat.event', 'event': event, 'message': data})
+
+
+def publish_message_events(event, messages, data):
+    """``publish_message_event`` for a batch, entering the event loop once rather than per send."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    async def send_all():
+        for message, payload in zip(messages, data):
+            for group in message_channel_groups(message):
+                await channel_layer.group_send(group, {'type': 'chat.event', 'event': event, 'message': payload})
+
+    async_to_sync(send_all)()
+
+
+def publish_group_joined(group_id, member_ids):
+    """Ask the open sockets of people added to a group to subscribe to it."""
+    for member_id in member_ids:
+        _group_send(user_channel_group(member_id), {'type': 'chat.subscribe', 'group_id': group_id})
+
+
+def publish_group_left(group_id, member_ids):
+    """Ask the open sockets of people removed from a group (or whose group went away) to unsubscribe."""
+    for member_id in member_ids:
+        _group_send(user_channel_group(member_id), {'type': 'chat.unsubscribe', 'group_id': group_id})
+
+
+def publish_receipts(conversation, receipts):
+    """Tell a conversation whose read/delivered watermarks moved; ``receipts`` is a list of dicts."""
+    for group in conversation_channel_groups(conversation):
+        _group_send(group, {'type': 'chat.receipts', 'conversation': conversation, 'receipts': receipts})
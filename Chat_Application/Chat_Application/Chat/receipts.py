@@ -0,0 +1,219 @@
+"""
+Read and delivery receipts.
+
+State is kept as two watermarks per participant and conversation on
+``ConversationSummary`` (``last_delivered_id``/``last_read_id``): recipient R
+has read message M when R's read watermark is at least M's id. That is one
+row per member rather than one per member and message, and a client
+acknowledges a whole burst by reporting the newest id it has read.
+
+Acknowledgements are coalesced a second time on the server: ``ack_buffer``
+keeps only the highest watermarks per user and conversation in memory and
+writes them every ``CHAT_ACK_FLUSH_INTERVAL`` seconds in one batch (one
+UPDATE per changed summary sent with a single executemany, as
+``conversations.write_back`` does for new messages), so a busy group reading
+a burst costs a fixed number of round trips per flush instead of one per
+member and message. A flush that fails puts its watermarks back for the next
+one.
+"""
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from .conversations import write_back
+from .models import ConversationSummary, Message
+from .realtime import publish_receipts
+
+logger = logging.getLogger(__name__)
+
+
+class Receipts:
+    """Watermarks of everyone in one conversation, to count who has a message."""
+
+    def __init__(self, rows):
+        # rows: (user_id, last_delivered_id, last_read_id)
+        self.watermarks = {user_id: (delivered, read) for user_id, delivered, read in rows}
+        self._delivered = sorted(delivered for delivered, _ in self.watermarks.values())
+        self._read = sorted(read for _, read in self.watermarks.values())
+
+    def _at_least(self, marks, message_id):
+        return len(marks) - bisect_left(marks, message_id)
+
+    def for_message(self, message):
+        """``{'recipients', 'delivered', 'read'}`` counts for ``message``, its sender left out."""
+        delivered = self._at_least(self._delivered, message.id)
+        read = self._at_least(self._read, message.id)
+        recipients = len(self.watermarks)
+        own = self.watermarks.get(message.sender_id)
+        if own is not None:
+            recipients -= 1
+            delivered -= own[0] >= message.id
+            read -= own[1] >= message.id
+        return {'recipients': recipients, 'delivered': delivered, 'read': read}
+
+    def as_dict(self):
+        return {user_id: {'delivered': d, 'read': r} for user_id, (d, r) in self.watermarks.items()}
+
+
+def _watermark_rows(conversation):
+    return ConversationSummary.objects.filter(conversation=conversation).values_list(
+        'user_id', 'last_delivered_id', 'last_read_id',
+    )
+
+
+def load_receipts(conversation):
+    """``Receipts`` of the conversation with key ``conversation``, in one query."""
+    return Receipts(_watermark_rows(conversation))
+
+
+async def aload_receipts(conversation):
+    return Receipts([row async for row in _watermark_rows(conversation)])
+
+
+# Conversations per unread recount query; each adds a term to an OR that
+# SQLite parses as one nested expression, at most 1000 deep
+UNREAD_CHUNK_SIZE = 200
+
+
+def _unread_after(rows):
+    """
+    Recount unread messages for summaries whose read watermark stopped short
+    of the last message, with one query per ``UNREAD_CHUNK_SIZE``
+    conversations over the unread tails.
+    """
+    since = {}
+    for row in rows:
+        since[row.conversation] = min(since.get(row.conversation, row.last_read_id), row.last_read_id)
+    keys = list(since)
+    senders = defaultdict(list)
+    for start in range(0, len(keys), UNREAD_CHUNK_SIZE):
+        tails = Q()
+        for conversation in keys[start:start + UNREAD_CHUNK_SIZE]:
+            tails |= Q(conversation=conversation, id__gt=since[conversation])
+        for conversation, pk, sender_id in Message.objects.filter(tails, is_deleted=False).values_list(
+            'conversation', 'id', 'sender_id',
+        ):
+            senders[conversation].append((pk, sender_id))
+    for row in rows:
+        row.unread_count = sum(
+            1 for pk, sender_id in senders[row.conversation] if pk > row.last_read_id and sender_id != row.user_id
+        )
+
+
+def write_acks(acks):
+    """
+    Move watermarks forward in one transaction. ``acks`` maps
+    ``(user_id, conversation)`` to ``(delivered_id, read_id)``; watermarks
+    never move back and never pass the conversation's last message. Rows
+    that changed are announced per conversation once committed.
+    """
+    if not acks:
+        return []
+    users = {user_id for user_id, _ in acks}
+    keys = {conversation for _, conversation in acks}
+    with transaction.atomic():
+        rows = ConversationSummary.objects.select_for_update().filter(
+            conversation__in=keys, user_id__in=users,
+        ).only(
+            'user_id', 'conversation', 'last_message_id', 'unread_count', 'last_read_id', 'last_delivered_id',
+        )
+        changed, partial = [], []
+        for row in rows:
+            ack = acks.get((row.user_id, row.conversation))
+            if ack is None:
+                continue
+            top = row.last_message_id or 0
+            read = max(row.last_read_id, min(ack[1] or 0, top))
+            delivered = max(row.last_delivered_id, read, min(ack[0] or 0, top))
+            if (delivered, read) == (row.last_delivered_id, row.last_read_id):
+                continue
+            if read != row.last_read_id:
+                row.last_read_id = read
+                if read >= top:
+                    row.unread_count = 0
+                else:
+                    partial.append(row)
+            row.last_delivered_id = delivered
+            changed.append(row)
+        if partial:
+            _unread_after(partial)
+        write_back(changed, ['last_read_id', 'last_delivered_id', 'unread_count'])
+
+    moved = defaultdict(list)
+    for row in changed:
+        moved[row.conversation].append({
+            'user_id': row.user_id, 'delivered': row.last_delivered_id, 'read': row.last_read_id,
+        })
+    for conversation, receipts in moved.items():
+        publish_receipts(conversation, receipts)
+    return changed
+
+
+class AckBuffer:
+    """Keeps the highest acknowledged ids per user and conversation until the next flush."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def add(self, user_id, conversation, delivered=None, read=None):
+        with self._lock:
+            self._merge({(user_id, conversation): (delivered or 0, read or 0)})
+            inline = not self._schedule()
+        if inline:
+            self.flush()
+
+    def _merge(self, acks):
+        # Caller holds the lock; watermarks only move forward
+        for key, (delivered, read) in acks.items():
+            old_delivered, old_read = self._pending.get(key, (0, 0))
+            self._pending[key] = (max(old_delivered, delivered), max(old_read, read))
+
+    def _schedule(self):
+        # Caller holds the lock; False when flushes are not deferred
+        interval = getattr(settings, 'CHAT_ACK_FLUSH_INTERVAL', 1.0)
+        if interval <= 0:
+            return False
+        if self._timer is None:
+            self._timer = threading.Timer(interval, self._flush_in_thread)
+            self._timer.daemon = True
+            self._timer.start()
+        return True
+
+    def flush(self):
+        """
+        Write everything pending now; returns the summaries that moved. If the
+        write fails, the acks go back in the buffer for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        try:
+            return write_acks(pending)
+        except Exception:
+            with self._lock:
+                self._merge(pending)
+                self._schedule()
+            raise
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Writing read receipts failed; retrying at the next flush')
+        finally:
+            # The timer thread owns its connection; don't leak it, broken or not
+            close_old_connections()
+
+
+ack_buffer = AckBuffer()
+atexit.register(ack_buffer._flush_in_thread)
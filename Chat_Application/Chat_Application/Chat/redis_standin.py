@@ -0,0 +1,47 @@
+"""
+An in-process Redis stand-in for development and tests.
+
+``CHAT_CHANNEL_LAYER=fakeredis`` and ``CHAT_CACHE=fakeredis`` run the Redis
+code paths (the ``channels_redis`` fan-out, the throttle's Lua script)
+against ``fakeredis`` instead of a server: same clients, same commands, no
+process to start. Like ``memory`` and ``locmem`` it lives in one process, so
+it is no substitute for Redis in a deployment. Needs ``fakeredis[lua]``.
+"""
+
+_server = None
+
+
+def server():
+    """The one fake server both the cache and the channel layer talk to."""
+    global _server
+    if _server is None:
+        import fakeredis
+
+        _server = fakeredis.FakeServer()
+    return _server
+
+
+def client():
+    """A plain client on the fake server, to look at or reset what the app left there."""
+    import fakeredis
+
+    return fakeredis.FakeRedis(server=server())
+
+
+def cache_config():
+    import fakeredis
+
+    return {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://fakeredis/0',
+        'OPTIONS': {'connection_class': fakeredis.FakeConnection, 'server': server()},
+    }
+
+
+def channel_layer_config(capacity):
+    from fakeredis.aioredis import FakeConnection
+
+    return {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [{'connection_class': FakeConnection, 'server': server()}], 'capacity': capacity},
+    }
@@ -0,0 +1,31 @@
+"""
+JSON rendering with orjson.
+
+The API's default renderer: it writes the same JSON as DRF's
+``JSONRenderer`` in a fraction of the time, which is most of the cost of a
+large history page once its rows are serialized. Datetimes are written
+natively (UTC as ``Z``, as DRF does), integer dict keys become strings, and
+anything orjson does not know (lazy translations, Decimals, ...) goes
+through DRF's encoder.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+_fallback = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = OPTIONS
+        # orjson only indents by two; any requested indent gets that
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=_fallback, option=options)
+        # Like JSONRenderer, keep the output a strict JavaScript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -0,0 +1,224 @@
+"""
+Read replicas.
+
+``ReplicaRoutingMiddleware`` decides per request where reads go: GET/HEAD
+requests under ``CHAT_REPLICA_PATHS`` (history, exports, search, the user,
+group and conversation lists) read from one of ``CHAT_DB_REPLICAS``, and
+everything else, including every write, uses ``default``.
+``ReplicaRouter`` applies that choice to each query.
+
+Two things send a read back to the primary:
+
+* Read-your-writes: a successful write pins its client (the Authorization
+  header, else the session) to the primary for ``CHAT_REPLICA_PIN_SECONDS``,
+  so a sender's next history fetch already has their message. Pins live in
+  the ``default`` cache, which must be shared (``CHAT_CACHE=redis``) when
+  more than one server process handles requests.
+* Lag: ``replica_monitor`` asks each replica how far behind it is at most
+  every ``CHAT_REPLICA_CHECK_INTERVAL`` seconds, and skips those more than
+  ``CHAT_REPLICA_MAX_LAG`` seconds behind or unreachable.
+"""
+import contextvars
+import hashlib
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+_read_alias = contextvars.ContextVar('chat_read_alias', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# On a standby, lag is how long ago the last replayed transaction committed,
+# unless everything received has been replayed (an idle primary is not lag)
+POSTGRES_LAG = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def replica_lag(alias):
+    """Seconds ``alias`` is behind the primary; 0 where the backend can't tell."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRES_LAG)
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaMonitor:
+    """Remembers, per process, which replicas were recently close enough to the primary."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}  # alias -> (checked_at, lag or None when unreachable)
+
+    def record(self, alias, lag):
+        with self._lock:
+            self._checked[alias] = (time.monotonic(), lag)
+
+    def clear(self):
+        with self._lock:
+            self._checked.clear()
+
+    def _lag(self, alias):
+        interval = getattr(settings, 'CHAT_REPLICA_CHECK_INTERVAL', 5)
+        with self._lock:
+            checked = self._checked.get(alias)
+        if checked is not None and time.monotonic() - checked[0] < interval:
+            return checked[1]
+        try:
+            lag = replica_lag(alias)
+        except DatabaseError:
+            logger.warning('Replica %s is unreachable; reading from the primary', alias)
+            lag = None
+        self.record(alias, lag)
+        return lag
+
+    def healthy(self):
+        max_lag = getattr(settings, 'CHAT_REPLICA_MAX_LAG', 2)
+        aliases = getattr(settings, 'CHAT_DB_REPLICAS', [])
+        return [alias for alias in aliases if (lag := self._lag(alias)) is not None and lag <= max_lag]
+
+
+replica_monitor = ReplicaMonitor()
+
+
+def _client_key(request):
+    credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'chat:primary-pin:' + hashlib.sha256(credentials.encode()).hexdigest()[:32]
+
+
+def _pinned(request):
+    key = _client_key(request)
+    return key is not None and cache.get(key) is not None
+
+
+def pin_to_primary(request):
+    """Read from the primary for this client's next ``CHAT_REPLICA_PIN_SECONDS``."""
+    key = _client_key(request)
+    if key is not None:
+        cache.set(key, 1, getattr(settings, 'CHAT_REPLICA_PIN_SECONDS', 5))
+
+
+async def apin_to_primary(request):
+    key = _client_key(request)
+    if key is not None:
+        await cache.aset(key, 1, getattr(settings, 'CHAT_REPLICA_PIN_SECONDS', 5))
+
+
+def choose_read_alias(request):
+    """The replica alias ``request`` should read from, or None for the primary."""
+    if request.method not in SAFE_METHODS or not getattr(settings, 'CHAT_DB_REPLICAS', None):
+        return None
+    if not request.path.startswith(tuple(getattr(settings, 'CHAT_REPLICA_PATHS', ()))):
+        return None
+    if _pinned(request):
+        return None
+    healthy = replica_monitor.healthy()
+    return random.choice(healthy) if healthy else None
+
+
+def _read_from(alias, content):
+    # Streamed exports query while the body is sent, after the view returned
+    iterator = iter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+async def _aread_from(alias, content):
+    iterator = aiter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        alias = choose_read_alias(request)
+        token = _read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        if alias is not None and response.streaming and not response.is_async:
+            response.streaming_content = _read_from(alias, response.streaming_content)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(request)
+        return response
+
+    async def __acall__(self, request):
+        # Choosing may check replica lag over the network; skip the thread when there are no replicas
+        alias = None
+        if getattr(settings, 'CHAT_DB_REPLICAS', None):
+            alias = await sync_to_async(choose_read_alias)(request)
+        token = _read_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        if alias is not None and response.streaming:
+            read = _aread_from if response.is_async else _read_from
+            response.streaming_content = read(alias, response.streaming_content)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            await apin_to_primary(request)
+        return response
+
+
+class ReplicaRouter:
+    """
+    Chat reads go where the middleware said. Accounts and sessions (and
+    every write and migration) stay on ``default``, so a fresh login or
+    signup is never looked up on a replica that hasn't caught up.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'Chat':
+            return None
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
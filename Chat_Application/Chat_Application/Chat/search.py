@@ -0,0 +1,212 @@
+"""
+Full-text message search.
+
+SQLite keeps an FTS5 index (``chat_message_fts``) over ``Chat_message.text``;
+PostgreSQL uses a GIN index on ``to_tsvector('chat_search', text)``, whose
+configuration adds ``unaccent`` to ``simple`` so that, as with FTS5's
+``remove_diacritics``, "cafe" finds "café". Both cover live messages only and
+are maintained by the database itself (triggers on SQLite, an expression
+index on PostgreSQL), so every write path, the views' create/edit/soft-delete
+as well as bulk and admin writes, stays in sync without a rebuild. They are
+created by migrations 0007_message_search and 0014_search_unaccent.
+
+The index only finds matches; ranking (BM25) and highlighting happen here, on
+a bounded window of the newest matches, so both backends rank the same way.
+"""
+import html
+import importlib
+import math
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Message, fold
+
+FTS_TABLE = 'chat_message_fts'
+MAX_TERMS = 8
+MIN_PREFIX = 3
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+# Text search configuration of the PostgreSQL index: 'simple' plus unaccent (migration 0014)
+TS_CONFIG = 'chat_search'
+
+
+def terms(query):
+    """Folded words of ``query``; operators and punctuation are dropped."""
+    return [fold(t, accents=False) for t in _TERM.findall(query or '')][:MAX_TERMS]
+
+
+def _fts5_query(words):
+    # Every word must match; the last one may be unfinished (search as you type).
+    # Prefixes of 3-4 letters hit the FTS5 prefix index, shorter ones match whole words
+    quoted = [f'"{w}"' for w in words]
+    if len(words[-1]) >= MIN_PREFIX:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _tsquery(words):
+    last = f'{words[-1]}:*' if len(words[-1]) >= MIN_PREFIX else words[-1]
+    return ' & '.join(words[:-1] + [last])
+
+
+def _scope_sql(custom_user, conversation, group_ids):
+    if conversation:
+        return 'm.conversation = %s', [conversation]
+    clauses = ['(m.to_group_id IS NULL AND (m.sender_id = %s OR m.to_user_id = %s))']
+    params = [custom_user.id, custom_user.id]
+    if group_ids:
+        clauses.append(f'm.to_group_id IN ({", ".join(["%s"] * len(group_ids))})')
+        params += list(group_ids)
+    return f'({" OR ".join(clauses)})', params
+
+
+def _candidates(db, words, scope, scope_params, window):
+    """Newest ``window`` live matches within scope on connection ``db``, as ``(id, text)`` rows."""
+    if db.vendor == 'sqlite':
+        sql = f"""
+            SELECT m.id, m.text
+            FROM {FTS_TABLE} JOIN Chat_message m ON m.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND {scope}
+            ORDER BY {FTS_TABLE}.rowid DESC
+            LIMIT %s
+        """
+        params = [_fts5_query(words), *scope_params, window]
+    elif db.vendor == 'postgresql':
+        sql = f"""
+            SELECT m.id, m.text
+            FROM "Chat_message" m
+            WHERE to_tsvector('{TS_CONFIG}', m.text) @@ to_tsquery('{TS_CONFIG}', %s) AND NOT m.is_deleted
+                AND {scope}
+            ORDER BY m.id DESC
+            LIMIT %s
+        """
+        params = [_tsquery(words), *scope_params, window]
+    else:
+        raise NotImplementedError(f'Message search is not available on {db.vendor}')
+    with db.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def text_match(query):
+    """``Q`` matching live messages whose text contains every word of ``query``, unranked."""
+    words = terms(query)
+    if not words:
+        return Q(pk__in=[])
+    vendor = connections[router.db_for_read(Message)].vendor
+    if vendor == 'sqlite':
+        sql, param = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', _fts5_query(words)
+    elif vendor == 'postgresql':
+        sql = f'SELECT id FROM "Chat_message" WHERE to_tsvector(\'{TS_CONFIG}\', text) @@ to_tsquery(\'{TS_CONFIG}\', %s)'
+        param = _tsquery(words)
+    else:
+        return Q(text__icontains=query)
+    return Q(pk__in=RawSQL(sql, [param]))
+
+
+def _matcher(words):
+    exact = set(words[:-1])
+    last = words[-1]
+    prefix = len(last) >= MIN_PREFIX
+
+    def match(token):
+        if token in exact:
+            return token
+        if token == last or (prefix and token.startswith(last)):
+            return last
+        return None
+    return match
+
+
+def _score(counts, length, weights, avg_length, k1=1.2, b=0.75):
+    """BM25 of one message from its per-term ``counts``, using candidate-set IDF ``weights``."""
+    norm = k1 * (1 - b + b * length / avg_length)
+    return sum(weights[term] * tf * (k1 + 1) / (tf + norm) for term, tf in counts.items())
+
+
+def rank(rows, words):
+    """
+    Order candidate ``(id, text)`` rows best first, newest first among equals.
+    Document frequencies come from the candidates themselves, which keeps the
+    cost proportional to the window rather than to how common a word is.
+    """
+    match = _matcher(words)
+    # One C-level scan per message finds the candidate hits; _matcher maps them to terms
+    alternatives = [re.escape(w) for w in words[:-1]]
+    alternatives.append(re.escape(words[-1]) + (r'\w*' if len(words[-1]) >= MIN_PREFIX else ''))
+    pattern = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b')
+    documents = []
+    frequency = dict.fromkeys(words, 0)
+    for pk, text in rows:
+        folded = fold(text, accents=False)
+        counts = {}
+        for token in pattern.findall(folded):
+            term = match(token)
+            if term:
+                counts[term] = counts.get(term, 0) + 1
+        for term in counts:
+            frequency[term] += 1
+        # Length only normalises the score; counting spaces is close enough and much cheaper
+        documents.append((pk, folded.count(' ') + 1, counts))
+    total = len(documents) or 1
+    weights = {term: math.log((total - df + 0.5) / (df + 0.5) + 1) for term, df in frequency.items()}
+    avg_length = sum(length for _, length, _ in documents) / total or 1
+    scored = [(_score(counts, length, weights, avg_length), pk) for pk, length, counts in documents]
+    scored.sort(reverse=True)
+    return [pk for _, pk in scored]
+
+
+def highlight(text, words):
+    """``text`` as HTML with the words matching the query wrapped in ``<mark>``."""
+    match = _matcher(words)
+    parts, last = [], 0
+    for found in _TERM.finditer(text):
+        if match(fold(found.group(), accents=False)):
+            parts.append(html.escape(text[last:found.start()]))
+            parts.append(f'<mark>{html.escape(found.group())}</mark>')
+            last = found.end()
+    parts.append(html.escape(text[last:]))
+    return ''.join(parts)
+
+
+def search_messages(custom_user, query, conversation=None, limit=20, offset=0):
+    """
+    Best matches for ``query`` among the live messages ``custom_user`` can
+    see (or just ``conversation``), as ``(message, highlight_html)`` pairs.
+
+    The index finds the newest ``CHAT_SEARCH_WINDOW`` matches and only those
+    are ranked: scoring every hit of a very common word is what makes
+    full-text search slow, and in a chat the recent hits are the ones people
+    look for. Fetches one extra row so callers can tell whether there are more.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    group_ids = [] if conversation else list(custom_user.groups.values_list('id', flat=True))
+    scope, scope_params = _scope_sql(custom_user, conversation, group_ids)
+    window = max(getattr(settings, 'CHAT_SEARCH_WINDOW', 500), offset + limit + 1)
+    # Candidates and rows from the same database: a lagging replica would silently drop hits
+    using = router.db_for_read(Message)
+    ranked = rank(_candidates(connections[using], words, scope, scope_params, window), words)
+    ranked = ranked[offset:offset + limit + 1]
+    messages = Message.objects.using(using).select_related('sender').in_bulk(ranked)
+    return [(messages[pk], highlight(messages[pk].text, words)) for pk in ranked if pk in messages]
+
+
+def ensure_search_triggers(using='default', **kwargs):
+    """
+    ``post_migrate`` hook: put the FTS5 sync triggers back if a table rebuild
+    dropped them, as migration 0007 created them (its copy is the only one).
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    with db.cursor() as cursor:
+        if FTS_TABLE not in db.introspection.table_names(cursor):
+            return
+        for sql in importlib.import_module('Chat.migrations.0007_message_search').SQLITE_TRIGGERS:
+            cursor.execute(sql)
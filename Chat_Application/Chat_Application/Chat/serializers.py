@@ -1,6 +1,11 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Group, Message, User as CustomUser
+import re
+
+from .models import ConversationSummary, Group, Message, Upload, User as CustomUser
+from .reactions import summarize
+from .uploads import max_size
 
 
 AuthUser = get_user_model()
@@ -47,24 +52,48 @@ class MessageSerializer(serializers.ModelSerializer):
     file_name = serializers.SerializerMethodField()
     is_image = serializers.SerializerMethodField()
     is_video = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    thumbnail_webp_url = serializers.SerializerMethodField()
+    receipt = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'sender', 'to_user', 'to_group', 'text', 'attachment', 'attachment_url', 'file_name', 'is_image', 'is_video', 'reaction', 'is_deleted', 'created_at', 'updated_at']
-        read_only_fields = ['sender', 'is_deleted', 'created_at', 'updated_at']
-
-    def get_attachment_url(self, obj):
-        if obj.attachment:
+        fields = ['id', 'sender', 'to_user', 'to_group', 'text', 'attachment', 'attachment_url', 'file_name', 'is_image', 'is_video',
+                  'thumbnail_url', 'thumbnail_webp_url', 'media_status', 'attachment_content_type', 'attachment_size',
+                  'attachment_width', 'attachment_height', 'reactions', 'is_deleted', 'created_at', 'updated_at',
+                  'receipt']
+        read_only_fields = ['sender', 'is_deleted', 'created_at', 'updated_at', 'media_status', 'attachment_content_type',
+                            'attachment_size', 'attachment_width', 'attachment_height']
+
+    def _file_url(self, field):
+        if field:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.attachment.url)
-            return obj.attachment.url
+                return request.build_absolute_uri(field.url)
+            return field.url
         return None
 
+    def get_attachment_url(self, obj):
+        return self._file_url(obj.attachment)
+
+    def get_thumbnail_url(self, obj):
+        return self._file_url(obj.thumbnail)
+
+    def get_thumbnail_webp_url(self, obj):
+        return self._file_url(obj.thumbnail_webp)
+
     def get_file_name(self, obj):
-        if obj.attachment:
-            return obj.attachment.name.split('/')[-1]
-        return None
+        return obj.file_name
+
+    def get_reactions(self, obj):
+        return summarize(obj, self.context.get('custom_user'))
+
+    def get_receipt(self, obj):
+        # How many recipients have it delivered/read; needs the conversation's
+        # watermarks in the context (see Chat/receipts.py), None without them
+        receipts = self.context.get('receipts')
+        return receipts.for_message(obj) if receipts else None
 
     def get_is_image(self, obj):
         return obj.is_image if hasattr(obj, 'is_image') else False
@@ -83,3 +112,73 @@ class MessageSerializer(serializers.ModelSerializer):
         validated_data['sender'] = self.context['custom_user']
         return super().create(validated_data)
 
+
+class BulkMessageItemSerializer(serializers.Serializer):
+    """One text message of a bulk send; recipients are checked for the whole batch at once."""
+    to_user = serializers.IntegerField(required=False, allow_null=True)
+    to_group = serializers.IntegerField(required=False, allow_null=True)
+    text = serializers.CharField()
+
+    def validate(self, attrs):
+        if bool(attrs.get('to_user')) == bool(attrs.get('to_group')):
+            raise serializers.ValidationError("Provide either to_user or to_group (but not both).")
+        return attrs
+
+
+class BulkMessageSerializer(serializers.Serializer):
+    messages = BulkMessageItemSerializer(many=True, allow_empty=False)
+
+    def validate_messages(self, value):
+        limit = getattr(settings, 'CHAT_BULK_MAX_MESSAGES', 1000)
+        if len(value) > limit:
+            raise serializers.ValidationError(f'At most {limit} messages per request.')
+        return value
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    """An inbox entry; ``type`` and ``id`` name it the way ``user_id``/``group_id`` do elsewhere."""
+    type = serializers.SerializerMethodField()
+    id = serializers.SerializerMethodField()
+    name = serializers.SerializerMethodField()
+    peer = ChatUserSerializer(read_only=True)
+    last_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = ConversationSummary
+        fields = ['type', 'id', 'name', 'conversation', 'peer', 'last_message', 'last_activity_at', 'unread_count',
+                  'last_read_id']
+
+    def get_type(self, obj):
+        return 'group' if obj.group_id else 'user'
+
+    def get_id(self, obj):
+        return obj.group_id or obj.peer_id
+
+    def get_name(self, obj):
+        return obj.group.name if obj.group_id else obj.peer.name
+
+
+class UploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Upload
+        fields = ['id', 'file_name', 'content_type', 'size', 'received', 'sha256', 'created_at', 'updated_at']
+        read_only_fields = ['received', 'created_at', 'updated_at']
+
+    def validate_file_name(self, value):
+        # Only the base name is kept; storage picks the directory
+        name = value.replace('\\', '/').split('/')[-1]
+        if not name:
+            raise serializers.ValidationError('A file name is required.')
+        return name
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Size must be positive.')
+        if value > max_size():
+            raise serializers.ValidationError(f'Files may be at most {max_size()} bytes.')
+        return value
+
+    def validate_sha256(self, value):
+        if value and not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+            raise serializers.ValidationError('Expected a hex SHA-256 digest.')
+        return value.lower()
@@ -0,0 +1,96 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import caching
+from .auth import chat_user_cache
+from .models import ArchivedMessage, Group, Message, User as CustomUser
+from .realtime import publish_group_joined, publish_group_left
+from .storage import release
+
+Membership = Group.members.through
+
+
+def _members_of(group_ids):
+    return set(Membership.objects.filter(group_id__in=group_ids).values_list('user_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_chat_user(sender, instance, **kwargs):
+    chat_user_cache.invalidate_chat_user(instance.id)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_auth_user(sender, instance, **kwargs):
+    # Signup or an email change can point the account at a different chat user
+    chat_user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_lists(sender, instance, created, **kwargs):
+    caching.invalidate_users()
+    if not created:
+        # Group payloads embed their members' names and photos
+        caching.invalidate_groups(_members_of(instance.groups.values('id')))
+
+
+@receiver(pre_delete, sender=CustomUser)
+def invalidate_lists_of_removed_user(sender, instance, **kwargs):
+    # Memberships are gone by post_delete; collect who shares a group now
+    caching.invalidate_users()
+    caching.invalidate_groups(_members_of(instance.groups.values('id')))
+
+
+@receiver(post_save, sender=Group)
+def invalidate_renamed_group(sender, instance, created, **kwargs):
+    # A new group has no members yet; adding them invalidates through m2m_changed
+    if not created:
+        caching.invalidate_groups(_members_of([instance.id]))
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_removed_group(sender, instance, **kwargs):
+    members = _members_of([instance.id])
+    caching.invalidate_groups(members)
+    transaction.on_commit(partial(publish_group_left, instance.id, members))
+
+
+@receiver(m2m_changed, sender=Membership)
+def invalidate_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    """Everyone in a group whose members changed, including those who left, sees a new list."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # user.groups.add(...): instance is the user, pk_set the groups
+        group_ids = pk_set if action != 'pre_clear' else instance.groups.values('id')
+        affected = {instance.pk}
+    else:
+        group_ids = [instance.pk]
+        affected = set(pk_set or ())
+    caching.invalidate_groups(affected | _members_of(group_ids))
+
+
+@receiver(m2m_changed, sender=Membership)
+def resubscribe_sockets(sender, instance, action, reverse, pk_set, **kwargs):
+    """Open sockets join a group when their user is added and leave it when removed, once that commits."""
+    if action == 'pre_clear':
+        # pk_set is empty for clear(); take the memberships about to go
+        action = 'post_remove'
+        pk_set = set(instance.groups.values_list('id', flat=True)) if reverse else _members_of([instance.pk])
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    publish = publish_group_joined if action == 'post_add' else publish_group_left
+    if reverse:
+        for group_id in pk_set:
+            transaction.on_commit(partial(publish, group_id, [instance.pk]))
+    else:
+        transaction.on_commit(partial(publish, instance.pk, set(pk_set)))
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=ArchivedMessage)
+def release_message_files(sender, instance, **kwargs):
+    release(*instance.stored_files())
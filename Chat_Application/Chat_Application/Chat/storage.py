@@ -0,0 +1,71 @@
+"""
+Content-addressed storage for message files.
+
+Every file is stored once under its SHA-256 (``blobs/ab/cd/<sha256>.<ext>``)
+and a ``Blob`` row counts the fields pointing at it, so an image forwarded to
+twenty groups takes the disk space of one. References are taken when a file
+is saved and released when a message drops it; ``gc_blobs`` removes blobs
+nobody references any more.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'blobs'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def blob_name(self, digest, name):
+        ext = os.path.splitext(name)[1].lower()[:16]
+        return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        blob = self.blob_name(digest.hexdigest(), name)
+        if not self.exists(blob):
+            stored = super()._save(blob, content)
+            if stored != blob:
+                # Someone stored the same bytes in the meantime; keep theirs
+                self.delete(stored)
+        add_reference(blob, self.size(blob))
+        return blob
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_PREFIX}/')
+
+
+def add_reference(name, size=None):
+    from .models import Blob
+
+    if not is_blob(name):
+        return
+    if size is None:
+        size = blob_storage.size(name)
+    _, created = Blob.objects.get_or_create(name=name, defaults={'size': size, 'ref_count': 1})
+    if not created:
+        Blob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+
+
+def release(*names):
+    """Drop one reference to each blob in ``names``; the files stay until ``gc_blobs``."""
+    from .models import Blob
+
+    names = [name for name in names if is_blob(name)]
+    if names:
+        Blob.objects.filter(name__in=names).update(ref_count=F('ref_count') - 1, updated_at=timezone.now())
@@ -1,3 +1,1745 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import pstats
+import runpy
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, router, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, force_authenticate
+
+from . import conversations, reactions, receipts, redis_standin, throttling
+from .attachments import schedule_processing
+from .async_views import AsyncMessageListCreateView
+from .consumers import SLOW_CONSUMER, ChatConsumer, JWTQueryAuthMiddleware
+from .media import MediaView
+from .metrics import MetricsMiddleware, metrics
+from .auth import CHAT_USER_CLAIM, chat_user_cache, get_chat_user, tokens_for
+from .models import (
+    ArchivedMessage, Blob, ConversationSummary, Group, Message, Reaction, ReactionCount, Upload, User as CustomUser,
+    dm_conversation_key, group_conversation_key,
+)
+from .realtime import MESSAGE_CREATED, publish_message_event
+from .renderers import ORJSONRenderer
+from .routing import websocket_urlpatterns
+from .routers import ReplicaRoutingMiddleware, replica_monitor
+from .search import ensure_search_triggers, text_match
+from .serializers import ChatUserSerializer, MessageSerializer
+from .views import conversation_messages, parse_conversation
+from Chat_Application import settings as settings_module
+
+
+class QueryCountTestCase(APITestCase):
+    """
+    Query-count regression harness: every list endpoint must issue the same
+    number of queries whether it returns one row or many.
+    """
+
+    def setUp(self):
+        cache.clear()  # rate-limit buckets too
+        self.auth_user = get_user_model().objects.create_user(
+            username='me@example.com', email='me@example.com', password='pass'
+        )
+        self.me = CustomUser.objects.create(name='me', email='me@example.com', password='!')
+        self.peer = CustomUser.objects.create(name='peer', email='peer@example.com', password='!')
+        self.client.force_authenticate(self.auth_user)
+
+    def make_users(self, count, prefix):
+        start = CustomUser.objects.count()
+        users = [
+            CustomUser(name=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password='!')
+            for i in range(start, start + count)
+        ]
+        for user in users:
+            user.assign_keys()
+        return CustomUser.objects.bulk_create(users)
+
+    def count_queries(self, path, params=None):
+        # Measure the cold path, including the chat user lookup
+        chat_user_cache.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, params or {})
+            if response.streaming:
+                # Streaming responses only hit the database while being consumed
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertQueryCountStable(self, grow, path, params=None, expected=None):
+        """Call ``grow()`` between two requests and check the query count holds."""
+        small = self.count_queries(path, params)
+        grow()
+        large = self.count_queries(path, params)
+        self.assertEqual(small, large, f'{path} issued {large} queries after growing, {small} before')
+        if expected is not None:
+            self.assertEqual(large, expected)
+
+
+class MessageQueryCountTests(QueryCountTestCase):
+
+    def send_dms(self, count):
+        for _ in range(count):
+            Message.objects.create(sender=self.me, to_user=self.peer, text='hi')
+            Message.objects.create(sender=self.peer, to_user=self.me, text='hello')
+
+    def test_dm_history(self):
+        self.send_dms(1)
+        self.assertQueryCountStable(lambda: self.send_dms(30), '/api/messages/', {'user_id': self.peer.id}, expected=6)
+
+    def test_group_history(self):
+        group = Group.objects.create(name='room', owner=self.me)
+
+        def grow():
+            members = self.make_users(20, 'member')
+            group.members.add(*members)
+            for member in members:
+                Message.objects.create(sender=member, to_group=group, text='hello')
+
+        group.members.add(self.me)
+        Message.objects.create(sender=self.me, to_group=group, text='first')
+        self.assertQueryCountStable(grow, '/api/messages/', {'group_id': group.id}, expected=7)
+
+    def test_export(self):
+        group = Group.objects.create(name='room', owner=self.me)
+        group.members.add(self.me)
+        Message.objects.create(sender=self.me, to_group=group, text='first')
+
+        def grow():
+            for member in self.make_users(20, 'member'):
+                group.members.add(member)
+                Message.objects.create(sender=member, to_group=group, text='hello')
+
+        self.assertQueryCountStable(grow, '/api/messages/export/', {'group_id': group.id}, expected=5)
+        self.assertQueryCountStable(
+            grow, '/api/messages/export/', {'group_id': group.id, 'output': 'ndjson', 'compress': 'gzip'}, expected=5
+        )
+
+
+class ConversationKeyTests(QueryCountTestCase):
+
+    def test_dm_key_is_the_same_from_both_sides(self):
+        key, group_id = parse_conversation(self.me, {'user_id': str(self.peer.id)})
+        self.assertEqual(key, f'u:{min(self.me.id, self.peer.id)}:{max(self.me.id, self.peer.id)}')
+        self.assertIsNone(group_id)
+        self.assertEqual(parse_conversation(self.peer, {'user_id': self.me.id})[0], key)
+
+    def test_group_key_and_membership(self):
+        group = Group.objects.create(name='room', owner=self.me)
+        key, group_id = parse_conversation(self.me, {'group_id': str(group.id)})
+        self.assertEqual((key, group_id), (f'g:{group.id}', group.id))
+        with self.assertRaises(PermissionDenied):
+            conversation_messages(self.me, key, group_id)
+        group.members.add(self.me)
+        message = Message.objects.create(sender=self.me, to_group=group, text='hi')
+        self.assertEqual(list(conversation_messages(self.me, key, group_id)), [message])
+
+    def test_bad_params(self):
+        for params in ({}, {'user_id': 'x'}, {'group_id': 'x'}):
+            with self.assertRaises(ParseError):
+                parse_conversation(self.me, params)
+        response = self.client.get('/api/messages/', {'group_id': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConversationBackfillMigrationTests(TransactionTestCase):
+    """Migration 0003 keys the rows that existed before it."""
+    before = [('Chat', '0002_user_alter_message_options_message_attachment_and_more')]
+    after = [('Chat', '0003_message_conversation')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        OldUser, OldGroup, OldMessage = (apps.get_model('Chat', name) for name in ('User', 'Group', 'Message'))
+        low = OldUser.objects.create(name='low', email='low@example.com', password='!')
+        high = OldUser.objects.create(name='high', email='high@example.com', password='!')
+        group = OldGroup.objects.create(name='room', owner=low)
+        ids = {
+            'to_low': OldMessage.objects.create(sender=high, to_user=low, text='a').id,
+            'to_high': OldMessage.objects.create(sender=low, to_user=high, text='b').id,
+            'group': OldMessage.objects.create(sender=high, to_group=group, text='c').id,
+        }
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        Migrated = executor.loader.project_state(self.after).apps.get_model('Chat', 'Message')
+        keys = dict(Migrated.objects.values_list('id', 'conversation'))
+        self.assertEqual(keys[ids['to_low']], dm_conversation_key(low.id, high.id))
+        self.assertEqual(keys[ids['to_high']], dm_conversation_key(low.id, high.id))
+        self.assertEqual(keys[ids['group']], group_conversation_key(group.id))
+
+
+class AsyncExportTests(QueryCountTestCase):
+
+    def test_asgi_export_streams_rows_a_chunk_at_a_time(self):
+        group = Group.objects.create(name='room', owner=self.me)
+        group.members.add(self.me)
+        Message.objects.bulk_create([
+            Message(sender=self.me, to_group=group, conversation=f'g:{group.id}', text='x' * 300)
+            for _ in range(400)
+        ])
+        request = AsyncRequestFactory().get('/api/messages/export/', {'group_id': group.id})
+        force_authenticate(request, self.auth_user)
+        with mock.patch('Chat.exports.EXPORT_CHUNK_SIZE', 50):
+            response = resolve('/api/messages/export/').func(request)
+        self.assertTrue(response.is_async)
+
+        async def first_chunk():
+            return await anext(aiter(response))
+
+        with CaptureQueriesContext(connection) as ctx:
+            chunk = async_to_sync(first_chunk)()
+        self.assertTrue(chunk.startswith(b'From,To,Message'))
+        # ~64KB is about 200 rows: only the batches for those have been read, not all eight
+        batches = sum('reactioncount' in query['sql'].lower() for query in ctx.captured_queries)
+        self.assertLess(batches, 8)
+
+
+class PaginationTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.messages = [
+            Message.objects.create(sender=self.me, to_user=self.peer, text=f'message {i}') for i in range(7)
+        ]
+
+    def page(self, **params):
+        response = self.client.get('/api/messages/', {'user_id': self.peer.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def texts(self, page):
+        return [m['text'] for m in page['results']]
+
+    def test_before_walks_back_and_after_walks_forward(self):
+        newest = self.page(limit=3)
+        self.assertEqual(self.texts(newest), ['message 4', 'message 5', 'message 6'])
+        self.assertTrue(newest['has_more'])
+        self.assertIsNone(newest['after_cursor'])
+        middle = self.page(limit=3, before=newest['before_cursor'])
+        self.assertEqual(self.texts(middle), ['message 1', 'message 2', 'message 3'])
+        oldest = self.page(limit=3, before=middle['before_cursor'])
+        self.assertEqual(self.texts(oldest), ['message 0'])
+        self.assertFalse(oldest['has_more'])
+        self.assertIsNone(oldest['before_cursor'])
+
+        forward = self.page(limit=3, after=oldest['after_cursor'])
+        self.assertEqual(self.texts(forward), ['message 1', 'message 2', 'message 3'])
+        self.assertTrue(forward['has_more'])
+        last = self.page(limit=3, after=forward['after_cursor'])
+        self.assertEqual(self.texts(last), ['message 4', 'message 5', 'message 6'])
+        self.assertFalse(last['has_more'])
+
+    @override_settings(CHAT_SYNC_OVERLAP=0)  # exact cursors: nothing read twice
+    def test_since_returns_edits_and_deletions(self):
+        cursor = self.page()['sync_cursor']
+        self.assertEqual(self.page(since=cursor)['results'], [])
+        edited, deleted = self.messages[1], self.messages[4]
+        self.client.patch(f'/api/messages/{edited.id}/', {'text': 'edited'}, format='json')
+        self.client.delete(f'/api/messages/{deleted.id}/')
+        changes = self.page(since=cursor)
+        self.assertEqual([(m['id'], m['text'], m['is_deleted']) for m in changes['results']], [
+            (edited.id, 'edited', False), (deleted.id, '', True),
+        ])
+        # Deleted messages are gone from ordinary pages
+        self.assertNotIn(deleted.id, [m['id'] for m in self.page()['results']])
+        self.assertEqual(self.page(since=changes['sync_cursor'])['results'], [])
+
+    @override_settings(CHAT_SYNC_OVERLAP=0)  # exact cursors: nothing read twice
+    def test_queryset_updates_reach_since(self):
+        message = self.messages[0]
+        message.attachment = 'blobs/aa/bb/file.txt'
+        message.save()
+        cursor = self.page()['sync_cursor']
+        with self.captureOnCommitCallbacks(execute=False):
+            schedule_processing(message)
+        self.assertEqual([m['id'] for m in self.page(since=cursor)['results']], [message.id])
+
+    def test_since_rereads_changes_committed_behind_the_cursor(self):
+        cursor = self.page()['sync_cursor']
+        self.assertEqual(self.page(since=cursor)['has_more'], False)
+        # Stamped before the last change the poll saw, committed after it
+        late = Message.objects.create(sender=self.peer, to_user=self.me, text='late')
+        Message.objects.filter(id=late.id).update(updated_at=self.messages[-1].updated_at - timedelta(seconds=2))
+        changes = self.page(since=cursor)
+        self.assertIn(late.id, [m['id'] for m in changes['results']])
+        self.assertIn(late.id, [m['id'] for m in self.page(since=changes['sync_cursor'])['results']])
+        # Only the overlap is read twice, not the whole history
+        Message.objects.filter(id__in=[m.id for m in self.messages[:3]]).update(
+            updated_at=self.messages[-1].updated_at - timedelta(minutes=5),
+        )
+        self.assertEqual(len(self.page(since=cursor)['results']), 5)
+
+    def test_empty_conversation_syncs_from_the_start(self):
+        other = CustomUser.objects.create(name='other', email='other@example.com', password='!')
+        response = self.client.get('/api/messages/', {'user_id': other.id}).json()
+        self.assertEqual(response['results'], [])
+        # Committed later, but stamped before the cursor was handed out
+        message = Message.objects.create(sender=other, to_user=self.me, text='late')
+        Message.objects.filter(id=message.id).update(updated_at=timezone.now() - timedelta(minutes=5))
+        changes = self.client.get('/api/messages/', {'user_id': other.id, 'since': response['sync_cursor']}).json()
+        self.assertEqual([m['id'] for m in changes['results']], [message.id])
+
+    def test_malformed_cursors_are_rejected(self):
+        naive = base64.urlsafe_b64encode(b'2024-01-01T00:00:00|5').decode()
+        for params in ({'before': 'garbage'}, {'after': '!!'}, {'since': 'bm9waXBl'}, {'before': naive},
+                       {'limit': 'many'}):
+            response = self.client.get('/api/messages/', {'user_id': self.peer.id, **params})
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(len(self.page(limit=10_000)['results']), 7)  # clamped, not refused
+
+
+class GroupQueryCountTests(QueryCountTestCase):
+
+    def test_group_list(self):
+        def grow():
+            members = self.make_users(10, 'member')
+            for i in range(10):
+                group = Group.objects.create(name=f'group{i}', owner=self.me)
+                group.members.add(self.me, *members)
+
+        group = Group.objects.create(name='first', owner=self.me)
+        group.members.add(self.me)
+        self.assertQueryCountStable(grow, '/api/groups/', expected=3)
+
+
+class ChatUserResolutionTests(QueryCountTestCase):
+
+    def test_lookup_is_cached_across_requests(self):
+        cold = self.count_queries('/api/conversations/')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/conversations/')
+        self.assertEqual(len(ctx.captured_queries), cold - 1)
+
+    def test_email_change_invalidates(self):
+        self.client.get('/api/groups/')
+        self.auth_user.email = 'peer@example.com'
+        self.auth_user.save()
+        response = self.client.get('/api/users/')
+        self.assertNotIn(self.peer.id, [u['id'] for u in response.json()['results']])
+
+    def test_requests_get_their_own_copy(self):
+        chat_user_cache.clear()
+        request = RequestFactory().get('/')
+        request.user = self.auth_user
+        first = get_chat_user(request)
+        first.name = 'changed'
+        request = RequestFactory().get('/')
+        request.user = self.auth_user
+        with self.assertNumQueries(0):
+            second = get_chat_user(request)
+        self.assertEqual(second, first)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.name, 'me')
+
+    def test_token_carries_chat_user_id(self):
+        access = tokens_for(self.auth_user).access_token
+        self.assertEqual(access[CHAT_USER_CLAIM], self.me.id)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get('/api/groups/').status_code, 200)
+
+
+class ArchiveTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': 'old 0'}, format='json')
+        for i in range(1, 5):
+            self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': f'old {i}'}, format='json')
+        first = Message.objects.order_by('id').first()
+        reactions.add_reaction(first, self.me, '👍')
+        Message.objects.update(created_at=timezone.now() - timedelta(days=400))
+        for i in range(3):
+            self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': f'new {i}'}, format='json')
+
+    def page(self, **params):
+        response = self.client.get('/api/messages/', {'user_id': self.peer.id, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_history_and_export_read_both_tiers(self):
+        call_command('archive_messages', stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(ArchivedMessage.objects.count(), 5)
+
+        page = self.page(limit=4)
+        self.assertEqual([m['text'] for m in page['results']], ['old 4', 'new 0', 'new 1', 'new 2'])
+        older = self.page(limit=4, before=page['before_cursor'])
+        self.assertEqual([m['text'] for m in older['results']], ['old 0', 'old 1', 'old 2', 'old 3'])
+        self.assertFalse(older['has_more'])
+        self.assertEqual(older['results'][0]['reactions'], [{'emoji': '👍', 'count': 1, 'me': True}])
+        newer = self.page(limit=2, after=older['after_cursor'])
+        self.assertEqual([m['text'] for m in newer['results']], ['old 4', 'new 0'])
+
+        export = self.client.get('/api/messages/export/', {'user_id': self.peer.id, 'output': 'ndjson'})
+        lines = b''.join(export.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['text'] for line in lines][:6], [f'old {i}' for i in range(5)] + ['new 0'])
+
+    def test_preview_stays_hot_and_deleted_messages_are_purged(self):
+        Message.objects.update(created_at=timezone.now() - timedelta(days=400))
+        newest = Message.objects.order_by('-id').first()
+        doomed = Message.objects.order_by('id').first()
+        self.client.delete(f'/api/messages/{doomed.id}/')
+        Message.objects.filter(id=doomed.id).update(updated_at=timezone.now() - timedelta(days=60))
+        call_command('archive_messages', stdout=StringIO())
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [newest.id])
+        self.assertFalse(ArchivedMessage.objects.filter(id=doomed.id).exists())
+        self.assertEqual(ArchivedMessage.objects.count(), 6)
+        inbox = self.client.get('/api/conversations/').json()['results']
+        self.assertEqual(inbox[0]['last_message']['id'], newest.id)
+
+
+class BulkSendTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name='room', owner=self.me)
+        self.group.members.add(self.me, self.peer)
+
+    def send(self, messages):
+        chat_user_cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/messages/bulk/', {'messages': messages}, format='json')
+        return response, len(ctx.captured_queries)
+
+    def test_broadcast_keeps_summaries_and_query_count(self):
+        self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': 'before'}, format='json')
+        response, _ = self.send([
+            {'to_user': self.peer.id, 'text': 'one'},
+            {'to_user': self.peer.id, 'text': 'two'},
+            {'to_group': self.group.id, 'text': 'hello room'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([m['text'] for m in response.json()['results']], ['one', 'two', 'hello room'])
+        dm = f'u:{self.me.id}:{self.peer.id}'
+        peer_dm = ConversationSummary.objects.get(user=self.peer, conversation=dm)
+        self.assertEqual(peer_dm.unread_count, 3)
+        self.assertEqual(peer_dm.last_message.text, 'two')
+        mine = ConversationSummary.objects.get(user=self.me, conversation=dm)
+        self.assertEqual((mine.unread_count, mine.last_read_id), (0, peer_dm.last_message_id))
+        room = ConversationSummary.objects.get(user=self.peer, conversation=f'g:{self.group.id}')
+        self.assertEqual(room.unread_count, 1)
+
+        fans = self.make_users(31, 'fan')
+        _, few = self.send([{'to_user': fans[0].id, 'text': 'news'}])
+        response, many = self.send([{'to_user': user.id, 'text': 'news'} for user in fans[1:]])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ConversationSummary.objects.filter(user__in=fans, unread_count=1).count(), 31)
+        self.assertEqual(few, many)
+
+    def test_batch_is_all_or_nothing(self):
+        closed = Group.objects.create(name='closed', owner=self.peer)
+        response, _ = self.send([{'to_user': self.peer.id, 'text': 'hi'}, {'to_group': closed.id, 'text': 'hi'}])
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['groups'], [closed.id])
+        response, _ = self.send([{'to_user': self.peer.id, 'text': 'hi'}, {'to_user': 999999, 'text': 'hi'}])
+        self.assertEqual(response.status_code, 400)
+        response, _ = self.send([{'to_user': self.peer.id, 'to_group': self.group.id, 'text': 'hi'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+class SeedCommandTests(QueryCountTestCase):
+
+    def test_seeded_data_is_consistent_and_usable(self):
+        call_command('seed_chat', users=30, groups=4, messages=600, max_group_size=20, attachment_share=0.2,
+                     accounts=2, password='pw', stdout=StringIO())
+        seeded = CustomUser.objects.filter(email__startswith='seed-')
+        self.assertEqual(seeded.count(), 30)
+        sizes = [group.members.count() for group in Group.objects.filter(name__startswith='seed-group-').order_by('id')]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertGreater(sizes[0], sizes[-1])
+        messages = Message.objects.filter(sender__in=seeded)
+        self.assertEqual(messages.count(), 600)
+        self.assertTrue(messages.exclude(attachment='').filter(attachment_size__gt=0).exists())
+        # Every live conversation has both inbox rows, pointing at its latest message
+        for key in messages.filter(is_deleted=False).values_list('conversation', flat=True).distinct()[:20]:
+            latest = messages.filter(conversation=key, is_deleted=False).order_by('-id').first()
+            summaries = ConversationSummary.objects.filter(conversation=key)
+            self.assertTrue(summaries.exists())
+            self.assertEqual(set(summaries.values_list('last_message_id', flat=True)), {latest.id})
+
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/auth/login/', {'email': 'seed-0@example.com', 'password': 'pw'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.json()["access"]}')
+        self.assertTrue(self.client.get('/api/conversations/').json()['results'])
+        with self.assertRaises(CommandError):
+            call_command('seed_chat', users=2, groups=0, messages=0, stdout=StringIO())
+
+
+class MetricsTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+        self.enterContext(override_settings(CHAT_METRICS_TOKEN='scrape-secret'))
+
+    def scrape(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Bearer scrape-secret')
+        response = self.client.get('/metrics', **headers)
+        self.assertEqual(response.status_code, 200)
+        return {
+            line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in response.content.decode().splitlines() if not line.startswith('#')
+        }
+
+    def test_requests_are_counted_per_route(self):
+        self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': 'hi'}, format='json')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/messages/', {'user_id': self.peer.id})
+        history_queries = len(ctx.captured_queries)  # later requests reset the log it reads
+        message = Message.objects.get()
+        self.client.get(f'/api/messages/{message.id}/')
+        self.client.get('/no/such/page/')
+        samples = self.scrape()
+
+        history = 'route="api/messages/",method="GET"'
+        self.assertEqual(samples[f'chat_http_requests_total{{{history},status="200"}}'], 1)
+        self.assertEqual(samples['chat_http_requests_total{route="api/messages/",method="POST",status="201"}'], 1)
+        self.assertEqual(samples['chat_http_requests_total{route="<unmatched>",method="GET",status="404"}'], 1)
+        # Labelled by pattern, so ids don't create new series
+        self.assertIn('chat_http_requests_total{route="api/messages/<int:pk>/",method="GET",status="405"}', samples)
+        self.assertEqual(samples[f'chat_http_db_queries_sum{{{history}}}'], history_queries)
+        self.assertEqual(samples[f'chat_http_request_duration_seconds_count{{{history}}}'], 1)
+        self.assertEqual(samples[f'chat_http_request_duration_seconds_bucket{{{history},le="+Inf"}}'], 1)
+        self.assertGreater(samples[f'chat_http_response_size_bytes_sum{{{history}}}'], 0)
+
+    def test_streamed_exports_are_measured_to_the_end(self):
+        self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': 'hi'}, format='json')
+        response = self.client.get('/api/messages/export/', {'user_id': self.peer.id})
+        self.assertNotIn('chat_http_requests_total{route="api/messages/export/",method="GET",status="200"}',
+                         self.scrape())
+        body = b''.join(response.streaming_content)
+        export = 'route="api/messages/export/",method="GET"'
+        self.assertEqual(self.scrape()[f'chat_http_response_size_bytes_sum{{{export}}}'], len(body))
+
+    def test_token_protects_the_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+    @override_settings(CHAT_METRICS_TOKEN='')
+    def test_without_a_token_only_staff_and_listed_networks_scrape(self):
+        # Loopback is where a reverse proxy's requests come from; it is not trusted by itself
+        for address in ('127.0.0.1', '10.0.0.5', '8.8.8.8'):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR=address).status_code, 403)
+        with override_settings(CHAT_METRICS_ALLOWED_IPS=['10.0.0.0/8']):
+            self.scrape(REMOTE_ADDR='10.0.0.5')
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.auth_user.is_staff = True
+        self.auth_user.save()
+        self.client.force_login(self.auth_user)
+        self.scrape()
+
+    def test_async_requests_are_measured(self):
+        self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': 'hi'}, format='json')
+        async def view(request):
+            # Rendered as the handler below the middleware would
+            return (await AsyncMessageListCreateView.as_view()(request)).render()
+
+        handler = MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(handler))
+        request = AsyncRequestFactory().get('/api/async/messages/', {'user_id': self.peer.id})
+        request.resolver_match = resolve('/api/async/messages/')
+        force_authenticate(request, self.auth_user)
+        # Run as under ASGI; the view's sync_to_async queries stay on this thread's test transaction
+        response = async_to_sync(handler)(request)
+        self.assertEqual(response.status_code, 200)
+        samples = self.scrape()
+        route = 'route="api/async/messages/",method="GET"'
+        # Counted although they ran on a sync_to_async thread
+        self.assertGreater(samples[f'chat_http_db_queries_sum{{{route}}}'], 0)
+        self.assertEqual(samples[f'chat_http_response_size_bytes_sum{{{route}}}'], len(response.content))
+
+    def test_async_streams_are_measured(self):
+        async def body():
+            yield b'abc'
+            yield b'de'
+
+        async def view(request):
+            return StreamingHttpResponse(body())
+
+        request = AsyncRequestFactory().get('/media/x')
+        request.resolver_match = resolve('/media/x')
+
+        async def consume():
+            response = await MetricsMiddleware(view)(request)
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(asyncio.run(consume()), b'abcde')
+        self.assertEqual(self.scrape()['chat_http_response_size_bytes_sum{route="media/<path:name>",method="GET"}'], 5)
+
+    def test_profiling_on_request(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(CHAT_PROFILE_DIR=directory, CHAT_PROFILE_TOKEN='profile-me'):
+            self.assertNotIn('X-Chat-Profile', self.client.get('/api/conversations/'))
+            wrong = self.client.get('/api/conversations/', HTTP_X_CHAT_PROFILE='guess')
+            self.assertNotIn('X-Chat-Profile', wrong)
+            response = self.client.get('/api/conversations/', HTTP_X_CHAT_PROFILE='profile-me')
+        name = response['X-Chat-Profile']
+        self.assertEqual(os.listdir(directory), [name])
+        stats = pstats.Stats(os.path.join(directory, name))
+        self.assertTrue(any('inbox' in function for _, _, function in stats.stats))
+
+
+@override_settings(CHAT_THROTTLE_RATES={'send': '3/min', 'send_ip': '5/min', 'auth': '2/min', 'auth_ip': None})
+class ThrottleTests(QueryCountTestCase):
+
+    def send(self, path='/api/messages/'):
+        return self.client.post(path, {'to_user': self.peer.id, 'text': 'hi'}, format='json')
+
+    def test_sends_are_limited_per_user_and_per_address(self):
+        self.assertEqual([self.send().status_code for _ in range(3)], [201, 201, 201])
+        response = self.send()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        # Reads don't spend tokens
+        self.assertEqual(self.client.get('/api/messages/', {'user_id': self.peer.id}).status_code, 200)
+
+        other = get_user_model().objects.create_user(username='peer@example.com', email='peer@example.com')
+        self.client.force_authenticate(other)
+        statuses = [self.send().status_code for _ in range(3)]
+        # Same address: two left of its five
+        self.assertEqual(statuses, [201, 201, 429])
+
+    def test_bulk_sends_spend_a_token_per_message(self):
+        def bulk(count):
+            messages = [{'to_user': self.peer.id, 'text': 'hi'}] * count
+            return self.client.post('/api/messages/bulk/', {'messages': messages}, format='json')
+
+        self.assertEqual(bulk(2).status_code, 201)
+        self.assertEqual(bulk(2).status_code, 429)
+        self.assertEqual(self.send().status_code, 201)
+        self.assertEqual(self.send().status_code, 429)
+        # Bigger than the whole bucket: no point in retrying
+        response = bulk(4)
+        self.assertEqual(response.status_code, 429)
+        self.assertNotIn('Retry-After', response)
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_async_sends_are_charged_once(self):
+        # Handed to the sync view, which throttles them; the async view must not charge again
+        statuses = [self.send('/api/async/messages/').status_code for _ in range(4)]
+        self.assertEqual(statuses, [201, 201, 201, 429])
+        self.assertEqual(self.send().status_code, 429)
+
+    def test_auth_is_limited_per_email(self):
+        self.client.force_authenticate(None)
+        attempt = {'email': 'Me@example.com', 'password': 'wrong'}
+        statuses = [self.client.post('/api/auth/login/', attempt, format='json').status_code for _ in range(3)]
+        self.assertEqual(statuses, [401, 401, 429])
+        response = self.client.post('/api/auth/login/', {'email': 'me@example.com', 'password': 'pass'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        response = self.client.post('/auth/login/', {'email': 'ME@example.com', 'password': 'pass'})
+        self.assertEqual(response.status_code, 429)
+        # Half a minute per token, less the time the password checks took
+        self.assertIn(int(response['Retry-After']), range(25, 31))
+        other = self.client.post('/api/auth/login/', {'email': 'peer@example.com', 'password': 'x'}, format='json')
+        self.assertEqual(other.status_code, 401)
+
+
+@skipUnless(find_spec('fakeredis'), 'needs fakeredis[lua]')
+@override_settings(CACHES={'default': redis_standin.cache_config()})
+class RedisThrottleTests(ThrottleTests):
+    """The same budgets kept by the Lua script, against the in-process Redis stand-in."""
+
+    def setUp(self):
+        redis_standin.client().flushall()
+        super().setUp()
+
+    def test_buckets_live_in_redis(self):
+        self.assertIsInstance(caches['default'], RedisCache)
+        self.send()
+        self.assertTrue(redis_standin.client().keys('*throttle:send:*'))
+
+    def test_script_is_registered_once(self):
+        import redis
+
+        register = mock.patch('redis.Redis.register_script', autospec=True, side_effect=redis.Redis.register_script)
+        with mock.patch.object(throttling, '_redis_script', None), register as registered:
+            self.assertEqual([self.send().status_code for _ in range(3)], [201, 201, 201])
+        self.assertEqual(registered.call_count, 1)
+
+
+@override_settings(CHAT_WS_OUTBOX_SIZE=2, CHAT_WS_SEND_TIMEOUT=0.05)
+class SlowConsumerTests(SimpleTestCase):
+
+    def run_consumer(self, events, pause=0):
+        async def scenario():
+            sent = []
+
+            async def base_send(message):
+                sent.append(message)
+                if message['type'] == 'websocket.send':
+                    await asyncio.Event().wait()  # the client never reads
+
+            consumer = ChatConsumer()
+            consumer.base_send = base_send
+            consumer.open_outbox()
+            for i in range(events):
+                await consumer.chat_event({'event': 'message.created', 'message': {'id': i}})
+            await asyncio.sleep(pause)
+            consumer.writer.cancel()
+            return [message['type'] for message in sent], sent[-1]
+
+        return asyncio.run(scenario())
+
+    def test_full_outbox_disconnects(self):
+        types, last = self.run_consumer(3)
+        self.assertEqual(types, ['websocket.close'])
+        self.assertEqual(last['code'], SLOW_CONSUMER)
+
+    def test_stalled_send_disconnects(self):
+        types, last = self.run_consumer(1, pause=0.2)
+        self.assertEqual(types, ['websocket.send', 'websocket.close'])
+        self.assertEqual(last['code'], SLOW_CONSUMER)
+
+
+class ChatConsumerTests(TransactionTestCase):
+    """Sockets end to end over the in-memory channel layer; committed data, as consumers read it from other threads."""
+
+    def setUp(self):
+        self.auth_users = {
+            name: get_user_model().objects.create_user(username=f'{name}@example.com', email=f'{name}@example.com')
+            for name in ('me', 'peer', 'out')
+        }
+        self.users = {
+            name: CustomUser.objects.create(name=name, email=f'{name}@example.com', password='!')
+            for name in self.auth_users
+        }
+        self.group = Group.objects.create(name='room', owner=self.users['me'])
+        self.group.members.add(self.users['me'], self.users['peer'])
+
+    async def connect(self, name=None, query=''):
+        communicator = WebsocketCommunicator(JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns)), f'/ws/chat/{query}')
+        communicator.scope['user'] = self.auth_users[name] if name else AnonymousUser()
+        connected, code = await communicator.connect()
+        self.assertTrue(connected, code)
+        return communicator
+
+    async def send_to_group(self, text):
+        def send():
+            message = Message.objects.create(sender=self.users['me'], to_group=self.group, text=text)
+            publish_message_event(MESSAGE_CREATED, message, {'id': message.id, 'text': text})
+
+        await sync_to_async(send)()
+
+    async def test_unauthenticated_sockets_are_refused(self):
+        communicator = WebsocketCommunicator(JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns)), '/ws/chat/')
+        communicator.scope['user'] = AnonymousUser()
+        self.assertEqual(await communicator.connect(), (False, 4401))
+        communicator = WebsocketCommunicator(
+            JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns)), '/ws/chat/?token=forged',
+        )
+        communicator.scope['user'] = AnonymousUser()
+        self.assertEqual(await communicator.connect(), (False, 4401))
+
+    async def test_token_in_query_string_authenticates(self):
+        token = (await sync_to_async(tokens_for)(self.auth_users['peer'])).access_token
+        communicator = WebsocketCommunicator(
+            JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns)), f'/ws/chat/?token={token}',
+        )
+        communicator.scope['user'] = AnonymousUser()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def test_events_fan_out_to_participants_only(self):
+        me, peer, out = await self.connect('me'), await self.connect('peer'), await self.connect('out')
+        await self.send_to_group('hello room')
+        for communicator in (me, peer):
+            event = await communicator.receive_json_from()
+            self.assertEqual((event['type'], event['message']['text']), (MESSAGE_CREATED, 'hello room'))
+        self.assertTrue(await out.receive_nothing())
+        for communicator in (me, peer, out):
+            await communicator.disconnect()
+
+    async def test_membership_changes_resubscribe_open_sockets(self):
+        out = await self.connect('out')
+        await sync_to_async(self.group.members.add)(self.users['out'])
+        self.assertEqual(await out.receive_json_from(), {'type': 'group.joined', 'group_id': self.group.id})
+        await self.send_to_group('welcome')
+        self.assertEqual((await out.receive_json_from())['message']['text'], 'welcome')
+
+        await sync_to_async(self.group.members.remove)(self.users['out'])
+        self.assertEqual(await out.receive_json_from(), {'type': 'group.left', 'group_id': self.group.id})
+        await self.send_to_group('after you left')
+        self.assertTrue(await out.receive_nothing())
+
+        # Removing the group from the user's side works the same way
+        await sync_to_async(self.users['out'].groups.add)(self.group)
+        self.assertEqual((await out.receive_json_from())['type'], 'group.joined')
+        await sync_to_async(self.users['out'].groups.clear)()
+        self.assertEqual((await out.receive_json_from())['type'], 'group.left')
+        await out.disconnect()
+
+
+@skipUnless(find_spec('fakeredis'), 'needs fakeredis[lua]')
+class RedisChatConsumerTests(ChatConsumerTests):
+    """The same sockets, fanned out through channels_redis against the in-process Redis stand-in."""
+
+    def setUp(self):
+        redis_standin.client().flushall()
+        # A fresh layer per test: channels_redis binds its receive lock and pools to the event loop that first used them
+        self.enterContext(override_settings(CHANNEL_LAYERS={'default': redis_standin.channel_layer_config(200)}))
+        super().setUp()
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    """The DATABASES that settings.py builds from the environment, and what a connection gets from them."""
+
+    def sqlite_connection(self, path, **options):
+        settings_dict = {**connections['default'].settings_dict, 'NAME': path}
+        settings_dict['OPTIONS'] = {**settings.DATABASES['default']['OPTIONS'], **options}
+        wrapper = SQLiteDatabaseWrapper(settings_dict, alias=f'settings-check-{len(options)}')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_sqlite_connections_get_the_pragmas(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'chat.sqlite3')
+        wrapper = self.sqlite_connection(path)
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 20000)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+        # BEGIN IMMEDIATE takes the write lock up front, before anything is written
+        other = self.sqlite_connection(path, timeout=0.05)
+        other.ensure_connection()
+        # As atomic() does it on SQLite
+        wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            with other.cursor() as cursor:
+                cursor.execute('CREATE TABLE probe (id integer)')
+        wrapper.rollback()
+        wrapper.set_autocommit(True)
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_path(settings_module.__file__)
+
+    def test_postgres_from_the_environment_uses_the_pool(self):
+        loaded = self.load_settings(
+            CHAT_DB_ENGINE='postgres', CHAT_DB_HOST='db', CHAT_DB_NAME='chat', CHAT_DB_POOL_MAX_SIZE='8',
+            CHAT_DB_REPLICA_HOSTS='standby1,standby2',
+        )
+        default = loaded['DATABASES']['default']
+        self.assertEqual(default['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((default['HOST'], default['NAME']), ('db', 'chat'))
+        self.assertEqual(default['OPTIONS']['pool'], {'min_size': 2, 'max_size': 8, 'timeout': 10})
+        # Pooled connections go back to the pool after each request
+        self.assertEqual(default['CONN_MAX_AGE'], 0)
+        self.assertEqual(loaded['CHAT_DB_REPLICAS'], ['replica1', 'replica2'])
+        self.assertEqual(loaded['DATABASES']['replica2']['HOST'], 'standby2')
+        self.assertEqual(loaded['DATABASES']['replica2']['OPTIONS'], default['OPTIONS'])
+
+    def test_postgres_without_the_pool_keeps_conn_max_age(self):
+        default = self.load_settings(
+            CHAT_DB_ENGINE='postgres', CHAT_DB_POOL='0', CHAT_DB_CONN_MAX_AGE='60',
+        )['DATABASES']['default']
+        self.assertEqual(default['OPTIONS'], {})
+        self.assertEqual(default['CONN_MAX_AGE'], 60)
+
+
+@override_settings(CHAT_DB_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        replica_monitor.clear()
+        replica_monitor.record('replica1', 0)
+        replica_monitor.record('replica2', 30)
+        self.factory = RequestFactory(HTTP_AUTHORIZATION='Bearer token-a')
+
+    def read_alias(self, request, response=None):
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Message))
+            return response or HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        ReplicaRoutingMiddleware(view)(request)
+        return seen[0]
+
+    def test_history_reads_use_a_caught_up_replica(self):
+        self.assertEqual(self.read_alias(self.factory.get('/api/messages/')), 'replica1')
+        self.assertEqual(router.db_for_read(Message), 'default')
+        # Accounts are never read from a replica
+        self.assertEqual(router.db_for_read(get_user_model()), 'default')
+
+    def test_writes_and_other_paths_use_the_primary(self):
+        self.assertEqual(self.read_alias(self.factory.post('/api/messages/')), 'default')
+        self.assertEqual(self.read_alias(self.factory.get('/api/auth/me/')), 'default')
+        self.assertEqual(router.db_for_write(Message), 'default')
+
+    def test_sender_reads_own_writes(self):
+        self.read_alias(self.factory.post('/api/messages/'))
+        self.assertEqual(self.read_alias(self.factory.get('/api/messages/')), 'default')
+        other = RequestFactory(HTTP_AUTHORIZATION='Bearer token-b')
+        self.assertEqual(self.read_alias(other.get('/api/messages/')), 'replica1')
+
+    def test_lagging_replicas_fall_back_to_primary(self):
+        replica_monitor.record('replica1', None)
+        self.assertEqual(self.read_alias(self.factory.get('/api/messages/')), 'default')
+
+    def test_streamed_export_reads_from_replica(self):
+        seen = []
+
+        def body():
+            seen.append(router.db_for_read(Message))
+            yield b'rows'
+
+        request = self.factory.get('/api/messages/export/')
+        response = ReplicaRoutingMiddleware(lambda request: StreamingHttpResponse(body()))(request)
+        self.assertEqual(b''.join(response.streaming_content), b'rows')
+        self.assertEqual(seen, ['replica1'])
+
+    def test_async_requests_stay_async(self):
+        seen = []
+
+        async def view(request):
+            seen.append(router.db_for_read(Message))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        factory, headers = AsyncRequestFactory(), {'Authorization': 'Bearer token-a'}
+        asyncio.run(middleware(factory.get('/api/async/messages/', headers=headers)))
+        asyncio.run(middleware(factory.post('/api/async/messages/', headers=headers)))
+        asyncio.run(middleware(factory.get('/api/async/messages/', headers=headers)))
+        self.assertEqual(seen, ['replica1', 'default', 'default'])
+
+
+class ListCacheTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.group = Group.objects.create(name='room', owner=self.me)
+        self.group.members.add(self.me, self.peer)
+
+    def get_ids(self, path, **headers):
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        # The user directory is paged, the group list is not
+        return sorted(row['id'] for row in (body['results'] if isinstance(body, dict) else body))
+
+    def test_repeated_lists_skip_the_database(self):
+        for path in ('/api/users/', '/api/groups/'):
+            self.client.get(path)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertEqual(len(ctx.captured_queries), 0, path)
+
+    def test_user_changes_invalidate(self):
+        self.assertEqual(self.get_ids('/api/users/'), [self.peer.id])
+        newcomer = CustomUser.objects.create(name='newcomer', email='newcomer@example.com', password='!')
+        self.assertEqual(self.get_ids('/api/users/'), [self.peer.id, newcomer.id])
+        self.peer.name = 'renamed'
+        self.peer.save()
+        members = self.client.get('/api/groups/').json()[0]['members']
+        self.assertIn('renamed', [member['name'] for member in members])
+        newcomer.delete()
+        self.assertEqual(self.get_ids('/api/users/'), [self.peer.id])
+
+    def test_membership_changes_invalidate(self):
+        other = Group.objects.create(name='other', owner=self.peer)
+        other.members.add(self.peer)
+        self.assertEqual(self.get_ids('/api/groups/'), [self.group.id])
+        other.members.add(self.me)
+        self.assertEqual(self.get_ids('/api/groups/'), [self.group.id, other.id])
+        self.me.groups.remove(self.group)
+        self.assertEqual(self.get_ids('/api/groups/'), [other.id])
+        other.members.clear()
+        self.assertEqual(self.get_ids('/api/groups/'), [])
+
+    def test_unchanged_list_is_not_modified(self):
+        for path in ('/api/users/', '/api/groups/', '/api/async/users/', '/api/async/groups/'):
+            tag = self.client.get(path)['ETag']
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=tag)
+            self.assertEqual(response.status_code, 304, path)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(len(ctx.captured_queries), 0, path)
+        tag = self.client.get('/api/groups/')['ETag']
+        self.group.name = 'renamed'
+        self.group.save()
+        response = self.client.get('/api/groups/', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], tag)
+
+
+class AsyncViewParityTests(QueryCountTestCase):
+    """The /api/async/ routes answer exactly as their sync counterparts."""
+
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name='room', owner=self.me)
+        self.group.members.add(self.me, self.peer)
+        self.outside = Group.objects.create(name='elsewhere', owner=self.peer)
+        self.outside.members.add(self.peer)
+        for i in range(5):
+            Message.objects.create(sender=self.me, to_user=self.peer, text=f'dm {i}')
+            Message.objects.create(sender=self.peer, to_group=self.group, text=f'group {i}')
+        reactions.add_reaction(Message.objects.first(), self.peer, '👍')
+        self.make_users(4, 'person')
+
+    def both(self, path, params=None):
+        sync = self.client.get(f'/api/{path}', params or {})
+        asynchronous = self.client.get(f'/api/async/{path}', params or {})
+        self.assertEqual(asynchronous.status_code, sync.status_code, (path, params))
+        self.assertEqual(asynchronous.json(), sync.json(), (path, params))
+        return sync
+
+    def test_history_pages_match(self):
+        first = self.both('messages/', {'user_id': self.peer.id, 'limit': 2}).json()
+        self.both('messages/', {'user_id': self.peer.id, 'limit': 2, 'before': first['before_cursor']})
+        self.both('messages/', {'user_id': self.peer.id, 'since': first['sync_cursor']})
+        self.both('messages/', {'group_id': self.group.id, 'compact': '1'})
+        self.both('messages/', {'user_id': self.peer.id, 'before': 'garbage'})
+        self.assertEqual(self.both('messages/', {'group_id': self.outside.id}).status_code, 403)
+
+    def test_lists_match(self):
+        first = self.both('users/', {'limit': 2}).json()
+        self.both('users/', {'limit': 2, 'after': first['next_cursor']})
+        self.assertEqual(len(self.both('users/', {'q': 'PERS'}).json()['results']), 4)
+        self.both('users/', {'contacts': '1'})
+        self.both('groups/')
+
+    def test_permissions_match(self):
+        stranger = get_user_model().objects.create_user(username='x@example.com', email='x@example.com')
+        self.client.force_authenticate(stranger)
+        for path in ('messages/', 'users/', 'groups/'):
+            self.assertEqual(self.both(path, {'user_id': self.peer.id}).status_code, 400)
+        self.client.force_authenticate(None)
+        for path in ('messages/', 'users/', 'groups/'):
+            self.assertIn(self.both(path).status_code, (401, 403))
+
+    def test_writes_go_through(self):
+        response = self.client.post('/api/async/messages/', {'to_user': self.peer.id, 'text': 'async hi'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['text'], 'async hi')
+        response = self.client.post('/api/async/groups/', {'name': 'made async', 'member_ids': [self.peer.id]},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(m['id'] for m in response.json()['members']), [self.me.id, self.peer.id])
+        self.both('groups/')
+
+
+class UserDirectoryTests(QueryCountTestCase):
+
+    def names(self, **params):
+        response = self.client.get('/api/users/', params)
+        self.assertEqual(response.status_code, 200)
+        return [user['name'] for user in response.json()['results']]
+
+    def test_pages_walk_everyone_in_name_order(self):
+        for name in ('Carol', 'alice', 'Bob', 'dave'):
+            CustomUser.objects.create(name=name, email=f'{name.lower()}@example.com', password='!')
+        seen, params = [], {'limit': 2}
+        while True:
+            page = self.client.get('/api/users/', params).json()
+            seen += [user['name'] for user in page['results']]
+            if not page['has_more']:
+                break
+            params['after'] = page['next_cursor']
+        # The caller is left out, whichever page they fall on
+        self.assertEqual(seen, ['alice', 'Bob', 'Carol', 'dave', 'peer'])
+        self.assertEqual(self.client.get('/api/users/', {'after': 'garbage'}).status_code, 400)
+
+    def test_prefix_search_on_name_and_email(self):
+        CustomUser.objects.create(name='Annabel', email='bel@example.com', password='!')
+        CustomUser.objects.create(name='Zed', email='ANN.smith@example.com', password='!')
+        CustomUser.objects.create(name='Joann', email='jo@example.com', password='!')
+        self.assertEqual(self.names(q='ann'), ['Annabel', 'Zed'])
+        self.assertEqual(self.names(q=' ANN '), ['Annabel', 'Zed'])
+        self.assertEqual(self.names(q='pe'), ['peer'])
+        self.assertEqual(self.names(q='me'), [])
+
+    def test_non_ascii_names_fold_the_same_on_both_sides(self):
+        for i, name in enumerate(('Élise', 'émile', 'Eve', 'Straße')):
+            CustomUser.objects.create(name=name, email=f'person{i}@example.com', password='!')
+        self.assertEqual(self.names(q='él'), ['Élise'])
+        self.assertEqual(self.names(q='ÉMI'), ['émile'])
+        self.assertEqual(self.names(q='strass'), ['Straße'])
+        seen, params = [], {'limit': 1, 'q': 'É'}
+        while True:
+            page = self.client.get('/api/users/', params).json()
+            seen += [user['name'] for user in page['results']]
+            if not page['has_more']:
+                break
+            params['after'] = page['next_cursor']
+        self.assertEqual(seen, ['Élise', 'émile'])
+
+    def test_prefix_ending_in_the_last_code_point(self):
+        last = chr(0x10FFFF)
+        CustomUser.objects.create(name=f'a{last}b', email='odd@example.com', password='!')
+        CustomUser.objects.create(name='ab', email='ab@example.com', password='!')
+        self.assertEqual(self.names(q=f'a{last}'), [f'a{last}b'])
+        self.assertEqual(self.names(q=last), [])
+
+    def test_contacts_are_dm_partners_and_group_mates(self):
+        mate, stranger = self.make_users(2, 'other')
+        group = Group.objects.create(name='room', owner=self.me)
+        group.members.add(self.me, mate)
+        self.assertEqual(self.names(contacts=1), [mate.name])
+        self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': 'hi'}, format='json')
+        self.assertEqual(self.names(contacts=1), [mate.name, 'peer'])
+        self.assertEqual(self.names(contacts=1, q='pe'), ['peer'])
+        self.assertIn(stranger.name, self.names())
+
+    def test_query_count_does_not_grow_with_the_directory(self):
+        self.assertQueryCountStable(lambda: self.make_users(300, 'person'), '/api/users/', {'q': 'pe'}, expected=2)
+        self.assertQueryCountStable(lambda: self.make_users(300, 'person'), '/api/users/', {'contacts': 1}, expected=2)
+
+
+class MediaTestCase(QueryCountTestCase):
+    """Uploads land in a throwaway MEDIA_ROOT and are processed inline."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root, CHAT_MEDIA_PROCESS_INLINE=True))
+
+    def upload(self, name, content, content_type):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/messages/', {
+                'to_user': self.peer.id,
+                'attachment': SimpleUploadedFile(name, content, content_type=content_type),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return Message.objects.get(id=response.json()['id'])
+
+
+class AttachmentProcessingTests(MediaTestCase):
+
+    def test_image_gets_thumbnails_and_metadata(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 900), 'red').save(buffer, format='PNG')
+        message = self.upload('photo.jpg', buffer.getvalue(), 'image/jpeg')
+        self.assertEqual(message.media_status, Message.MEDIA_READY)
+        # The content type comes from the bytes, not the file name
+        self.assertEqual(message.attachment_content_type, 'image/png')
+        self.assertEqual((message.attachment_width, message.attachment_height), (1600, 900))
+        with Image.open(message.thumbnail.path) as thumb:
+            self.assertLessEqual(max(thumb.size), 320)
+        with Image.open(message.thumbnail_webp.path) as thumb:
+            self.assertEqual(thumb.format, 'WEBP')
+
+    def test_other_files_are_left_alone(self):
+        message = self.upload('notes.txt', b'hello', 'text/plain')
+        self.assertEqual(message.media_status, Message.MEDIA_READY)
+        self.assertEqual(message.attachment_size, 5)
+        self.assertFalse(message.thumbnail)
+
+
+    def test_requeue_processes_attachments_a_stopped_pool_left_pending(self):
+        stale = self.upload('notes.txt', b'hello', 'text/plain')
+        fresh = self.upload('more.txt', b'hello again', 'text/plain')
+        # As if the worker pool had stopped before getting to them
+        Message.objects.filter(id__in=[stale.id, fresh.id]).update(
+            media_status=Message.MEDIA_PENDING, attachment_size=None,
+        )
+        Message.objects.filter(id=stale.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        out = StringIO()
+        call_command('requeue_media', stdout=out)
+        self.assertIn('Processed 1 pending attachment(s), 0 failed.', out.getvalue())
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.media_status, stale.attachment_size), (Message.MEDIA_READY, 5))
+        self.assertEqual(fresh.media_status, Message.MEDIA_PENDING)
+
+
+class ChunkedUploadTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=root, CHAT_UPLOAD_STAGING_DIR=f'{root}/staging', CHAT_MEDIA_PROCESS_INLINE=True,
+        ))
+        self.payload = bytes(range(256)) * 40
+
+    def start(self, **extra):
+        response = self.client.post('/api/uploads/', {
+            'file_name': 'clip.bin', 'size': len(self.payload), **extra,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def put(self, upload_id, start, end, **headers):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/', self.payload[start:end], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.payload)}', **headers,
+        )
+
+    def complete(self, upload_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/uploads/{upload_id}/complete/', {'to_user': self.peer.id}, format='json')
+
+    def test_upload_resumes_and_completes_into_a_message(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.payload).hexdigest())
+        self.assertEqual(self.put(upload_id, 0, 4000).json()['received'], 4000)
+        # A gap is refused, and the client is told where to resume
+        response = self.put(upload_id, 6000, 8000)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['received'], 4000)
+        self.assertEqual(self.complete(upload_id).status_code, 409)
+        # Overlapping the received range is fine
+        self.assertEqual(self.put(upload_id, 3000, len(self.payload)).json()['received'], len(self.payload))
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(id=response.json()['id'])
+        with message.attachment.open('rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertEqual(message.attachment_size, len(self.payload))
+        self.assertFalse(Upload.objects.exists())
+
+    def test_chunk_checksum_is_verified(self):
+        upload_id = self.start()
+        response = self.put(upload_id, 0, 1000, HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['received'], 0)
+
+    def test_empty_body_is_a_bad_request(self):
+        upload_id = self.start()
+        response = self.client.put(
+            f'/api/uploads/{upload_id}/', b'', content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-99/{len(self.payload)}',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'Expected 100 bytes, got 0')
+        self.assertEqual(self.put(upload_id, 0, 100).json()['received'], 100)
+
+    def test_corrupt_overlapping_resend_keeps_received_bytes(self):
+        upload_id = self.start(sha256=hashlib.sha256(self.payload).hexdigest())
+        self.assertEqual(self.put(upload_id, 0, 4000).json()['received'], 4000)
+        good, self.payload = self.payload, self.payload[:2000] + b'\0' * (len(self.payload) - 2000)
+        response = self.put(upload_id, 2000, 6000, HTTP_X_CHUNK_SHA256=hashlib.sha256(good[2000:6000]).hexdigest())
+        self.assertEqual((response.status_code, response.json()['received']), (400, 4000))
+        self.payload = good
+        self.assertEqual(self.put(upload_id, 4000, len(good)).json()['received'], len(good))
+        # The whole-file checksum still matches, so bytes 2000-4000 survived the bad re-send
+        self.assertEqual(self.complete(upload_id).status_code, 201)
+
+    def test_size_limit(self):
+        with override_settings(CHAT_UPLOAD_MAX_SIZE=1000):
+            response = self.client.post('/api/uploads/', {'file_name': 'big.bin', 'size': 1001}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_uploads_are_private(self):
+        upload_id = self.start()
+        other = get_user_model().objects.create_user(username='peer@example.com', email='peer@example.com', password='pass')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.put(upload_id, 0, 1000).status_code, 404)
+
+
+class DeduplicatedStorageTests(MediaTestCase):
+
+    def test_same_file_is_stored_once(self):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), 'blue').save(buffer, format='PNG')
+        first = self.upload('a.png', buffer.getvalue(), 'image/png')
+        second = self.upload('forwarded.png', buffer.getvalue(), 'image/png')
+        self.assertEqual(first.attachment.name, second.attachment.name)
+        self.assertEqual(second.file_name, 'forwarded.png')
+        # The second copy reuses the first one's thumbnails instead of rendering new ones
+        self.assertEqual(first.thumbnail.name, second.thumbnail.name)
+        self.assertEqual(Blob.objects.get(name=first.attachment.name).ref_count, 2)
+        self.assertEqual(Blob.objects.get(name=first.thumbnail.name).ref_count, 2)
+
+        self.assertEqual(self.client.delete(f'/api/messages/{first.id}/').status_code, 204)
+        self.assertEqual(Blob.objects.get(name=second.attachment.name).ref_count, 1)
+        second.delete()
+        self.assertFalse(Blob.objects.filter(ref_count__gt=0).exists())
+
+        path = second.attachment.path
+        call_command('gc_blobs', grace=0, stdout=StringIO())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class MediaServingTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.message = self.upload('notes.txt', b'0123456789', 'text/plain')
+        self.url = f'/media/{self.message.attachment.name}'
+        self.outsider_auth = get_user_model().objects.create_user(
+            username='out@example.com', email='out@example.com', password='pass'
+        )
+        self.outsider = CustomUser.objects.create(name='out', email='out@example.com', password='!')
+
+    def test_ranges_and_revalidation(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertEqual(response['ETag'], f'"{digest}"')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # Not something to render on our origin
+        self.assertEqual(response['Content-Disposition'], 'attachment')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+        # A stale If-Range gets the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{digest}"')
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_streams_asynchronously_under_asgi(self):
+        request = AsyncRequestFactory().get(self.url, headers={'Range': 'bytes=5-'})
+        force_authenticate(request, self.auth_user)
+        response = MediaView.as_view()(request, name=self.message.attachment.name)
+        self.assertTrue(response.is_async)
+
+        async def body():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual((response.status_code, asyncio.run(body())), (206, b'56789'))
+
+    def test_only_the_conversation_can_read(self):
+        self.client.force_authenticate(self.outsider_auth)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        group = Group.objects.create(name='room', owner=self.me)
+        group.members.add(self.me, self.outsider)
+        Message.objects.create(
+            sender=self.me, to_group=group, conversation=f'g:{group.id}', attachment=self.message.attachment.name,
+        )
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get('/media/../db.sqlite3').status_code, 404)
+
+    def test_site_artwork_is_public(self):
+        with open(os.path.join(self.media_root, 'icon.png'), 'wb') as f:
+            f.write(b'png')
+        self.client.force_authenticate(None)
+        response = self.client.get('/media/icon.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response['Content-Type'], response['Content-Disposition']), ('image/png', 'inline'))
+        self.assertTrue(response['Cache-Control'].startswith('public'))
+
+    def test_transfer_can_be_offloaded(self):
+        with override_settings(CHAT_MEDIA_OFFLOAD='nginx'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.message.attachment.name}')
+        self.assertEqual(response.content, b'')
+        with override_settings(CHAT_MEDIA_OFFLOAD='sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.message.attachment.path)
+
+
+class HistorySerializationTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(2):
+            self.client.post('/api/messages/', {'to_user': self.peer.id, 'text': f'old {i}'}, format='json')
+        reactions.add_reaction(Message.objects.order_by('id').first(), self.peer, '🎉')
+        Message.objects.update(created_at=timezone.now() - timedelta(days=400))
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), 'green').save(buffer, format='PNG')
+        photo = self.upload('photo.png', buffer.getvalue(), 'image/png')
+        reactions.add_reaction(photo, self.me, '👍')
+        self.upload('notes.txt', b'hello', 'text/plain')
+        Message.objects.create(sender=self.peer, to_user=self.me, text='reply')
+        call_command('archive_messages', stdout=StringIO())
+
+    def test_fast_path_matches_message_serializer(self):
+        response = self.client.get('/api/messages/', {'user_id': self.peer.id})
+        self.assertEqual(ArchivedMessage.objects.count(), 2)
+        archived = [row.as_message(self.me) for row in ArchivedMessage.objects.select_related('sender').order_by('id')]
+        hot = Message.objects.select_related('sender').prefetch_related(reactions.prefetch_reactions(self.me))
+        context = {
+            'request': response.wsgi_request, 'custom_user': self.me,
+            'receipts': receipts.load_receipts(dm_conversation_key(self.me.id, self.peer.id)),
+        }
+        expected = MessageSerializer(archived + list(hot.order_by('id')), many=True, context=context).data
+        self.assertEqual(response.json()['results'], json.loads(json.dumps(expected)))
+        self.assertTrue(response.json()['results'][2]['is_image'])
+
+    def test_compact_pages_send_each_sender_once(self):
+        page = self.client.get('/api/messages/', {'user_id': self.peer.id, 'compact': '1'}).json()
+        self.assertEqual([m['sender'] for m in page['results']], [self.me.id] * 4 + [self.peer.id])
+        self.assertEqual(page['users'], {
+            str(user.id): dict(ChatUserSerializer(user).data) for user in (self.me, self.peer)
+        })
+
+    def test_renderer_writes_what_drf_would(self):
+        data = {
+            'at': datetime(2024, 5, 1, 12, 30, 15, 250000, tzinfo=dt_timezone.utc),
+            'watermarks': {3: {'read': 7}},
+            'price': Decimal('1.5'),
+            'text': 'line\u2028break ünïcode',
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        pretty = ORJSONRenderer().render(data, 'application/json; indent=4')
+        self.assertEqual(json.loads(pretty), json.loads(JSONRenderer().render(data)))
+
+
+class MessageSearchTests(QueryCountTestCase):
+
+    def send(self, text, **target):
+        response = self.client.post('/api/messages/', {'text': text, **(target or {'to_user': self.peer.id})}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def search(self, q, **params):
+        response = self.client.get('/api/messages/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_index_follows_create_edit_and_delete(self):
+        message_id = self.send('Lunch at the <b>harbour</b> café?')
+        hit = self.search('harb')['results'][0]
+        self.assertEqual(hit['id'], message_id)
+        self.assertIn('<mark>harbour</mark>', hit['highlight'])
+        self.assertIn('&lt;b&gt;', hit['highlight'])
+        # Diacritics fold, so "cafe" finds "café"
+        self.assertEqual(len(self.search('cafe')['results']), 1)
+
+        self.client.patch(f'/api/messages/{message_id}/', {'text': 'Dinner instead'}, format='json')
+        self.assertEqual(self.search('harbour')['results'], [])
+        self.assertEqual(self.search('dinner')['results'][0]['id'], message_id)
+
+        self.client.delete(f'/api/messages/{message_id}/')
+        self.assertEqual(self.search('dinner')['results'], [])
+
+    def test_results_are_scoped_to_the_caller(self):
+        stranger = CustomUser.objects.create(name='stranger', email='stranger@example.com', password='!')
+        Message.objects.create(sender=self.peer, to_user=stranger, text='secret harbour plans')
+        room = Group.objects.create(name='crew', owner=self.peer)
+        room.members.set([self.peer, self.me])
+        Message.objects.create(sender=self.peer, to_group=room, text='crew harbour meetup')
+        mine = self.send('my harbour note')
+        found = {m['id'] for m in self.search('harbour')['results']}
+        self.assertEqual(len(found), 2)
+        self.assertIn(mine, found)
+        self.assertEqual(len(self.search('harbour', group_id=room.id)['results']), 1)
+
+    def test_ranking_and_paging(self):
+        self.send('harbour')
+        best = self.send('harbour harbour harbour')
+        page = self.search('harbour', limit=1)
+        self.assertEqual(page['results'][0]['id'], best)
+        self.assertTrue(page['has_more'])
+        self.assertFalse(self.search('harbour', limit=1, offset=page['next_offset'])['has_more'])
+
+    def test_operators_are_plain_text(self):
+        self.send('quote " and NEAR( stuff')
+        self.assertEqual(len(self.search('"near(')['results']), 1)
+
+    def test_triggers_come_back_after_a_table_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER chat_message_fts_insert')
+        ensure_search_triggers()
+        self.send('rebuilt harbour')
+        self.assertEqual(len(self.search('rebuilt')['results']), 1)
+        self.assertEqual(self.client.get('/api/messages/search/', {'q': '  "" '}).status_code, 400)
+
+    def test_admin_match_follows_the_read_database(self):
+        # SQL for the database the rows are read from, not whatever 'default' is
+        with mock.patch('Chat.search.router.db_for_read', return_value='replica'), \
+                mock.patch('Chat.search.connections', {'replica': mock.Mock(vendor='postgresql')}):
+            [(_, rows)] = text_match('Café harbour').children
+        self.assertIn('to_tsvector', rows.sql)
+        self.assertEqual(rows.params, ['cafe & harbour:*'])
+
+
+class ConversationSummaryTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.peer_auth = get_user_model().objects.create_user(
+            username='peer@example.com', email='peer@example.com', password='pass'
+        )
+
+    def send(self, as_user, text, **target):
+        self.client.force_authenticate(as_user)
+        response = self.client.post('/api/messages/', {'text': text, **target}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(self.auth_user)
+        return response.json()['id']
+
+    def inbox(self):
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_inbox_query_count(self):
+        def grow():
+            for user in self.make_users(10, 'contact'):
+                Message.objects.create(sender=user, to_user=self.me, text='hi')
+                conversations.record_message(Message.objects.latest('id'))
+
+        self.send(self.auth_user, 'first', to_user=self.peer.id)
+        self.assertQueryCountStable(grow, '/api/conversations/', expected=3)
+        self.assertEqual(len(self.inbox()), 11)
+
+    def test_unread_counts_follow_writes_and_reads(self):
+        self.send(self.auth_user, 'ping', to_user=self.peer.id)
+        self.send(self.peer_auth, 'pong', to_user=self.me.id)
+        last = self.send(self.peer_auth, 'still there?', to_user=self.me.id)
+        [entry] = self.inbox()
+        self.assertEqual((entry['type'], entry['id'], entry['name']), ('user', self.peer.id, 'peer'))
+        self.assertEqual(entry['unread_count'], 2)
+        self.assertEqual(entry['last_message']['id'], last)
+
+        # Deleting an unread message uncounts it and the preview falls back
+        self.client.force_authenticate(self.peer_auth)
+        self.client.delete(f'/api/messages/{last}/')
+        self.client.force_authenticate(self.auth_user)
+        [entry] = self.inbox()
+        self.assertEqual(entry['unread_count'], 1)
+        self.assertEqual(entry['last_message']['text'], 'pong')
+
+        response = self.client.post('/api/conversations/read/', {'user_id': self.peer.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.inbox()[0]['unread_count'], 0)
+
+    def test_groups_show_up_ordered_by_activity(self):
+        response = self.client.post('/api/groups/', {'name': 'crew', 'member_ids': [self.peer.id]}, format='json')
+        group_id = response.json()['id']
+        self.send(self.auth_user, 'dm', to_user=self.peer.id)
+        self.assertEqual([e['type'] for e in self.inbox()], ['user', 'group'])
+        self.send(self.peer_auth, 'hello crew', to_group=group_id)
+        entries = self.inbox()
+        self.assertEqual((entries[0]['type'], entries[0]['unread_count']), ('group', 1))
+
+        page = self.client.get('/api/conversations/', {'limit': 1}).json()
+        self.assertTrue(page['has_more'])
+        rest = self.client.get('/api/conversations/', {'limit': 1, 'before': page['before_cursor']}).json()
+        self.assertEqual(rest['results'][0]['type'], 'user')
+        self.assertFalse(rest['has_more'])
+
+
+class ReadReceiptTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(CHAT_ACK_FLUSH_INTERVAL=60))
+
+    def receive(self, count, **target):
+        ids = []
+        for i in range(count):
+            message = Message.objects.create(sender=self.peer, text=f'news {i}', **target)
+            conversations.record_message(message)
+            ids.append(message.id)
+        return ids
+
+    def history(self, **params):
+        return self.client.get('/api/messages/', params).json()
+
+    def test_group_burst_is_written_in_one_batch(self):
+        def read_burst(members):
+            room = Group.objects.create(name=f'room{len(members)}', owner=self.peer)
+            room.members.set([self.me, self.peer, *members])
+            conversations.open_group(room)
+            last = self.receive(10, to_group=room)[-1]
+            for member in [self.me, *members]:
+                # Every message acknowledged one by one; only the highest id survives
+                for message_id in range(last - 9, last + 1):
+                    receipts.ack_buffer.add(member.id, f'g:{room.id}', read=message_id)
+            with CaptureQueriesContext(connection) as ctx:
+                moved = receipts.ack_buffer.flush()
+            self.assertEqual(len(moved), len(members) + 1)
+            return room, len(ctx.captured_queries)
+
+        _, small = read_burst(self.make_users(2, 'few'))
+        room, large = read_burst(self.make_users(40, 'many'))
+        self.assertEqual(small, large)
+
+        data = self.history(group_id=room.id)
+        self.assertEqual(data['results'][-1]['receipt'], {'recipients': 41, 'delivered': 41, 'read': 41})
+        self.assertEqual(data['watermarks'][str(self.me.id)]['read'], data['results'][-1]['id'])
+
+    def test_recount_over_many_conversations(self):
+        # One flush leaving more conversations partly read than SQLite nests expressions
+        peers = self.make_users(1100, 'sender')
+        messages = [
+            Message(sender=peer, to_user=self.me, text=text) for peer in peers for text in ('first', 'second')
+        ]
+        for message in messages:
+            message.assign_conversation()
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            conversations.record_messages(messages)
+        moved = receipts.write_acks({
+            (self.me.id, first.conversation): (None, first.id) for first in messages[::2]
+        })
+        self.assertEqual(len(moved), len(peers))
+        self.assertEqual({row.unread_count for row in moved}, {1})
+
+
+    def test_racing_first_messages_both_count(self):
+        real = conversations._new_summary
+
+        def raced(message, user_id):
+            # Another first message of the DM committed its row between our UPDATE and INSERT
+            if not ConversationSummary.objects.filter(conversation=message.conversation, user_id=user_id).exists():
+                ConversationSummary.objects.create(
+                    user_id=user_id, conversation=message.conversation, peer_id=message.sender_id,
+                    last_activity_at=message.created_at, unread_count=1,
+                )
+            return real(message, user_id)
+
+        with mock.patch.object(conversations, '_new_summary', raced):
+            message_id = self.receive(1, to_user=self.me)[0]
+            other = self.make_users(1, 'racer')[0]
+            fresh = Message(sender=self.peer, to_user=other, text='bulk')
+            fresh.assign_conversation()
+            Message.objects.bulk_create([fresh])
+            conversations.record_messages([fresh])
+        # The other message's count, plus this one
+        mine = ConversationSummary.objects.get(user=self.me, conversation=dm_conversation_key(self.me.id, self.peer.id))
+        self.assertEqual((mine.unread_count, mine.last_message_id), (2, message_id))
+        theirs = ConversationSummary.objects.get(user=other, conversation=fresh.conversation)
+        self.assertEqual((theirs.unread_count, theirs.last_message_id), (2, fresh.id))
+
+    def test_failed_flush_keeps_the_acks_for_the_next_one(self):
+        first, second, last = self.receive(3, to_user=self.me)
+        conversation = dm_conversation_key(self.me.id, self.peer.id)
+        receipts.ack_buffer.add(self.me.id, conversation, read=second)
+        with mock.patch.object(receipts, 'write_acks', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                receipts.ack_buffer.flush()
+        # Acked again meanwhile, lower: the higher watermark survives
+        receipts.ack_buffer.add(self.me.id, conversation, read=first)
+        moved = receipts.ack_buffer.flush()
+        self.assertEqual([row.last_read_id for row in moved], [second])
+        self.assertEqual(ConversationSummary.objects.get(user=self.me, conversation=conversation).unread_count, 1)
+
+    def test_watermarks_recount_unread_and_stay_bounded(self):
+        first, second, last = self.receive(3, to_user=self.me)
+        with override_settings(CHAT_ACK_FLUSH_INTERVAL=0):
+            self.client.post('/api/conversations/read/', {'user_id': self.peer.id, 'read': first}, format='json')
+            self.assertEqual(self.client.get('/api/conversations/').json()['results'][0]['unread_count'], 2)
+            receipt = self.history(user_id=self.peer.id)['results']
+            self.assertEqual([m['receipt']['read'] for m in receipt], [1, 0, 0])
+
+            # Ids past the last message cannot pre-read future messages
+            self.client.post('/api/conversations/read/', {'user_id': self.peer.id, 'read': last + 100}, format='json')
+            summary = ConversationSummary.objects.get(user=self.me, conversation=f'u:{self.me.id}:{self.peer.id}')
+            self.assertEqual((summary.last_read_id, summary.last_delivered_id, summary.unread_count), (last, last, 0))
+
+            # Watermarks never move back
+            self.client.post('/api/conversations/read/', {'user_id': self.peer.id, 'read': second}, format='json')
+            summary.refresh_from_db()
+            self.assertEqual(summary.last_read_id, last)
+
+
+class ReactionTests(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.room = Group.objects.create(name='crew', owner=self.peer)
+        self.crew = self.make_users(3, 'crew')
+        self.room.members.set([self.me, self.peer, *self.crew])
+        self.message = Message.objects.create(sender=self.peer, to_group=self.room, text='lunch?')
+
+    def react(self, emoji, method='post'):
+        url = f'/api/messages/{self.message.id}/reactions/'
+        if method == 'post':
+            return self.client.post(url, {'emoji': emoji}, format='json')
+        return self.client.delete(f'{url}?emoji={emoji}')
+
+    def test_many_users_many_emoji(self):
+        for user in self.crew:
+            reactions.add_reaction(self.message, user, '👍')
+        reactions.add_reaction(self.message, self.crew[0], '🎉')
+        self.assertEqual(self.react('👍').status_code, 201)
+        self.assertEqual(self.react('❤️').status_code, 201)
+        # Reacting twice with the same emoji is a no-op
+        response = self.react('👍')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['reactions'], [
+            {'emoji': '👍', 'count': 4, 'me': True},
+            {'emoji': '🎉', 'count': 1, 'me': False},
+            {'emoji': '❤️', 'count': 1, 'me': True},
+        ])
+
+        self.assertEqual(self.react('❤️', 'delete').status_code, 200)
+        history = self.client.get('/api/messages/', {'group_id': self.room.id}).json()['results']
+        self.assertEqual([(r['emoji'], r['count']) for r in history[0]['reactions']], [('👍', 4), ('🎉', 1)])
+        self.assertEqual(
+            ReactionCount.objects.get(message=self.message, emoji='👍').count,
+            Reaction.objects.filter(message=self.message, emoji='👍').count(),
+        )
+
+    def test_history_reactions_do_not_add_queries_per_message(self):
+        def grow():
+            for i in range(10):
+                message = Message.objects.create(sender=self.peer, to_group=self.room, text=f'more {i}')
+                for user in self.crew:
+                    reactions.add_reaction(message, user, '👍')
+
+        reactions.add_reaction(self.message, self.me, '👍')
+        self.assertQueryCountStable(grow, '/api/messages/', {'group_id': self.room.id})
+
+    def test_only_participants_can_react(self):
+        outsider = Message.objects.create(sender=self.peer, to_user=self.crew[0], text='psst')
+        response = self.client.post(f'/api/messages/{outsider.id}/reactions/', {'emoji': '👍'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Reaction.objects.exists())
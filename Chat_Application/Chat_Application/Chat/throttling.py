@@ -0,0 +1,194 @@
+"""
+Token-bucket rate limits for the write and auth endpoints.
+
+Each scope in ``CHAT_THROTTLE_RATES`` has one budget per user (``send``,
+``upload``; ``auth`` is per attempted account) and one per client IP
+(``send_ip``, ...). A rate of ``"60/min"`` is a bucket of 60 tokens that
+refills at one per second, so a client can burst up to 60 requests and then
+keeps going at the refill rate. A request spends a token from every bucket
+it falls under (a bulk send one per message); when one is short it gets a
+429 with ``Retry-After`` set to when that bucket will have enough again.
+A request costing more than a whole bucket can never pass and gets a 429
+without ``Retry-After``. ``None`` turns a budget off.
+
+Buckets live in the ``default`` cache, so they are shared the same way the
+list cache is: per process with ``locmem``, by every server with
+``CHAT_CACHE=redis``, where a Lua script refills and spends each bucket in
+one atomic step.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+# KEYS[1]: bucket; ARGV: capacity, tokens per second, cost. Returns the wait in seconds.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or capacity
+local at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+_local_lock = threading.Lock()
+
+# (cache backend, Script bound to a client of its server), made on first use
+_redis_script = None
+_redis_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """``"60/min"`` -> ``(60, 1.0)``: bucket size and tokens added per second. None stays None."""
+    if rate is None:
+        return None
+    count, _, period = rate.partition('/')
+    return int(count), int(count) / PERIODS[period]
+
+
+def rate_for(scope):
+    return parse_rate(getattr(settings, 'CHAT_THROTTLE_RATES', {}).get(scope))
+
+
+def _refill(tokens, at, now, capacity, per_second):
+    return min(capacity, tokens + max(0.0, now - at) * per_second)
+
+
+def _take_script(backend):
+    """
+    ``TAKE_SCRIPT`` registered once, on a client of the primary (the first
+    ``LOCATION``) of the ``default`` cache, built from the same settings the
+    cache builds its own pool from. The script is then run by its SHA; redis-py
+    loads it again by itself if the server was restarted.
+    """
+    global _redis_script
+    with _redis_lock:
+        # override_settings(CACHES=...) replaces the backend; follow it to its server
+        if _redis_script is None or _redis_script[0] is not backend:
+            import redis
+
+            config = settings.CACHES['default']
+            location = config['LOCATION']
+            location = location.split(',')[0] if isinstance(location, str) else location[0]
+            options = {k: v for k, v in config.get('OPTIONS', {}).items() if k != 'parser_class'}
+            pool = options.pop('pool_class', redis.ConnectionPool).from_url(location, **options)
+            _redis_script = backend, redis.Redis(connection_pool=pool).register_script(TAKE_SCRIPT)
+        return _redis_script[1]
+
+
+def take(key, capacity, per_second, cost=1):
+    """Spend ``cost`` tokens from bucket ``key``; returns 0 when allowed, else seconds until it would be."""
+    key = f'chat:throttle:{key}'
+    backend = caches['default']
+    if isinstance(backend, RedisCache):
+        key = backend.make_and_validate_key(key)
+        return float(_take_script(backend)(keys=[key], args=[capacity, per_second, cost]))
+    # locmem is per process, so a process lock makes the read and the write one step
+    with _local_lock:
+        now = time.time()
+        tokens, at = cache.get(key, (capacity, now))
+        tokens = _refill(tokens, at, now, capacity, per_second)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / per_second
+        cache.set(key, (tokens, now), timeout=math.ceil(capacity / per_second))
+    return wait
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Spends ``cost`` tokens per write from the ``scope`` budget of the caller
+    (``subject``), then from the ``<scope>_ip`` budget of their address.
+    Reads are never throttled.
+    """
+    scope = None
+
+    def cost(self, request):
+        return 1
+
+    def subject(self, request):
+        user = getattr(request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def buckets(self, request):
+        subject = self.subject(request)
+        if subject is not None:
+            yield self.scope, f'{self.scope}:{subject}'
+        yield f'{self.scope}_ip', f'{self.scope}_ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        self.delay = 0.0
+        if request.method in SAFE_METHODS:
+            return True
+        cost = self.cost(request)
+        for scope, key in self.buckets(request):
+            rate = rate_for(scope)
+            if rate is not None:
+                if cost > rate[0]:
+                    # More than the bucket holds; waiting would not help
+                    self.delay = None
+                    return False
+                self.delay = take(key, *rate, cost=cost)
+                if self.delay:
+                    # Stop here, so a caller over their own budget doesn't also drain their address's
+                    return False
+        return True
+
+    def wait(self):
+        return self.delay
+
+
+class SendRateThrottle(BucketThrottle):
+    scope = 'send'
+
+
+class BulkSendRateThrottle(SendRateThrottle):
+    """The ``send`` budgets, charged one token per message of the batch."""
+
+    def cost(self, request):
+        messages = request.data.get('messages') if hasattr(request.data, 'get') else None
+        return max(len(messages), 1) if isinstance(messages, list) else 1
+
+
+class UploadRateThrottle(BucketThrottle):
+    scope = 'upload'
+
+
+class AuthRateThrottle(BucketThrottle):
+    """Logins and signups, budgeted per attempted email as well as per IP."""
+    scope = 'auth'
+
+    def subject(self, request):
+        data = getattr(request, 'data', request.POST)
+        email = data.get('email')
+        if not isinstance(email, str) or not email.strip():
+            return None
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+
+
+def check(throttle, request):
+    """Run ``throttle`` outside DRF (the form views); returns the wait, 0 when allowed."""
+    return 0 if throttle.allow_request(request, None) else throttle.wait()
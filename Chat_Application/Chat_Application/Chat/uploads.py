@@ -0,0 +1,146 @@
+"""
+Chunked, resumable attachment uploads.
+
+A client initiates an upload with the final size (and optionally its SHA-256),
+PUTs byte ranges with ``Content-Range`` and, once every byte has arrived,
+completes it into a ``Message``. Bytes are streamed from the request straight
+into a staging file at their offset, so neither the chunk nor the file is ever
+held in memory, and a dropped connection only loses the chunk in flight.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from .models import Upload
+
+
+READ_SIZE = 64 * 1024
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class UploadError(ValueError):
+    """A chunk or completion the upload cannot accept; ``status`` is the HTTP code."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class StagedFile(File):
+    """
+    A finished staging file. ``temporary_file_path`` lets FileSystemStorage
+    move it into place instead of copying; other storages stream it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def max_size():
+    return getattr(settings, 'CHAT_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+
+
+def max_chunk():
+    return getattr(settings, 'CHAT_UPLOAD_MAX_CHUNK', 8 * 1024 * 1024)
+
+
+def staging_path(upload):
+    return os.path.join(settings.CHAT_UPLOAD_STAGING_DIR, f'{upload.id.hex}.part')
+
+
+def open_staging(upload):
+    """Create the (empty) staging file for a new upload."""
+    os.makedirs(settings.CHAT_UPLOAD_STAGING_DIR, exist_ok=True)
+    with open(staging_path(upload), 'wb'):
+        pass
+
+
+def discard(upload):
+    try:
+        os.remove(staging_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def parse_content_range(header, size):
+    """``bytes first-last/total`` -> ``(first, last + 1)``, checked against ``size``."""
+    match = _CONTENT_RANGE.match(header or '')
+    if not match:
+        raise UploadError('Content-Range header of the form "bytes first-last/total" is required')
+    first, last, total = match.groups()
+    start, end = int(first), int(last) + 1
+    if total != '*' and int(total) != size:
+        raise UploadError('Content-Range total does not match the upload size')
+    if start >= end or end > size:
+        raise UploadError('Content-Range is outside the upload', status=416)
+    if end - start > max_chunk():
+        raise UploadError(f'Chunks may be at most {max_chunk()} bytes', status=413)
+    return start, end
+
+
+def write_chunk(upload, stream, content_range, checksum=None):
+    """
+    Write one ``Content-Range`` chunk from ``stream`` and advance
+    ``upload.received``. Chunks must start at or before the current offset;
+    re-sending bytes that already arrived is harmless: they are read and
+    checksummed but never written again, so a corrupt or cut-off re-send
+    cannot damage them.
+    """
+    start, end = parse_content_range(content_range, upload.size)
+    received = upload.received
+    if start > received:
+        raise UploadError(f'Chunk starts at {start} but only {received} bytes have been received', status=409)
+    if stream is None:
+        # DRF gives no stream for an empty body
+        raise UploadError(f'Expected {end - start} bytes, got 0')
+    digest = hashlib.sha256()
+    written = 0
+    with open(staging_path(upload), 'r+b') as f:
+        while written < end - start:
+            data = stream.read(min(READ_SIZE, end - start - written))
+            if not data:
+                break
+            digest.update(data)
+            position = start + written
+            written += len(data)
+            skip = max(received - position, 0)
+            if skip < len(data):
+                f.seek(position + skip)
+                f.write(data[skip:])
+    if written != end - start:
+        # The connection dropped mid-chunk; the offset stays put so it can be resent
+        raise UploadError(f'Expected {end - start} bytes, got {written}')
+    if checksum and checksum.lower() != digest.hexdigest():
+        raise UploadError('Chunk checksum mismatch')
+    # Only move forward, and only from a contiguous offset, even with concurrent PUTs
+    Upload.objects.filter(id=upload.id, received__gte=start, received__lt=end).update(
+        received=end, updated_at=timezone.now()
+    )
+    upload.refresh_from_db(fields=['received', 'updated_at'])
+    return upload
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish(upload):
+    """The verified staging file, ready to hand to ``FieldFile.save``."""
+    if not upload.is_complete:
+        raise UploadError(f'Upload incomplete: {upload.received} of {upload.size} bytes received', status=409)
+    path = staging_path(upload)
+    if upload.sha256 and _file_sha256(path) != upload.sha256:
+        # Something was corrupted along the way; start over rather than keep bad bytes
+        Upload.objects.filter(id=upload.id).update(received=0)
+        raise UploadError('File checksum mismatch; the upload has been reset', status=422)
+    return StagedFile(open(path, 'rb'), name=upload.file_name)
@@ -1,7 +1,6 @@
 from django.urls import path
 from django.conf import settings
-from django.conf.urls.static import static
-from . import views
+from . import async_views, media, metrics, views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -15,11 +14,24 @@ urlpatterns = [
     path('api/auth/me/', views.me_view, name='api-me'),
     path('api/users/', views.UserListView.as_view(), name='api-users'),
     path('api/groups/', views.GroupListCreateView.as_view(), name='api-groups'),
+    path('api/conversations/', views.ConversationListView.as_view(), name='api-conversations'),
+    path('api/conversations/read/', views.ConversationReadView.as_view(), name='api-conversations-read'),
     path('api/messages/', views.MessageListCreateView.as_view(), name='api-messages'),
+    path('api/messages/bulk/', views.MessageBulkCreateView.as_view(), name='api-messages-bulk'),
     path('api/messages/<int:pk>/', views.MessageDetailView.as_view(), name='api-message-detail'),
+    path('api/messages/<int:pk>/reactions/', views.MessageReactionView.as_view(), name='api-message-reactions'),
     path('api/messages/export/', views.export_csv, name='api-messages-export'),
+    path('api/messages/search/', views.MessageSearchView.as_view(), name='api-messages-search'),
+    # Chunked, resumable attachment uploads
+    path('api/uploads/', views.UploadListCreateView.as_view(), name='api-uploads'),
+    path('api/uploads/<uuid:pk>/', views.UploadDetailView.as_view(), name='api-upload-detail'),
+    path('api/uploads/<uuid:pk>/complete/', views.UploadCompleteView.as_view(), name='api-upload-complete'),
+    # ASGI-native variants of the read-heavy endpoints
+    path('api/async/users/', async_views.AsyncUserListView.as_view(), name='api-async-users'),
+    path('api/async/groups/', async_views.AsyncGroupListCreateView.as_view(), name='api-async-groups'),
+    path('api/async/messages/', async_views.AsyncMessageListCreateView.as_view(), name='api-async-messages'),
+    # Prometheus scrape endpoint
+    path('metrics', metrics.metrics_view, name='metrics'),
+    # Uploads, checked against conversation membership (see Chat/media.py)
+    path(settings.MEDIA_URL.lstrip('/') + '<path:name>', media.MediaView.as_view(), name='media'),
 ]
-
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,22 +1,43 @@
-import csv
-from io import StringIO
+import math
+from datetime import datetime, time, timedelta
+from functools import partial
 
 from django.contrib.auth import authenticate, login, logout as auth_logout
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.db import models
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.exceptions import ParseError, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import Group, Message, User as CustomUser
-from .serializers import AuthUserSerializer, ChatUserSerializer, GroupSerializer, MessageSerializer
+from . import archive, caching, conversations, directory, history, receipts, search, uploads
+from .reactions import MAX_EMOJI_LENGTH, add_reaction, prefetch_reactions, remove_reaction
+from .models import Group, Message, Upload, User as CustomUser, dm_conversation_key, group_conversation_key
+from .attachments import schedule_processing
+from .auth import get_chat_user, tokens_for
+from .exports import EXPORT_FORMATS, stream_export
+from .pagination import (
+    InvalidCursor, decode_cursor, encode_cursor, keyset_after, keyset_before, paginate_messages, parse_limit,
+)
+from .realtime import (
+    MESSAGE_CREATED, MESSAGE_DELETED, MESSAGE_REACTED, MESSAGE_UPDATED,
+    publish_message_event, publish_message_events,
+)
+from .serializers import (
+    AuthUserSerializer, BulkMessageSerializer, ConversationSerializer, GroupSerializer, MessageSerializer,
+    UploadSerializer,
+)
+from .storage import release
+from .throttling import AuthRateThrottle, BulkSendRateThrottle, SendRateThrottle, UploadRateThrottle, check
 
 User = get_user_model()
 
@@ -30,22 +51,17 @@ def index(request):
 def chat(request):
     # Handle authentication - if not logged in, still render page but show login modal
     current_custom_user = None
-    users = CustomUser.objects.none()
     groups = Group.objects.none()
     
     if request.user.is_authenticated:
-        # Get all users (from custom User model)
-        try:
-            current_custom_user = CustomUser.objects.get(email=request.user.email)
-            groups = Group.objects.filter(members=current_custom_user).distinct()
-            users = CustomUser.objects.exclude(id=current_custom_user.id)
-        except CustomUser.DoesNotExist:
-            pass
+        # People are loaded by the page itself, from the directory API
+        current_custom_user = get_chat_user(request)
+        if current_custom_user:
+            groups = Group.objects.filter(members=current_custom_user).distinct().prefetch_related('members')
     
     context = {
         'current_user': request.user,
         'current_custom_user': current_custom_user,
-        'users': users,
         'groups': groups,
         'MEDIA_URL': settings.MEDIA_URL,
     }
@@ -54,6 +70,7 @@ def chat(request):
 
 @api_view(['POST'])
 @permission_classes([])
+@throttle_classes([AuthRateThrottle])
 @csrf_exempt
 def login_view(request):
     email = request.data.get('email')
@@ -61,7 +78,7 @@ def login_view(request):
     user = authenticate(request, username=email, password=password)
     if not user:
         return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
-    refresh = RefreshToken.for_user(user)
+    refresh = tokens_for(user)
     return Response({
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -71,6 +88,7 @@ def login_view(request):
 
 @api_view(['POST'])
 @permission_classes([])
+@throttle_classes([AuthRateThrottle])
 @csrf_exempt
 def signup_view(request):
     email = request.data.get('email')
@@ -81,7 +99,7 @@ def signup_view(request):
     if User.objects.filter(username=email).exists():
         return Response({'detail': 'User already exists'}, status=status.HTTP_400_BAD_REQUEST)
     user = User.objects.create_user(username=email, email=email, password=password, first_name=name)
-    refresh = RefreshToken.for_user(user)
+    refresh = tokens_for(user)
     return Response({
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -89,8 +107,22 @@ def signup_view(request):
     }, status=status.HTTP_201_CREATED)
 
 
+def throttled_form(request):
+    """The page to show instead when the form views' auth budget is spent, else None."""
+    wait = check(AuthRateThrottle(), request)
+    if not wait:
+        return None
+    seconds = math.ceil(wait)
+    response = render(request, 'chat.html', {'error': f'Too many attempts, try again in {seconds} seconds'},
+                      status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(seconds)
+    return response
+
+
 def login_form_view(request):
     if request.method == 'POST':
+        if response := throttled_form(request):
+            return response
         email = request.POST.get('email')
         password = request.POST.get('password')
         user = authenticate(request, username=email, password=password)
@@ -107,6 +139,8 @@ def login_form_view(request):
 
 def signup_form_view(request):
     if request.method == 'POST':
+        if response := throttled_form(request):
+            return response
         email = request.POST.get('email')
         password = request.POST.get('password')
         name = request.POST.get('name') or email
@@ -144,88 +178,273 @@ def me_view(request):
     return Response(AuthUserSerializer(request.user).data)
 
 
+def parse_conversation(custom_user, params):
+    """
+    Conversation key named by ``user_id``/``group_id``, plus the group id when
+    membership still has to be checked.
+    """
+    user_id = params.get('user_id')
+    group_id = params.get('group_id')
+    if not user_id and not group_id:
+        raise ParseError('user_id or group_id is required')
+    try:
+        if user_id:
+            return dm_conversation_key(custom_user.id, user_id), None
+        group_id = int(group_id)
+    except ValueError:
+        raise ParseError('user_id and group_id must be integers')
+    return group_conversation_key(group_id), group_id
+
+
+def conversation_messages(custom_user, key, group_id):
+    """
+    Every message (soft-deleted included) of the conversation ``key``, as
+    returned with ``group_id`` by ``parse_conversation``, looked up through
+    the conversation key index.
+    """
+    if group_id and not Group.objects.filter(id=group_id, members=custom_user).exists():
+        raise PermissionDenied('Not a member of this group')
+    return Message.objects.filter(conversation=key)
+
+
 class UserListView(APIView):
+    """
+    The user directory, a page at a time: ``q`` searches name and email
+    prefixes, ``contacts=1`` keeps people the caller talks to, ``after``
+    continues from ``next_cursor``.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         if not custom_user:
             return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
-        qs = CustomUser.objects.exclude(id=custom_user.id)
-        return Response(ChatUserSerializer(qs, many=True).data)
+        try:
+            page = directory.DirectoryPage(custom_user, request.query_params)
+        except InvalidCursor as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if not page.shared:
+            return Response(directory.directory_page(page))
+        version = caching.users_version()
+        tag = page.etag(version)
+        if caching.fresh(request, tag):
+            return caching.tagged(tag)
+        return caching.tagged(tag, directory.directory_page(page, version))
 
 
 class GroupListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         if not custom_user:
             return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
-        groups = Group.objects.filter(members=custom_user).distinct()
-        return Response(GroupSerializer(groups, many=True).data)
+        version = caching.groups_version(custom_user)
+        tag = caching.etag('groups', version, custom_user)
+        if caching.fresh(request, tag):
+            return caching.tagged(tag)
+        return caching.tagged(tag, caching.group_list(custom_user, version))
 
     def post(self, request):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         if not custom_user:
             return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
         serializer = GroupSerializer(data=request.data, context={'request': request, 'custom_user': custom_user})
         serializer.is_valid(raise_exception=True)
-        group = serializer.save()
+        with transaction.atomic():
+            group = serializer.save()
+            conversations.open_group(group)
         return Response(GroupSerializer(group).data, status=status.HTTP_201_CREATED)
 
 
 class MessageListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SendRateThrottle]
 
     def get(self, request):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         if not custom_user:
             return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
-        user_id = request.query_params.get('user_id')
-        group_id = request.query_params.get('group_id')
-        if not user_id and not group_id:
-            return Response({'detail': 'user_id or group_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        key, group_id = parse_conversation(custom_user, request.query_params)
+        qs = history.page_rows(conversation_messages(custom_user, key, group_id))
+        try:
+            rows, meta = paginate_messages(qs, request.query_params, cold=partial(history.archived_rows, key))
+        except InvalidCursor as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        reactions = history.load_reactions(rows, custom_user)
+        watermarks = receipts.load_receipts(key)
+        return Response(history.page_response(
+            rows, meta, watermarks, reactions, request, history.wants_compact(request.query_params),
+        ))
 
-        qs = Message.objects.filter(is_deleted=False)
-        if user_id:
-            qs = qs.filter(
-                (models.Q(sender=custom_user, to_user_id=user_id) |
-                 models.Q(sender_id=user_id, to_user=custom_user))
+    def post(self, request):
+        custom_user = get_chat_user(request)
+        if not custom_user:
+            return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
+        return create_message(request, custom_user, request.data)
+
+
+def create_message(request, custom_user, data, attachment=None):
+    """Validate and save a message from ``data``, then announce it."""
+    # Handle both JSON and FormData
+    data = data.copy()
+
+    # Convert to_user and to_group from string IDs to integers if needed
+    if 'to_user' in data and isinstance(data['to_user'], str):
+        try:
+            data['to_user'] = int(data['to_user'])
+        except ValueError:
+            pass
+    if 'to_group' in data and isinstance(data['to_group'], str):
+        try:
+            data['to_group'] = int(data['to_group'])
+        except ValueError:
+            pass
+
+    serializer = MessageSerializer(data=data, context={'request': request, 'custom_user': custom_user})
+    serializer.is_valid(raise_exception=True)
+    to_group = serializer.validated_data.get('to_group')
+    if to_group and not to_group.members.filter(id=custom_user.id).exists():
+        return Response({'detail': 'Not a member of this group'}, status=status.HTTP_403_FORBIDDEN)
+    with transaction.atomic():
+        message = serializer.save(attachment=attachment) if attachment else serializer.save()
+        conversations.record_message(message)
+    message.reaction_summary = []  # nobody has reacted yet, no need to ask
+    schedule_processing(message)
+    response_serializer = MessageSerializer(message, context={'request': request, 'custom_user': custom_user})
+    publish_message_event(MESSAGE_CREATED, message, response_serializer.data)
+    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
+class MessageBulkCreateView(APIView):
+    """
+    Send up to ``CHAT_BULK_MAX_MESSAGES`` text messages at once, e.g. a
+    broadcast to many DMs or an import: ``{"messages": [{"to_user" | "to_group", "text"}, ...]}``.
+    All of them are saved, or none, and each one spends a ``send`` token.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [BulkSendRateThrottle]
+
+    def post(self, request):
+        custom_user = get_chat_user(request)
+        if not custom_user:
+            return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = BulkMessageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['messages']
+
+        user_ids = {item['to_user'] for item in items if item.get('to_user')}
+        group_ids = {item['to_group'] for item in items if item.get('to_group')}
+        # One query per kind of recipient, however many messages there are
+        known = set(CustomUser.objects.filter(id__in=user_ids).values_list('id', flat=True)) if user_ids else set()
+        joined = set(
+            Group.objects.filter(id__in=group_ids, members=custom_user).values_list('id', flat=True)
+        ) if group_ids else set()
+        if group_ids - joined:
+            return Response(
+                {'detail': 'Not a member of these groups', 'groups': sorted(group_ids - joined)},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        if user_ids - known:
+            return Response(
+                {'detail': 'No such users', 'users': sorted(user_ids - known)}, status=status.HTTP_400_BAD_REQUEST,
             )
-        if group_id:
-            qs = qs.filter(to_group_id=group_id, to_group__members=custom_user)
-        qs = qs.order_by('created_at')
-        serializer = MessageSerializer(qs, many=True, context={'request': request, 'custom_user': custom_user})
-        return Response(serializer.data)
+
+        messages = [
+            Message(sender=custom_user, to_user_id=item.get('to_user'), to_group_id=item.get('to_group'),
+                    text=item['text'])
+            for item in items
+        ]
+        for message in messages:
+            # bulk_create skips save(), which normally fills this in
+            message.assign_conversation()
+            message.reaction_summary = []
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            conversations.record_messages(messages)
+        data = MessageSerializer(messages, many=True, context={'request': request, 'custom_user': custom_user}).data
+        publish_message_events(MESSAGE_CREATED, messages, data)
+        return Response({'results': data}, status=status.HTTP_201_CREATED)
+
+
+class UploadListCreateView(APIView):
+    """Start a chunked upload; the response's ``id`` names it for the PUTs that follow."""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UploadRateThrottle]
 
     def post(self, request):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         if not custom_user:
             return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
-        # Handle both JSON and FormData
-        data = request.data.copy()
-        
-        # Convert to_user and to_group from string IDs to integers if needed
-        if 'to_user' in data and isinstance(data['to_user'], str):
-            try:
-                data['to_user'] = int(data['to_user'])
-            except ValueError:
-                pass
-        if 'to_group' in data and isinstance(data['to_group'], str):
-            try:
-                data['to_group'] = int(data['to_group'])
-            except ValueError:
-                pass
-        
-        serializer = MessageSerializer(data=data, context={'request': request, 'custom_user': custom_user})
+        serializer = UploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        to_group = serializer.validated_data.get('to_group')
-        if to_group and not to_group.members.filter(id=custom_user.id).exists():
-            return Response({'detail': 'Not a member of this group'}, status=status.HTTP_403_FORBIDDEN)
-        message = serializer.save()
-        response_serializer = MessageSerializer(message, context={'request': request, 'custom_user': custom_user})
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+        upload = serializer.save(owner=custom_user)
+        uploads.open_staging(upload)
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class UploadDetailView(APIView):
+    """
+    GET reports how many bytes have arrived (where to resume), PUT writes one
+    ``Content-Range`` chunk from the raw request body, DELETE abandons it.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [UploadRateThrottle]
+
+    def get_object(self, request, pk):
+        custom_user = get_chat_user(request)
+        if not custom_user:
+            return None
+        return Upload.objects.filter(pk=pk, owner=custom_user).first()
+
+    def get(self, request, pk):
+        upload = self.get_object(request, pk)
+        if not upload:
+            return Response({'detail': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(UploadSerializer(upload).data)
+
+    def put(self, request, pk):
+        upload = self.get_object(request, pk)
+        if not upload:
+            return Response({'detail': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            # request.stream is the unparsed body; reading it never buffers the chunk
+            uploads.write_chunk(
+                upload, request.stream, request.headers.get('Content-Range'),
+                checksum=request.headers.get('X-Chunk-SHA256'),
+            )
+        except uploads.UploadError as exc:
+            upload.refresh_from_db()
+            return Response({'detail': str(exc), 'received': upload.received}, status=exc.status)
+        return Response(UploadSerializer(upload).data)
+
+    def delete(self, request, pk):
+        upload = self.get_object(request, pk)
+        if not upload:
+            return Response({'detail': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        uploads.discard(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadCompleteView(APIView):
+    """Turn a fully received upload into a message; takes the usual message fields."""
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [SendRateThrottle]
+
+    def post(self, request, pk):
+        custom_user = get_chat_user(request)
+        upload = Upload.objects.filter(pk=pk, owner=custom_user).first() if custom_user else None
+        if not upload:
+            return Response({'detail': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            staged = uploads.finish(upload)
+        except uploads.UploadError as exc:
+            return Response({'detail': str(exc)}, status=exc.status)
+        with staged:
+            response = create_message(request, custom_user, request.data, attachment=staged)
+        if response.status_code == status.HTTP_201_CREATED:
+            uploads.discard(upload)
+        return response
 
 
 class MessageDetailView(APIView):
@@ -233,72 +452,239 @@ class MessageDetailView(APIView):
 
     def get_object(self, pk, user):
         try:
-            msg = Message.objects.get(pk=pk)
+            msg = Message.objects.select_related('sender').get(pk=pk)
         except Message.DoesNotExist:
             return None
-        if msg.sender != user:
+        if msg.sender_id != user.id:
             return None
         return msg
 
     def patch(self, request, pk):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         msg = self.get_object(pk, custom_user) if custom_user else None
         if not msg:
             return Response({'detail': 'Not found or not permitted'}, status=status.HTTP_404_NOT_FOUND)
         text = request.data.get('text')
-        reaction = request.data.get('reaction')
         if text is not None:
             msg.text = text
             msg.updated_at = timezone.now()
-        if reaction is not None:
-            msg.reaction = reaction or None
         msg.save()
-        return Response(MessageSerializer(msg, context={'request': request, 'custom_user': custom_user}).data)
+        data = MessageSerializer(msg, context={'request': request, 'custom_user': custom_user}).data
+        publish_message_event(MESSAGE_UPDATED, msg, data)
+        return Response(data)
 
     def delete(self, request, pk):
-        custom_user = CustomUser.objects.filter(email=request.user.email).first()
+        custom_user = get_chat_user(request)
         msg = self.get_object(pk, custom_user) if custom_user else None
         if not msg:
             return Response({'detail': 'Not found or not permitted'}, status=status.HTTP_404_NOT_FOUND)
         msg.is_deleted = True
         msg.text = ''
-        msg.save()
+        files = msg.stored_files()
+        msg.attachment = msg.thumbnail = msg.thumbnail_webp = None
+        msg.attachment_name = ''
+        with transaction.atomic():
+            msg.save()
+            conversations.record_deletion(msg)
+        release(*files)
+        data = MessageSerializer(msg, context={'request': request, 'custom_user': custom_user}).data
+        publish_message_event(MESSAGE_DELETED, msg, data)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def visible_message(custom_user, pk):
+    """Live message ``pk`` if ``custom_user`` takes part in its conversation, else None."""
+    msg = Message.objects.select_related('sender').filter(pk=pk, is_deleted=False).first()
+    if msg is None:
+        return None
+    if msg.to_group_id:
+        if not Group.objects.filter(id=msg.to_group_id, members=custom_user).exists():
+            return None
+    elif custom_user.id not in (msg.sender_id, msg.to_user_id):
+        return None
+    return msg
+
+
+class MessageReactionView(APIView):
+    """
+    Anyone in the conversation can react: POST ``{"emoji"}`` adds one of the
+    caller's reactions, DELETE ``?emoji=`` takes it off again.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, pk):
+        return self.react(request, pk, request.data.get('emoji'), add_reaction)
+
+    def delete(self, request, pk):
+        return self.react(request, pk, request.query_params.get('emoji'), remove_reaction)
+
+    def react(self, request, pk, emoji, change):
+        custom_user = get_chat_user(request)
+        msg = visible_message(custom_user, pk) if custom_user else None
+        if not msg:
+            return Response({'detail': 'Not found or not permitted'}, status=status.HTTP_404_NOT_FOUND)
+        emoji = (emoji or '').strip()
+        if not emoji or len(emoji) > MAX_EMOJI_LENGTH:
+            return Response({'detail': 'emoji is required'}, status=status.HTTP_400_BAD_REQUEST)
+        changed = change(msg, custom_user, emoji)
+        data = MessageSerializer(msg, context={'request': request, 'custom_user': custom_user}).data
+        if changed:
+            # Others get the counts; "me" is only right for the caller, so say who changed what
+            event = dict(MessageSerializer(msg, context={'request': request}).data)
+            event['reaction_change'] = {'user_id': custom_user.id, 'emoji': emoji, 'added': change is add_reaction}
+            publish_message_event(MESSAGE_REACTED, msg, event)
+        created = changed and change is add_reaction
+        return Response(data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class ConversationListView(APIView):
+    """
+    The caller's inbox, most recently active first: each DM and group with its
+    last message and unread count, read from the precomputed summaries.
+    Pages back through older conversations with ``before``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        custom_user = get_chat_user(request)
+        if not custom_user:
+            return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
+        qs = conversations.inbox(custom_user)
+        try:
+            limit = parse_limit(request.query_params.get('limit'))
+            if request.query_params.get('before'):
+                qs = qs.filter(keyset_before('last_activity_at', *decode_cursor(request.query_params['before'])))
+        except InvalidCursor as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        rows = list(qs[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        serializer = ConversationSerializer(rows, many=True, context={'request': request, 'custom_user': custom_user})
+        return Response({
+            'results': serializer.data,
+            'has_more': has_more,
+            'before_cursor': encode_cursor(rows[-1].last_activity_at, rows[-1].id) if has_more else None,
+        })
+
+
+class ConversationReadView(APIView):
+    """
+    Acknowledge the DM or group named by ``user_id``/``group_id``: ``read``
+    and/or ``delivered`` are "up to message id" watermarks, written with the
+    next batch. Without either, everything is marked read right away.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        custom_user = get_chat_user(request)
+        if not custom_user:
+            return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
+        key, group_id = parse_conversation(custom_user, request.data)
+        if group_id and not Group.objects.filter(id=group_id, members=custom_user).exists():
+            raise PermissionDenied('Not a member of this group')
+        try:
+            read = int(request.data.get('read') or 0)
+            delivered = int(request.data.get('delivered') or 0)
+        except (TypeError, ValueError):
+            return Response({'detail': 'read and delivered must be message ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if read or delivered:
+            receipts.ack_buffer.add(custom_user.id, key, delivered=delivered, read=read)
+        else:
+            conversations.mark_read(custom_user, key)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class MessageSearchView(APIView):
+    """
+    Full-text search over the caller's DMs and groups, best match first.
+    ``user_id``/``group_id`` narrow it to one conversation; each result
+    carries an HTML ``highlight`` with the matched words in ``<mark>``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        custom_user = get_chat_user(request)
+        if not custom_user:
+            return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
+        params = request.query_params
+        if not search.terms(params.get('q')):
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        key = None
+        if params.get('user_id') or params.get('group_id'):
+            key, group_id = parse_conversation(custom_user, params)
+            if group_id and not Group.objects.filter(id=group_id, members=custom_user).exists():
+                raise PermissionDenied('Not a member of this group')
+        try:
+            limit = parse_limit(params.get('limit'))
+            offset = max(0, int(params.get('offset') or 0))
+        except (InvalidCursor, ValueError):
+            return Response({'detail': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        hits = search.search_messages(custom_user, params['q'], conversation=key, limit=limit, offset=offset)
+        prefetch_related_objects([message for message, _ in hits[:limit]], prefetch_reactions(custom_user))
+        context = {'request': request, 'custom_user': custom_user}
+        results = []
+        for message, highlight in hits[:limit]:
+            data = MessageSerializer(message, context=context).data
+            data['highlight'] = highlight
+            results.append(data)
+        return Response({
+            'results': results,
+            'has_more': len(hits) > limit,
+            'next_offset': offset + limit if len(hits) > limit else None,
+        })
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def export_csv(request):
-    custom_user = CustomUser.objects.filter(email=request.user.email).first()
+    custom_user = get_chat_user(request)
     if not custom_user:
         return Response({'detail': 'Custom user not found for this account'}, status=status.HTTP_400_BAD_REQUEST)
-    user_id = request.query_params.get('user_id')
-    group_id = request.query_params.get('group_id')
-    if not user_id and not group_id:
-        return Response({'detail': 'user_id or group_id is required'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    qs = Message.objects.filter(is_deleted=False)
-    if user_id:
-        qs = qs.filter(
-            (models.Q(sender=custom_user, to_user_id=user_id) |
-             models.Q(sender_id=user_id, to_user=custom_user))
-        )
-    elif group_id:
-        qs = qs.filter(to_group_id=group_id, to_group__members=custom_user)
-
-    qs = qs.order_by('created_at')
-    buffer = StringIO()
-    writer = csv.writer(buffer)
-    writer.writerow(['From', 'To', 'Message', 'Time', 'Reaction'])
-    for m in qs:
-        to_val = m.to_user.email if m.to_user else f'Group:{m.to_group.name}'
-        writer.writerow([
-            m.sender.email,
-            to_val,
-            m.text.replace('"', '""'),
-            timezone.localtime(m.created_at).strftime('%Y-%m-%d %H:%M'),
-            m.reaction or ''
-        ])
-    resp = HttpResponse(buffer.getvalue(), content_type='text/csv')
-    resp['Content-Disposition'] = 'attachment; filename="chat_export.csv"'
-    return resp
\ No newline at end of file
+    params = request.query_params
+    output = params.get('output', 'csv')
+    if output not in EXPORT_FORMATS:
+        return Response({'detail': f'output must be one of {", ".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    key, group_id = parse_conversation(custom_user, params)
+    qs = conversation_messages(custom_user, key, group_id).filter(is_deleted=False)
+    cold = archive.archived_export(key)
+    try:
+        start = _parse_export_bound(params.get('start'))
+        end = _parse_export_bound(params.get('end'), end_of_day=True)
+        if params.get('after'):
+            position = keyset_after('created_at', *decode_cursor(params['after']))
+            qs, cold = qs.filter(position), cold.filter(position)
+    except (ValueError, InvalidCursor) as exc:
+        return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if start:
+        qs, cold = qs.filter(created_at__gte=start), cold.filter(created_at__gte=start)
+    if end:
+        qs, cold = qs.filter(created_at__lt=end), cold.filter(created_at__lt=end)
+
+    qs = qs.order_by('created_at', 'id').select_related(
+        'sender', 'to_user', 'to_group'
+    ).only(
+        'text', 'created_at',
+        'sender', 'sender__email', 'to_user', 'to_user__email', 'to_group', 'to_group__name',
+    ).prefetch_related(prefetch_reactions(None))
+    return stream_export(
+        qs, output=output, compress=params.get('compress') == 'gzip', archived=cold,
+        asynchronous=isinstance(request._request, ASGIRequest),
+    )
+
+
+def _parse_export_bound(value, end_of_day=False):
+    """Accept ``YYYY-MM-DD`` or a full ISO datetime; a bare ``end`` date is inclusive."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value}')
+        if end_of_day:
+            day += timedelta(days=1)
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
\ No newline at end of file
@@ -2,6 +2,8 @@
 ASGI config for Chat_Application project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django as before; WebSocket connections on ``/ws/chat/``
+are routed to the Chat consumer through Channels.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Chat_Application.settings')
 
-application = get_asgi_application()
+# Initialise Django before importing anything that touches models.
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from Chat.consumers import JWTQueryAuthMiddleware  # noqa: E402
+from Chat.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns)))
+    ),
+})
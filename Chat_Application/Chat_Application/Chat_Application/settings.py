@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,6 +32,7 @@ ALLOWED_HOSTS = ["*"]
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -40,12 +42,15 @@ INSTALLED_APPS = [
     'corsheaders',
     'rest_framework',
     'rest_framework_simplejwt',
+    'channels',
     'Chat',
 ]
 
 MIDDLEWARE = [
+    'Chat.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'Chat.routers.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,17 +77,86 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Chat_Application.wsgi.application'
+ASGI_APPLICATION = 'Chat_Application.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Picked from the environment so production can run on PostgreSQL:
+#   CHAT_DB_ENGINE=postgres CHAT_DB_NAME=chat CHAT_DB_USER=chat CHAT_DB_PASSWORD=... CHAT_DB_HOST=db
+# PostgreSQL connections come from psycopg 3's pool (CHAT_DB_POOL_MIN_SIZE/MAX_SIZE);
+# CHAT_DB_POOL=0 turns it off. Under ASGI (daphne) every request may run on a
+# fresh thread, so connections only persist across requests (CHAT_DB_CONN_MAX_AGE)
+# when you opt in, e.g. for a WSGI deployment.
+CHAT_DB_ENGINE = os.environ.get('CHAT_DB_ENGINE', 'sqlite')
+CHAT_DB_CONN_MAX_AGE = int(os.environ.get('CHAT_DB_CONN_MAX_AGE', 0))
+
+if CHAT_DB_ENGINE == 'postgres':
+    CHAT_DB_POOL = os.environ.get('CHAT_DB_POOL', '1') != '0'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('CHAT_DB_NAME', 'chat'),
+            'USER': os.environ.get('CHAT_DB_USER', ''),
+            'PASSWORD': os.environ.get('CHAT_DB_PASSWORD', ''),
+            'HOST': os.environ.get('CHAT_DB_HOST', ''),
+            'PORT': os.environ.get('CHAT_DB_PORT', ''),
+            # A pooled connection goes back to the pool at the end of every request
+            'CONN_MAX_AGE': 0 if CHAT_DB_POOL else CHAT_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('CHAT_DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('CHAT_DB_POOL_MAX_SIZE', 20)),
+                    'timeout': 10,
+                },
+            } if CHAT_DB_POOL else {},
+        },
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('CHAT_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': CHAT_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # WAL: readers keep going while a message is written, and commits
+                # append to the log instead of rewriting pages (so NORMAL sync is safe)
+                'init_command': (
+                    'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; '
+                    'PRAGMA cache_size=-16000; PRAGMA mmap_size=134217728'
+                ),
+                # Take the write lock at BEGIN: concurrent senders queue on the busy
+                # timeout instead of failing when a read transaction tries to write
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        },
+    }
+
+# Read replicas (Chat/routers.py): comma-separated hosts of PostgreSQL standbys,
+# or replica database files for SQLite, each becoming an alias 'replicaN' with
+# the primary's settings. GET requests under CHAT_REPLICA_PATHS read from them.
+CHAT_DB_REPLICAS = []
+for _number, _location in enumerate(filter(None, os.environ.get('CHAT_DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'],
+        'HOST' if CHAT_DB_ENGINE == 'postgres' else 'NAME': _location.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    CHAT_DB_REPLICAS.append(f'replica{_number}')
+
+DATABASE_ROUTERS = ['Chat.routers.ReplicaRouter']
+CHAT_REPLICA_PATHS = ['/api/messages/', '/api/users/', '/api/groups/', '/api/conversations/', '/api/async/']
+# Reads stay on the primary this long after a client writes. The pin is kept in
+# the 'default' cache, so with several server processes use CHAT_CACHE=redis:
+# a per-process locmem pin is missed by the worker serving the next read.
+CHAT_REPLICA_PIN_SECONDS = 5
+CHAT_REPLICA_MAX_LAG = 2  # seconds behind the primary before a replica is skipped
+CHAT_REPLICA_CHECK_INTERVAL = 5  # seconds between lag checks, per process
 
 
 # Password validation
@@ -137,8 +211,147 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'Chat.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+# Process-local cache of auth user -> Chat.User, see Chat/auth.py
+CHAT_USER_CACHE_SIZE = 4096
+CHAT_USER_CACHE_TTL = 300  # seconds
+
+# Attachment processing (Chat/attachments.py): thumbnails, WebP variants, video posters
+CHAT_MEDIA_WORKERS = int(os.environ.get('CHAT_MEDIA_WORKERS', 2))
+CHAT_THUMBNAIL_SIZE = (320, 320)
+CHAT_MEDIA_PROCESS_INLINE = False  # True runs the pipeline inside the request (tests)
+# Seconds an attachment may stay pending before requeue_media takes it over
+# from a worker pool that has stopped; longer than the slowest processing
+CHAT_MEDIA_PENDING_GRACE = 10 * 60
+
+# Serving MEDIA_URL (Chat/media.py). CHAT_MEDIA_OFFLOAD hands the transfer to
+# the front server once access is checked: 'nginx' sends X-Accel-Redirect to
+# CHAT_MEDIA_ACCEL_PREFIX (an internal location aliased to MEDIA_ROOT),
+# 'sendfile' sends X-Sendfile; empty streams the file from here.
+CHAT_MEDIA_OFFLOAD = os.environ.get('CHAT_MEDIA_OFFLOAD', '')
+CHAT_MEDIA_ACCEL_PREFIX = os.environ.get('CHAT_MEDIA_ACCEL_PREFIX', '/protected-media/')
+CHAT_MEDIA_MAX_AGE = 60 * 60  # seconds browsers may reuse a file that is not a blob
+
+# Chunked uploads (Chat/uploads.py): partial files live in the staging dir until completed
+CHAT_UPLOAD_STAGING_DIR = BASE_DIR / 'upload_staging'
+CHAT_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024  # 1 GiB per file
+CHAT_UPLOAD_MAX_CHUNK = 8 * 1024 * 1024  # bytes per PUT
+CHAT_UPLOAD_EXPIRY = 24 * 60 * 60  # seconds of inactivity before purge_uploads drops an upload
+
+# Message search (Chat/search.py) ranks at most this many of the newest matches per query
+CHAT_SEARCH_WINDOW = 500
+
+# Hot/cold message tiers (Chat/archive.py, manage.py archive_messages): messages
+# older than this move to the archive table, soft-deleted ones are purged after
+# the retention period
+CHAT_ARCHIVE_AFTER_DAYS = 180
+CHAT_DELETED_RETENTION_DAYS = 30
+CHAT_ARCHIVE_BATCH_SIZE = 1000
+
+# Largest batch POST /api/messages/bulk/ accepts
+CHAT_BULK_MAX_MESSAGES = 1000
+
+# Token-bucket rate limits (Chat/throttling.py): '<n>/<s|min|hour|day>' is a
+# burst of n that refills over the period. 'send' is per user, 'auth' per
+# attempted email, the '_ip' budgets per client address (behind a proxy, set
+# REST_FRAMEWORK['NUM_PROXIES'] so X-Forwarded-For is used). None turns one off;
+# CHAT_THROTTLE=0 turns them all off, for load tests.
+CHAT_THROTTLE_RATES = {} if os.environ.get('CHAT_THROTTLE', '1') == '0' else {
+    'send': '120/min',
+    'send_ip': '600/min',
+    'upload': '600/min',  # chunk PUTs count too
+    'upload_ip': '1200/min',
+    'auth': '10/min',
+    'auth_ip': '30/min',
 }
 
+# Seconds of changes a since= poll reads again behind its cursor, for rows
+# stamped before the poll but committed after it (Chat/pagination.py)
+CHAT_SYNC_OVERLAP = 10
+
+# Request metrics and profiling (Chat/metrics.py). /metrics is for staff,
+# 'Authorization: Bearer <CHAT_METRICS_TOKEN>' and the networks in
+# CHAT_METRICS_ALLOWED_IPS (comma-separated, e.g. '10.0.0.0/8'). Behind a
+# reverse proxy every request comes from the proxy, so only list addresses
+# that reach this server directly. A request is
+# profiled when it sends 'X-Chat-Profile: <CHAT_PROFILE_TOKEN>' or is drawn at
+# CHAT_PROFILE_SAMPLE_RATE (0-1); dumps go to CHAT_PROFILE_DIR.
+CHAT_METRICS_TOKEN = os.environ.get('CHAT_METRICS_TOKEN', '')
+CHAT_METRICS_ALLOWED_IPS = list(filter(None, os.environ.get('CHAT_METRICS_ALLOWED_IPS', '').split(',')))
+CHAT_PROFILE_TOKEN = os.environ.get('CHAT_PROFILE_TOKEN', '')
+CHAT_PROFILE_SAMPLE_RATE = float(os.environ.get('CHAT_PROFILE_SAMPLE_RATE', 0))
+CHAT_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# WebSocket backpressure (Chat/consumers.py): events queued per connection, and
+# how long one frame may take to go out, before a slow client is disconnected
+CHAT_WS_OUTBOX_SIZE = 256
+CHAT_WS_SEND_TIMEOUT = 10  # seconds
+# Undelivered events the channel layer keeps per connection; it drops the rest
+CHAT_WS_CHANNEL_CAPACITY = 200
+
+# Read/delivered acknowledgements are coalesced in memory and written in one
+# batch this often (seconds); 0 writes each one straight away
+CHAT_ACK_FLUSH_INTERVAL = 1.0
+
+# Channel layer used to fan out real-time message events.
+# 'memory' only works within a single server process; 'redis' talks to any
+# Redis-protocol server (redis-server, Valkey, KeyDB...) at CHAT_REDIS_URL;
+# 'fakeredis' runs the redis code in-process, without a server, for
+# development and tests (Chat/redis_standin.py).
+CHAT_CHANNEL_LAYER = os.environ.get('CHAT_CHANNEL_LAYER', 'memory')
+CHAT_REDIS_URL = os.environ.get('CHAT_REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+if CHAT_CHANNEL_LAYER == 'fakeredis':
+    from Chat import redis_standin
+
+    CHANNEL_LAYERS = {'default': redis_standin.channel_layer_config(CHAT_WS_CHANNEL_CAPACITY)}
+elif CHAT_CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHAT_REDIS_URL], 'capacity': CHAT_WS_CHANNEL_CAPACITY},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': CHAT_WS_CHANNEL_CAPACITY},
+        },
+    }
+
+# Cache behind the user and group list responses (Chat/caching.py). 'locmem' is
+# per process, so each worker revalidates on its own; 'redis' shares one cache
+# through the Redis-protocol server at CHAT_REDIS_URL; 'fakeredis' is the
+# in-process stand-in, as for the channel layer.
+CHAT_CACHE = os.environ.get('CHAT_CACHE', 'locmem')
+CHAT_LIST_CACHE_TTL = 300  # seconds a list version is kept after it was built
+
+if CHAT_CACHE == 'fakeredis':
+    from Chat import redis_standin
+
+    CACHES = {'default': redis_standin.cache_config()}
+elif CHAT_CACHE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CHAT_REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            # A version and a group list per user; the default of 300 entries would cull them constantly
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        },
+    }
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,27 @@
+"""Bootstrap Django against a scratch database for benchmark scripts."""
+import os
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup(db_path=None, configure=None):
+    """
+    Configure Django, optionally pointing ``default`` at ``db_path``, and migrate.
+    ``configure()`` may adjust ``settings`` further before Django is set up.
+    """
+    if str(PROJECT_DIR) not in sys.path:
+        sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Chat_Application.settings')
+    import django
+    from django.conf import settings
+
+    if db_path:
+        settings.DATABASES['default']['NAME'] = str(db_path)
+    if configure is not None:
+        configure()
+    django.setup()
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
@@ -0,0 +1,175 @@
+"""
+API load suite: seeds a scratch database with ``manage.py seed_chat``,
+counts the queries each endpoint issues, then drives the endpoints over HTTP
+at each concurrency and reports throughput, p50/p99 latency and query counts
+as JSON, for comparing releases.
+
+    python -m benchmarks.api_load --messages 1000000 --concurrency 1 8 32 --output load.json
+    python -m benchmarks.api_load --base-url http://127.0.0.1:8000 --endpoints dm_history send
+
+The scratch database (``--db``) is seeded if it has no messages yet. Without
+``--base-url`` the suite starts daphne on it with rate limits off
+(``CHAT_THROTTLE=0``); a server passed with ``--base-url`` must serve the same
+database (``CHAT_DB_NAME``) and should run with them off as well.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from . import _django
+from .http_load import login, run_load
+
+
+def endpoints(peer, room):
+    """name -> (method, path, body factory or None)."""
+    def send():
+        return json.dumps({'to_user': peer, 'text': 'load test'})
+
+    def create_group():
+        return json.dumps({'name': f'load-{uuid.uuid4().hex[:12]}', 'member_ids': [peer]})
+
+    return {
+        'users': ('GET', '/api/users/', None),
+        'groups': ('GET', '/api/groups/', None),
+        'group_create': ('POST', '/api/groups/', create_group),
+        'conversations': ('GET', '/api/conversations/', None),
+        'dm_history': ('GET', f'/api/messages/?user_id={peer}', None),
+        'group_history': ('GET', f'/api/messages/?group_id={room}', None),
+        'send': ('POST', '/api/messages/', send),
+        'export': ('GET', f'/api/messages/export/?user_id={peer}', None),
+        'search': ('GET', '/api/messages/search/?q=deadline', None),
+    }
+
+
+def pick_participants(email):
+    """The seeded login, their busiest DM partner and their biggest group."""
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count
+
+    from Chat.models import Group, Message, User
+
+    me = User.objects.get(email=email)
+    peer = Message.objects.filter(sender=me, to_group=None).values('to_user').annotate(
+        sent=Count('id'),
+    ).order_by('-sent').first()['to_user']
+    room = Group.objects.filter(members=me).annotate(size=Count('members')).order_by('-size').first()
+    return get_user_model().objects.get(username=email), peer, room.id
+
+
+def count_queries(auth_user, suite):
+    """Queries per request on the cold path (empty caches), as the tests measure them."""
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    from Chat.auth import chat_user_cache
+
+    client = APIClient()
+    client.force_authenticate(auth_user)
+    counts = {}
+    for name, (method, path, body) in suite.items():
+        chat_user_cache.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            if method == 'GET':
+                response = client.get(path)
+            else:
+                response = client.post(path, body(), content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        counts[name] = len(ctx.captured_queries) if response.status_code < 400 else None
+    return counts
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def server(db_path):
+    """daphne serving ``db_path`` on a free port, with rate limits off."""
+    port = free_port()
+    env = dict(os.environ, CHAT_DB_NAME=str(db_path), CHAT_THROTTLE='0')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'Chat_Application.asgi:application'],
+        cwd=_django.PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise SystemExit('daphne did not start')
+                time.sleep(0.2)
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='/tmp/chat_load.sqlite3')
+    parser.add_argument('--base-url', help='Use this server instead of starting one.')
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--email', default='seed-0@example.com')
+    parser.add_argument('--password', default='seed-password')
+    parser.add_argument('--endpoints', nargs='+', help='Only these (default: all).')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+    args = parser.parse_args()
+
+    _django.setup(args.db)
+    from django.core.management import call_command
+
+    from Chat.models import Message
+
+    if not Message.objects.exists():
+        started = time.perf_counter()
+        call_command('seed_chat', users=args.users, groups=args.groups, messages=args.messages,
+                     password=args.password, stdout=sys.stderr)
+        print(f'seeded in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    auth_user, peer, room = pick_participants(args.email)
+    suite = endpoints(peer, room)
+    if args.endpoints:
+        suite = {name: suite[name] for name in args.endpoints}
+    queries = count_queries(auth_user, suite)
+
+    results = []
+    with (server(args.db) if args.base_url is None else nullcontext(args.base_url)) as base_url:
+        headers = {**login(base_url, args.email, args.password), 'Content-Type': 'application/json'}
+        for name, (method, path, body) in suite.items():
+            for concurrency in args.concurrency:
+                stats = run_load(base_url, path, concurrency, args.duration, headers, method=method, body=body)
+                results.append({'endpoint': name, 'method': method, 'queries': queries[name], **stats})
+
+    report = {
+        'config': {'concurrency': args.concurrency, 'duration': args.duration, 'db': args.db},
+        'data': {'messages': Message.objects.count(), 'peer': peer, 'group': room},
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
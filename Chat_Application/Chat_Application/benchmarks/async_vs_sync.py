@@ -0,0 +1,47 @@
+"""
+Throughput and p99 latency of the sync API views against their ASGI-native
+variants under ``/api/async/``, on the same running server.
+
+    daphne -p 8000 Chat_Application.asgi:application
+    python -m benchmarks.async_vs_sync --email me@example.com --password secret --user-id 2 --group-id 1
+
+Run the server under an ASGI server (daphne/uvicorn); under WSGI the async
+views are wrapped back into threads and the comparison is meaningless.
+"""
+import argparse
+import json
+
+from .http_load import login, run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--user-id', type=int, required=True, help='DM partner for the history endpoint')
+    parser.add_argument('--group-id', type=int, help='group for the history endpoint')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    headers = login(args.base_url, args.email, args.password)
+    endpoints = {
+        'users': 'users/',
+        'groups': 'groups/',
+        'dm_history': f'messages/?user_id={args.user_id}',
+    }
+    if args.group_id:
+        endpoints['group_history'] = f'messages/?group_id={args.group_id}'
+
+    results = []
+    for name, suffix in endpoints.items():
+        for concurrency in args.concurrency:
+            for flavour, prefix in (('sync', '/api/'), ('async', '/api/async/')):
+                stats = run_load(args.base_url, prefix + suffix, concurrency, args.duration, headers)
+                results.append({'endpoint': name, 'flavour': flavour, **stats})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Throughput of sending a broadcast one message per request (POST /api/messages/)
+against batches on POST /api/messages/bulk/, through the full Django stack
+in-process (DRF, auth, summaries, realtime fan-out), without an HTTP server.
+
+    python -m benchmarks.bulk_send --messages 2000 --batch 500 --db /tmp/bulk_bench.sqlite3
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from . import _django
+
+
+def run(messages, batch, recipients):
+    from django.contrib.auth import get_user_model
+    from django.test.utils import setup_test_environment
+    from rest_framework.test import APIClient
+
+    from Chat.models import Message, User
+
+    setup_test_environment()
+    get_user_model().objects.filter(username='bulk-bench-sender@example.com').delete()
+    User.objects.filter(name__startswith='bulk-bench').delete()
+    auth_user = get_user_model().objects.create_user(
+        username='bulk-bench-sender@example.com', email='bulk-bench-sender@example.com', password='!',
+    )
+    sender = User.objects.create(name='bulk-bench-sender', email='bulk-bench-sender@example.com', password='!')
+    people = User.objects.bulk_create([
+        User(name=f'bulk-bench{i}', email=f'bulk-bench{i}@example.com', password='!') for i in range(recipients)
+    ])
+    client = APIClient()
+    client.force_authenticate(auth_user)
+    payload = [{'to_user': people[i % recipients].id, 'text': f'broadcast {i}'} for i in range(messages)]
+
+    def per_message():
+        for item in payload:
+            assert client.post('/api/messages/', item, format='json').status_code == 201
+
+    def bulk():
+        for start in range(0, messages, batch):
+            response = client.post('/api/messages/bulk/', {'messages': payload[start:start + batch]}, format='json')
+            assert response.status_code == 201, response.content
+
+    results = {'messages': messages, 'batch': batch, 'recipients': recipients}
+    for name, send in (('per_message', per_message), ('bulk', bulk)):
+        started = time.perf_counter()
+        send()
+        elapsed = time.perf_counter() - started
+        results[name] = {'seconds': round(elapsed, 2), 'messages_per_s': round(messages / elapsed, 1)}
+    results['speedup'] = round(results['bulk']['messages_per_s'] / results['per_message']['messages_per_s'], 1)
+    assert Message.objects.filter(sender=sender).count() == 2 * messages
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--recipients', type=int, default=200, help='distinct DM partners the broadcast goes to')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'bulk_bench.sqlite3'))
+    args = parser.parse_args()
+    _django.setup(args.db)
+    print(json.dumps(run(args.messages, args.batch, args.recipients), indent=2))
+
+
+if __name__ == '__main__':
+    main()
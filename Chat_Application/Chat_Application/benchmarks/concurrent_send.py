@@ -0,0 +1,167 @@
+"""
+Concurrent message sends (and history reads alongside them) under different
+database configurations, each run in its own process against its own
+scratch database.
+
+    python -m benchmarks.concurrent_send --writers 8 --readers 4 --duration 10
+    CHAT_DB_NAME=chat_bench CHAT_DB_USER=... python -m benchmarks.concurrent_send \\
+        --profiles postgres postgres-pool
+
+Profiles:
+  sqlite-legacy          the old settings: rollback journal, deferred transactions, 5 s timeout
+  sqlite-tuned           the shipped settings: WAL, synchronous=NORMAL, BEGIN IMMEDIATE
+  sqlite-persistent      sqlite-tuned keeping connections open between requests
+  postgres               CHAT_DB_ENGINE=postgres, a new connection per request
+  postgres-pool          CHAT_DB_ENGINE=postgres with the psycopg pool
+
+Each worker thread behaves like a request handler: request_started, one
+transaction, request_finished (where Django closes or recycles connections).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import _django
+
+SQLITE_PROFILES = ('sqlite-legacy', 'sqlite-tuned', 'sqlite-persistent')
+POSTGRES_PROFILES = ('postgres', 'postgres-pool')
+
+
+def configure(profile):
+    """Environment for ``profile``, set before the settings module is imported."""
+    if profile in POSTGRES_PROFILES:
+        os.environ['CHAT_DB_ENGINE'] = 'postgres'
+        os.environ['CHAT_DB_POOL'] = '1' if profile == 'postgres-pool' else '0'
+    else:
+        os.environ['CHAT_DB_ENGINE'] = 'sqlite'
+        os.environ['CHAT_DB_CONN_MAX_AGE'] = '0'
+
+
+def adjust(profile):
+    from django.conf import settings
+
+    default = settings.DATABASES['default']
+    if profile == 'sqlite-legacy':
+        default['OPTIONS'] = {}
+    if profile == 'sqlite-persistent':
+        default['CONN_MAX_AGE'] = None
+
+
+def request(fn):
+    """Run ``fn`` the way a view runs, so connections are handled as in production."""
+    from django.core import signals
+
+    signals.request_started.send(sender=None)
+    try:
+        return fn()
+    finally:
+        signals.request_finished.send(sender=None)
+
+
+def run(writers, readers, duration):
+    from django.db import OperationalError, connection, transaction
+
+    from Chat import conversations
+    from Chat.models import Message, User
+
+    User.objects.filter(name__startswith='concurrent-bench').delete()
+    people = User.objects.bulk_create([
+        User(name=f'concurrent-bench{i}', email=f'concurrent-bench{i}@example.com', password='!')
+        for i in range(2 * writers)
+    ])
+    pairs = [(people[2 * i], people[2 * i + 1]) for i in range(writers)]
+    deadline = time.perf_counter() + duration
+    results = {'send': [], 'send_failed': 0, 'read': [], 'read_failed': 0}
+    lock = threading.Lock()
+
+    def send(sender, peer):
+        with transaction.atomic():
+            message = Message.objects.create(sender=sender, to_user=peer, text='load')
+            conversations.record_message(message)
+
+    def read(sender, peer):
+        key = f'u:{min(sender.id, peer.id)}:{max(sender.id, peer.id)}'
+        list(Message.objects.filter(conversation=key, is_deleted=False).order_by('-created_at', '-id')[:50])
+        list(conversations.inbox(sender)[:50])
+
+    def worker(kind, fn, sender, peer):
+        timings, failed = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                request(lambda: fn(sender, peer))
+            except OperationalError:
+                failed += 1
+                continue
+            timings.append((time.perf_counter() - started) * 1000)
+        connection.close()
+        with lock:
+            results[kind].extend(timings)
+            results[f'{kind}_failed'] += failed
+
+    threads = [threading.Thread(target=worker, args=('send', send, *pair)) for pair in pairs]
+    threads += [threading.Thread(target=worker, args=('read', read, *pairs[i % writers])) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    summary = {}
+    for kind in ('send', 'read'):
+        timings = sorted(results[kind])
+        summary[kind] = {
+            'per_s': round(len(timings) / elapsed, 1),
+            'failed': results[f'{kind}_failed'],
+            'p50_ms': round(statistics.median(timings), 2) if timings else None,
+            'p99_ms': round(timings[int(len(timings) * 0.99)], 2) if timings else None,
+        }
+    return summary
+
+
+def run_profile(profile, args):
+    """Run one profile in a child process, so it gets its own settings and database."""
+    command = [
+        sys.executable, '-m', 'benchmarks.concurrent_send', '--profile', profile,
+        '--writers', str(args.writers), '--readers', str(args.readers), '--duration', str(args.duration),
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=_django.PROJECT_DIR).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=list(SQLITE_PROFILES),
+                        choices=SQLITE_PROFILES + POSTGRES_PROFILES)
+    parser.add_argument('--profile', help=argparse.SUPPRESS)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.profile is None:
+        config = {'writers': args.writers, 'readers': args.readers, 'duration': args.duration}
+        print(json.dumps({**config, 'profiles': {p: run_profile(p, args) for p in args.profiles}}, indent=2))
+        return
+
+    configure(args.profile)
+    db_path = None
+    if args.profile in SQLITE_PROFILES:
+        # Journal mode sticks to the file, so every profile starts from a new one
+        db_path = os.path.join(tempfile.gettempdir(), f'concurrent_{args.profile}.sqlite3')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    _django.setup(db_path, configure=lambda: adjust(args.profile))
+    print(json.dumps(run(args.writers, args.readers, args.duration)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""Django on a seeded scratch database for the pytest-benchmark suite in ``micro.py``."""
+import sys
+import time
+
+from . import _django
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench-db', default='/tmp/chat_micro.sqlite3', help='Scratch database, seeded if empty.')
+    parser.addoption('--bench-messages', type=int, default=100_000, help='Messages to seed it with.')
+    parser.addoption('--bench-users', type=int, default=1000)
+    parser.addoption('--bench-groups', type=int, default=100)
+
+
+def pytest_configure(config):
+    _django.setup(config.getoption('--bench-db'))
+    from django.core.management import call_command
+
+    from Chat.models import Message
+
+    if not Message.objects.exists():
+        started = time.perf_counter()
+        call_command('seed_chat', users=config.getoption('--bench-users'), groups=config.getoption('--bench-groups'),
+                     messages=config.getoption('--bench-messages'), stdout=sys.stderr)
+        print(f'seeded in {time.perf_counter() - started:.1f}s', file=sys.stderr)
@@ -0,0 +1,145 @@
+"""
+Query plans and latency of conversation reads: the old sender/recipient OR
+query against the conversation-key partial index.
+
+    python -m benchmarks.conversation_index --messages 1000000 --db /tmp/chat_bench.sqlite3
+
+The scratch database is created (and seeded) if it does not exist yet.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+from . import _django
+
+
+def label(rng, kind, i):
+    return f'{kind} {i}'
+
+
+def seed(messages, users, groups, hot_share=0.01, text=label):
+    """Seed a realistic mix of DMs and group messages; ``text(rng, kind, i)`` writes the bodies."""
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    from Chat.models import Group, Message, User, dm_conversation_key, group_conversation_key
+
+    rng = random.Random(42)
+    people = User.objects.bulk_create(
+        [User(name=f'bench{i}', email=f'bench{i}@example.com', password='!') for i in range(users)]
+    )
+    rooms = Group.objects.bulk_create([Group(name=f'bench-group-{i}', owner=people[0]) for i in range(groups)])
+    Membership = Group.members.through
+    Membership.objects.bulk_create([
+        Membership(group_id=room.id, user_id=person.id)
+        for room in rooms
+        for person in rng.sample(people, min(len(people), 50)) + [people[0]]
+    ], ignore_conflicts=True)
+
+    start = timezone.now() - timedelta(days=365)
+    step = timedelta(days=365) / max(messages, 1)
+    hot_a, hot_b = people[0].id, people[1].id
+    # Columns whose defaults only exist on the Django side
+    blanks = ['media_status', 'attachment_content_type', 'attachment_name']
+    sql = (
+        f'INSERT INTO {Message._meta.db_table} '
+        f'(sender_id, to_user_id, to_group_id, text, created_at, updated_at, is_deleted, conversation, {", ".join(blanks)}) '
+        f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s{", %s" * len(blanks)})'
+    )
+    batch = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(messages):
+            created = connection.ops.adapt_datetimefield_value(start + step * i)
+            roll = rng.random()
+            if roll < hot_share:
+                sender, to_user = rng.choice([(hot_a, hot_b), (hot_b, hot_a)])
+                row = (sender, to_user, None, text(rng, 'hot', i), created, created, False, dm_conversation_key(sender, to_user))
+            elif roll < 0.5:
+                sender, to_user = rng.sample(people, 2)
+                row = (sender.id, to_user.id, None, text(rng, 'dm', i), created, created, rng.random() < 0.02,
+                       dm_conversation_key(sender.id, to_user.id))
+            else:
+                room = rng.choice(rooms)
+                row = (hot_a, None, room.id, text(rng, 'group', i), created, created, rng.random() < 0.02,
+                       group_conversation_key(room.id))
+            batch.append(row + ('',) * len(blanks))
+            if len(batch) >= 10000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+        if connection.vendor == 'sqlite':
+            cursor.execute('ANALYZE')
+        else:
+            cursor.execute(f'ANALYZE {Message._meta.db_table}')
+
+
+def measure(qs, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(qs.all())  # fresh clone, so the result cache is not reused
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'plan': qs.explain(),
+    }
+
+
+def run(repeat):
+    from django.db.models import Q
+
+    from Chat.models import Group, Message, User, dm_conversation_key, group_conversation_key
+
+    me, peer = User.objects.order_by('id')[:2]
+    room = Group.objects.order_by('id').first()
+    page = 50
+    legacy_dm = Message.objects.filter(is_deleted=False).filter(
+        Q(sender=me, to_user=peer) | Q(sender=peer, to_user=me)
+    )
+    legacy_group = Message.objects.filter(is_deleted=False, to_group=room, to_group__members=me)
+    keyed_dm = Message.objects.filter(conversation=dm_conversation_key(me.id, peer.id), is_deleted=False)
+    keyed_group = Message.objects.filter(conversation=group_conversation_key(room.id), is_deleted=False)
+
+    cases = {
+        'dm_latest_page': (legacy_dm.order_by('-created_at', '-id')[:page],
+                           keyed_dm.order_by('-created_at', '-id')[:page]),
+        'group_latest_page': (legacy_group.order_by('-created_at', '-id')[:page],
+                              keyed_group.order_by('-created_at', '-id')[:page]),
+        'dm_full_export': (legacy_dm.order_by('created_at', 'id').values_list('id'),
+                           keyed_dm.order_by('created_at', 'id').values_list('id')),
+    }
+    return {
+        name: {'before': measure(before, repeat), 'after': measure(after, repeat)}
+        for name, (before, after) in cases.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='/tmp/chat_bench.sqlite3')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    _django.setup(args.db)
+    from Chat.models import Message
+
+    if not Message.objects.exists():
+        started = time.perf_counter()
+        seed(args.messages, args.users, args.groups)
+        print(f'seeded {args.messages} messages in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    results = {'messages': Message.objects.count(), 'cases': run(args.repeat)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Disk used by message attachments with the old per-message FileField storage
+against the content-addressed blob storage, on a synthetic but chat-shaped
+corpus:
+
+* photos, documents and the odd video, with log-normal sizes;
+* a share of posts re-send a file seen before, picked by popularity
+  (reposting a random earlier post makes popular files more popular);
+* a few announcements fanned out to many groups at once.
+
+    python -m benchmarks.dedup_savings --posts 2000 --db /tmp/dedup_bench.sqlite3
+
+File contents are random bytes, i.e. as incompressible as real media.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from . import _django
+
+KINDS = [
+    # (extension, share of new files, median bytes, sigma)
+    ('jpg', 0.70, 300 * 1024, 0.8),
+    ('pdf', 0.22, 150 * 1024, 1.0),
+    ('mp4', 0.08, 6 * 1024 * 1024, 0.7),
+]
+
+
+def disk_usage(root):
+    used = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            used += os.stat(os.path.join(directory, name)).st_blocks * 512
+    return used
+
+
+def corpus(posts, resend_share, fanout_share, fanout, rng):
+    """Yields ``(file_id, extension, size)`` per attachment post."""
+    files, history = [], []
+    for _ in range(posts):
+        roll = rng.random()
+        if history and roll < resend_share:
+            file_id = rng.choice(history)
+            repeats = 1
+        else:
+            ext, _, median, sigma = rng.choices(KINDS, weights=[k[1] for k in KINDS])[0]
+            size = max(1024, int(rng.lognormvariate(0, sigma) * median))
+            file_id = len(files)
+            files.append((ext, size))
+            repeats = fanout if roll > 1 - fanout_share else 1
+        for _ in range(repeats):
+            history.append(file_id)
+            yield file_id, *files[file_id]
+
+
+def run(posts, resend_share, fanout_share, fanout, seed):
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import FileSystemStorage
+    from django.db.models import Sum
+
+    from Chat.models import Blob
+    from Chat.storage import ContentAddressedStorage
+
+    rng = random.Random(seed)
+    root = tempfile.mkdtemp(prefix='dedup-bench-')
+    plain = FileSystemStorage(location=os.path.join(root, 'plain'))
+    blobs = ContentAddressedStorage(location=os.path.join(root, 'cas'))
+    Blob.objects.all().delete()
+    timings = {'plain': 0.0, 'cas': 0.0}
+    count = logical = 0
+    try:
+        for file_id, ext, size in corpus(posts, resend_share, fanout_share, fanout, rng):
+            # Same file, same bytes: derive them from the file id
+            data = random.Random(f'{seed}:{file_id}').randbytes(size)
+            name = f'message_attachments/upload_{count}.{ext}'
+            for label, storage in (('plain', plain), ('cas', blobs)):
+                started = time.perf_counter()
+                storage.save(name, ContentFile(data))
+                timings[label] += time.perf_counter() - started
+            count += 1
+            logical += size
+        plain_bytes = disk_usage(plain.location)
+        cas_bytes = disk_usage(blobs.location)
+        referenced = Blob.objects.aggregate(total=Sum('ref_count'))['total']
+        return {
+            'attachments': count,
+            'distinct_files': Blob.objects.count(),
+            'references': referenced,
+            'logical_mb': round(logical / 1024 / 1024, 1),
+            'plain_disk_mb': round(plain_bytes / 1024 / 1024, 1),
+            'cas_disk_mb': round(cas_bytes / 1024 / 1024, 1),
+            'saved_pct': round((1 - cas_bytes / plain_bytes) * 100, 1) if plain_bytes else 0,
+            'plain_save_ms': round(timings['plain'] / count * 1000, 2),
+            'cas_save_ms': round(timings['cas'] / count * 1000, 2),
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=2000, help='attachment posts before fan-out')
+    parser.add_argument('--resend-share', type=float, default=0.25, help='posts re-sending an earlier file')
+    parser.add_argument('--fanout-share', type=float, default=0.02, help='new files announced to many groups')
+    parser.add_argument('--fanout', type=int, default=20, help='groups an announcement is posted to')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'dedup_bench.sqlite3'),
+                        help='scratch SQLite database for the Blob rows')
+    args = parser.parse_args(argv)
+    _django.setup(args.db)
+    print(json.dumps(run(args.posts, args.resend_share, args.fanout_share, args.fanout, args.seed), indent=2))
+
+
+if __name__ == '__main__':
+    main()
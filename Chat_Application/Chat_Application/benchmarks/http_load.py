@@ -0,0 +1,79 @@
+"""Small closed-loop HTTP load generator built on the standard library."""
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def login(base_url, email, password):
+    """Return an ``Authorization`` header for ``email`` via the JWT login API."""
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    body = json.dumps({'email': email, 'password': password})
+    conn.request('POST', '/api/auth/login/', body=body, headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    payload = json.loads(response.read() or b'{}')
+    if response.status != 200:
+        raise SystemExit(f'login failed ({response.status}): {payload}')
+    return {'Authorization': f'Bearer {payload["access"]}'}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(base_url, path, concurrency=8, duration=10.0, headers=None, method='GET', body=None):
+    """
+    Keep ``concurrency`` keep-alive connections busy with ``path`` for
+    ``duration`` seconds and report throughput and latency percentiles.
+    ``body`` may be a callable, for requests that need a fresh body each time.
+    """
+    parts = urlsplit(base_url)
+    deadline = time.perf_counter() + duration
+    latencies, errors, lock = [], [0], threading.Lock()
+
+    def worker():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=body() if callable(body) else body, headers=headers or {})
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                continue
+            local.append((time.perf_counter() - started) * 1000)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'path': path,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else 0.0,
+    }
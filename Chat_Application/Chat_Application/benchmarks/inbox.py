@@ -0,0 +1,115 @@
+"""
+Inbox latency: the sidebar computed per conversation (last message plus an
+unread count, two queries per row) against the precomputed summaries behind
+/api/conversations/, and what keeping them current adds to a message write.
+
+    python -m benchmarks.inbox --messages 1000000 --db /tmp/inbox_bench.sqlite3
+
+The scratch database is created (and seeded) if it does not exist yet; the
+summaries of a seeded database come from the 0008 migration's backfill.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from . import _django
+from .conversation_index import seed
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return result, {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 2),
+    }
+
+
+def run(repeat, page=50):
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+
+    from Chat import conversations
+    from Chat.models import ConversationSummary, Group, Message, User
+
+    # The busiest inbox: the seed makes the first user a member of every group
+    me = User.objects.order_by('id').first()
+    summaries = list(ConversationSummary.objects.filter(user=me).values_list('conversation', 'last_read_id'))
+
+    def per_conversation():
+        rows = []
+        for key, last_read in summaries:
+            live = Message.objects.filter(conversation=key, is_deleted=False)
+            last = live.order_by('-created_at', '-id').first()
+            unread = live.filter(id__gt=last_read).exclude(sender=me).count()
+            rows.append((key, last, unread))
+        rows.sort(key=lambda row: (row[1].created_at, row[1].id) if row[1] else (me.id,), reverse=True)
+        return rows[:page]
+
+    def summarized():
+        return list(conversations.inbox(me)[:page])
+
+    results = {'conversations': len(summaries)}
+    cases = [('per_conversation', per_conversation, max(1, repeat // 5)), ('summary_table', summarized, repeat)]
+    for name, fn, runs in cases:
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        queries = len(ctx.captured_queries)
+        _, timings = timed(fn, runs)
+        results[name] = {**timings, 'queries': queries}
+
+    # Write overhead: saving a message with and without its summary update
+    peer = User.objects.order_by('id')[1]
+    room = Group.objects.filter(members=me).order_by('id').first()
+    created = []
+
+    def send(record, **target):
+        def write():
+            with transaction.atomic():
+                message = Message.objects.create(sender=me, text='benchmark', **target)
+                if record:
+                    conversations.record_message(message)
+            created.append(message.id)
+        return write
+
+    for name, target in (('dm', {'to_user': peer}), ('group', {'to_group': room})):
+        _, plain = timed(send(False, **target), repeat)
+        _, recorded = timed(send(True, **target), repeat)
+        results[f'write_{name}'] = {'message_only': plain, 'with_summary': recorded}
+    Message.objects.filter(id__in=created).delete()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='/tmp/inbox_bench.sqlite3')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    _django.setup(args.db)
+    from Chat.models import Message
+
+    if not Message.objects.exists():
+        started = time.perf_counter()
+        seed(args.messages, args.users, args.groups)
+        # The backfill ran on an empty table; redo it now there is history
+        from django.core.management import call_command
+        call_command('migrate', 'Chat', '0007', verbosity=0)
+        call_command('migrate', verbosity=0)
+        print(f'seeded {args.messages} messages in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    results = {'messages': Message.objects.count(), 'cases': run(args.repeat)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
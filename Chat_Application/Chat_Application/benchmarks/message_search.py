@@ -0,0 +1,137 @@
+"""
+Message search latency: the admin's old ``LIKE '%term%'`` scan against the
+full-text index behind /api/messages/search/, for rare, mid-frequency, very
+common and prefix terms, plus what the sync triggers cost on insert.
+
+    python -m benchmarks.message_search --messages 2000000 --db /tmp/chat_search_bench.sqlite3
+
+Message bodies are drawn from a Zipf-distributed vocabulary, so term
+frequencies look like natural language. The scratch database is created (and
+seeded) if it does not exist yet.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from . import _django
+from .conversation_index import seed
+
+VOCABULARY = 20000
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'su', 'ta', 'ri', 'po', 'an', 'el', 'to', 've', 'da', 'gu', 'fi', 'ho']
+
+
+def word(rank):
+    """Deterministic pseudo-word for vocabulary rank ``rank`` (0 = most common)."""
+    syllables = []
+    rank += len(SYLLABLES)
+    while rank:
+        rank, digit = divmod(rank, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return ''.join(syllables)
+
+
+def zipf_text(weights):
+    ranks = range(VOCABULARY)
+
+    def text(rng, kind, i):
+        return ' '.join(word(r) for r in rng.choices(ranks, cum_weights=weights, k=rng.randint(3, 18)))
+    return text
+
+
+def cumulative_zipf(s=1.07):
+    total, weights = 0.0, []
+    for rank in range(1, VOCABULARY + 1):
+        total += 1 / rank ** s
+        weights.append(total)
+    return weights
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return result, {
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 2),
+    }
+
+
+def run(repeat, page=20):
+    from django.db import connection
+    from django.db.models import Q
+
+    from Chat.models import Message, User
+    from Chat.search import search_messages
+
+    me = User.objects.order_by('id').first()
+    group_ids = list(me.groups.values_list('id', flat=True))
+    visible = Message.objects.filter(is_deleted=False).filter(
+        Q(to_group__isnull=True, sender=me) | Q(to_group__isnull=True, to_user=me) | Q(to_group_id__in=group_ids)
+    )
+    cases = {
+        'rare': word(15000),
+        'mid': word(300),
+        'common': word(3),
+        'two_words': f'{word(3)} {word(300)}',
+        'prefix': word(300)[:-1],
+    }
+    results = {}
+    for name, query in cases.items():
+        like = visible
+        for term in query.split():
+            like = like.filter(text__icontains=term)
+        like = like.order_by('-id')[:page]
+        hits, fts = timed(lambda: search_messages(me, query, limit=page), repeat)
+        _, scan = timed(lambda: list(like.all()), max(1, repeat // 5))
+        results[name] = {'query': query, 'hits': len(hits), 'like_scan': scan, 'fts': fts}
+
+    # Write cost of the sync triggers: single-row inserts with and without them
+    peer = User.objects.order_by('id')[1]
+
+    def insert_batch():
+        for i in range(500):
+            Message.objects.create(sender=me, to_user=peer, text=f'{word(i)} {word(i * 7)} benchmark')
+
+    _, with_triggers = timed(insert_batch, 3)
+    if connection.vendor == 'sqlite':
+        from Chat.search import ensure_search_triggers
+
+        with connection.cursor() as cursor:
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f'DROP TRIGGER chat_message_fts_{trigger}')
+        _, without_triggers = timed(insert_batch, 3)
+        ensure_search_triggers()
+        results['insert_500'] = {'with_index': with_triggers, 'without_index': without_triggers}
+    Message.objects.filter(text__endswith=' benchmark', sender=me, to_user=peer).delete()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='/tmp/chat_search_bench.sqlite3')
+    parser.add_argument('--messages', type=int, default=2_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    _django.setup(args.db)
+    from django.db import connection
+
+    from Chat.models import Message
+
+    if not Message.objects.exists():
+        started = time.perf_counter()
+        seed(args.messages, args.users, args.groups, text=zipf_text(cumulative_zipf()))
+        print(f'seeded {args.messages} messages in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    results = {'messages': Message.objects.count(), 'vendor': connection.vendor, 'cases': run(args.repeat)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
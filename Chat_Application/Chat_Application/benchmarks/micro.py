@@ -0,0 +1,149 @@
+"""
+Microbenchmarks of the querysets and serializers behind the hot endpoints,
+with pytest-benchmark, on the scratch database ``conftest.py`` seeds.
+
+    python -m pytest benchmarks/micro.py --benchmark-json=micro.json
+    python -m pytest benchmarks/micro.py --bench-db /tmp/micro_1m.sqlite3 --bench-messages 1000000
+
+Every benchmark also records how many queries one round issues
+(``extra_info.queries`` in the JSON), so a regression in either shows up.
+"""
+from functools import partial
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from .api_load import pick_participants  # noqa: E402
+
+PAGE = {'limit': '50'}
+
+
+@pytest.fixture(scope='module')
+def people():
+    from Chat.models import User
+
+    auth_user, peer, room = pick_participants('seed-0@example.com')
+    return User.objects.get(email=auth_user.email), peer, room
+
+
+@pytest.fixture(scope='module')
+def context(people):
+    me = people[0]
+    return {'request': APIRequestFactory().get('/api/messages/'), 'custom_user': me}
+
+
+def measure(benchmark, fn):
+    with CaptureQueriesContext(connection) as ctx:
+        fn()
+    benchmark.extra_info['queries'] = len(ctx.captured_queries)
+    return benchmark(fn)
+
+
+def history_page(me, key):
+    from Chat import archive
+    from Chat.models import Message
+    from Chat.pagination import paginate_messages
+    from Chat.reactions import prefetch_reactions
+
+    qs = Message.objects.filter(conversation=key, is_deleted=False).select_related('sender').prefetch_related(
+        prefetch_reactions(me)
+    )
+    rows, _ = paginate_messages(qs, PAGE, cold=partial(archive.archived_page, key))
+    return archive.as_messages(rows, me)
+
+
+@pytest.mark.parametrize('kind', ['dm', 'group'])
+def test_history_page_queryset(benchmark, people, kind):
+    from Chat.models import dm_conversation_key, group_conversation_key
+
+    me, peer, room = people
+    key = dm_conversation_key(me.id, peer) if kind == 'dm' else group_conversation_key(room)
+    assert measure(benchmark, lambda: history_page(me, key))
+
+
+def test_history_page_serializer(benchmark, people, context):
+    from Chat.models import dm_conversation_key
+    from Chat.serializers import MessageSerializer
+
+    me, peer, _ = people
+    rows = history_page(me, dm_conversation_key(me.id, peer))
+    assert len(measure(benchmark, lambda: MessageSerializer(rows, many=True, context=context).data)) == 50
+
+
+def test_history_page_fast(benchmark, people, context):
+    from Chat import history
+    from Chat.models import Message, dm_conversation_key
+    from Chat.pagination import paginate_messages
+    from Chat.receipts import load_receipts
+    from Chat.renderers import ORJSONRenderer
+
+    me, peer, _ = people
+    key = dm_conversation_key(me.id, peer)
+
+    def page():
+        qs = history.page_rows(Message.objects.filter(conversation=key))
+        rows, meta = paginate_messages(qs, PAGE, cold=partial(history.archived_rows, key))
+        body = history.page_response(
+            rows, meta, load_receipts(key), history.load_reactions(rows, me), context['request'], False,
+        )
+        return ORJSONRenderer().render(body)
+
+    assert measure(benchmark, page)
+
+
+def test_inbox_queryset(benchmark, people):
+    from Chat import conversations
+
+    assert measure(benchmark, lambda: list(conversations.inbox(people[0])[:51]))
+
+
+def test_inbox_serializer(benchmark, people, context):
+    from Chat import conversations
+    from Chat.serializers import ConversationSerializer
+
+    rows = list(conversations.inbox(people[0])[:50])
+    assert measure(benchmark, lambda: ConversationSerializer(rows, many=True, context=context).data)
+
+
+@pytest.mark.parametrize('params', [{}, {'q': 'seed-1'}, {'contacts': '1'}], ids=['everyone', 'prefix', 'contacts'])
+def test_user_directory_page(benchmark, people, params):
+    from Chat.directory import DirectoryPage
+
+    def page():
+        # Uncached, as the first caller after a change sees it
+        page = DirectoryPage(people[0], params)
+        return page.finish(page.rows(list(page.queryset)))
+
+    assert measure(benchmark, page)['results']
+
+
+def test_group_list(benchmark, people):
+    from Chat.models import Group
+    from Chat.serializers import GroupSerializer
+
+    def groups():
+        qs = Group.objects.filter(members=people[0]).distinct().prefetch_related('members')
+        return GroupSerializer(qs, many=True).data
+
+    assert measure(benchmark, groups)
+
+
+def test_export_rows(benchmark, people):
+    from Chat.models import Message, dm_conversation_key
+
+    me, peer, _ = people
+    qs = Message.objects.filter(conversation=dm_conversation_key(me.id, peer), is_deleted=False).order_by(
+        'created_at', 'id',
+    ).select_related('sender', 'to_user', 'to_group')
+    assert measure(benchmark, lambda: sum(1 for _ in qs.iterator(chunk_size=2000)))
+
+
+def test_search(benchmark, people):
+    from Chat import search
+
+    assert measure(benchmark, lambda: search.search_messages(people[0], 'deadline review', limit=20))
@@ -0,0 +1,84 @@
+"""
+Cost of read receipts when a big group reads a burst: every member
+acknowledging every message with its own write, against the coalesced
+watermarks of Chat/receipts.py (highest id per member, one batched flush).
+
+    python -m benchmarks.read_receipts --members 500 --burst 50 --db /tmp/receipts_bench.sqlite3
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from . import _django
+
+
+def run(members, burst):
+    from django.db import connection
+
+    from Chat import conversations, receipts
+    from Chat.models import ConversationSummary, Group, Message, User
+
+    Group.objects.filter(name__startswith='receipts-bench').delete()
+    User.objects.filter(name__startswith='receipts-bench').delete()
+    people = User.objects.bulk_create([
+        User(name=f'receipts-bench{i}', email=f'receipts-bench{i}@example.com', password='!') for i in range(members)
+    ])
+    results = {'members': members, 'burst': burst}
+    for mode in ('per_message', 'coalesced'):
+        room = Group.objects.create(name=f'receipts-bench-{mode}', owner=people[0])
+        room.members.set(people)
+        conversations.open_group(room)
+        sent = []
+        for i in range(burst):
+            message = Message.objects.create(sender=people[0], to_group=room, text=f'burst {i}')
+            conversations.record_message(message)
+            sent.append(message.id)
+        key = f'g:{room.id}'
+
+        statements = []
+
+        def count(execute, sql, params, many, context):
+            statements.append(sql.split(None, 1)[0].upper())
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            if mode == 'per_message':
+                # One write per member and message, as a receipt-per-message design would do
+                for person in people[1:]:
+                    for message_id in sent:
+                        receipts.write_acks({(person.id, key): (message_id, message_id)})
+            else:
+                for person in people[1:]:
+                    for message_id in sent:
+                        receipts.ack_buffer.add(person.id, key, read=message_id)
+                receipts.ack_buffer.flush()
+        elapsed = time.perf_counter() - started
+        unread = ConversationSummary.objects.filter(conversation=key, unread_count__gt=0).count()
+        results[mode] = {
+            'ms': round(elapsed * 1000, 1),
+            'statements': len(statements),
+            'updates': statements.count('UPDATE'),
+            'members_left_unread': unread,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--burst', type=int, default=50, help='messages posted before the group reads them')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'receipts_bench.sqlite3'))
+    args = parser.parse_args()
+    _django.setup(args.db)
+    from django.conf import settings
+
+    # Flush by hand so the timer thread does not interfere with the measurement
+    settings.CHAT_ACK_FLUSH_INTERVAL = 3600
+    print(json.dumps(run(args.members, args.burst), indent=2))
+
+
+if __name__ == '__main__':
+    main()
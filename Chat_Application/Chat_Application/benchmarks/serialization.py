@@ -0,0 +1,123 @@
+"""
+Cost of turning history into JSON: ``MessageSerializer`` over model
+instances and DRF's ``JSONRenderer`` (the old path), against the
+``values_list`` rows of Chat/history.py and ``ORJSONRenderer``, in the
+nested and the compact shape. Times are per 10k messages, split into
+fetching, serializing and rendering.
+
+    python -m benchmarks.serialization --messages 10000 --db /tmp/serialization_bench.sqlite3
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from . import _django
+
+PER = 10_000
+
+
+def seed(count):
+    from Chat.models import Message, ReactionCount, User, dm_conversation_key
+
+    me, _ = User.objects.get_or_create(name='serialization-bench-me', defaults={
+        'email': 'serialization-bench-me@example.com', 'password': '!',
+    })
+    peer, _ = User.objects.get_or_create(name='serialization-bench-peer', defaults={
+        'email': 'serialization-bench-peer@example.com', 'password': '!',
+    })
+    key = dm_conversation_key(me.id, peer.id)
+    Message.objects.filter(conversation=key).delete()
+    messages = []
+    for i in range(count):
+        sender, to_user = (me, peer) if i % 2 else (peer, me)
+        message = Message(sender=sender, to_user=to_user, conversation=key, text=f'message number {i} ' * 3)
+        if i % 20 == 0:
+            # One in twenty carries a processed photo
+            digest = f'{i:064x}'
+            message.attachment = f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+            message.attachment_name = f'photo-{i}.jpg'
+            message.attachment_content_type = 'image/jpeg'
+            message.attachment_size, message.attachment_width, message.attachment_height = 200_000, 1280, 960
+            message.thumbnail = message.thumbnail_webp = message.attachment.name
+            message.media_status = Message.MEDIA_READY
+        messages.append(message)
+    messages = Message.objects.bulk_create(messages, batch_size=2000)
+    ReactionCount.objects.bulk_create([
+        ReactionCount(message=message, emoji='👍', count=2) for message in messages[::10]
+    ])
+    return me, key
+
+
+def best(fn, repeat):
+    times, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+
+def run(count, repeat):
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIRequestFactory
+
+    from Chat import history, receipts
+    from Chat.models import Message
+    from Chat.reactions import prefetch_reactions
+    from Chat.renderers import ORJSONRenderer
+    from Chat.serializers import MessageSerializer
+
+    me, key = seed(count)
+    request = APIRequestFactory().get('/api/messages/')
+    watermarks = receipts.load_receipts(key)
+    scale = PER / count * 1000
+
+    def current():
+        fetch, rows = best(lambda: list(Message.objects.filter(conversation=key).order_by('created_at', 'id')
+                                        .select_related('sender').prefetch_related(prefetch_reactions(me))), repeat)
+        context = {'request': request, 'custom_user': me, 'receipts': watermarks}
+        serialize, data = best(lambda: MessageSerializer(rows, many=True, context=context).data, repeat)
+        render, body = best(lambda: JSONRenderer().render({'results': data}), repeat)
+        return fetch, serialize, render, body
+
+    def fast(compact):
+        def fetch_rows():
+            rows = list(history.page_rows(Message.objects.filter(conversation=key).order_by('created_at', 'id')))
+            return rows, history.load_reactions(rows, me)
+
+        fetch, (rows, reactions) = best(fetch_rows, repeat)
+        serialize, data = best(lambda: history.page_response(
+            rows, {}, watermarks, reactions, request, compact), repeat)
+        render, body = best(lambda: ORJSONRenderer().render(data), repeat)
+        return fetch, serialize, render, body
+
+    results = {'messages': count, 'unit': f'ms per {PER} messages'}
+    bodies = {}
+    for name, path in (('current', current), ('fast', lambda: fast(False)), ('fast_compact', lambda: fast(True))):
+        fetch, serialize, render, body = path()
+        bodies[name] = body
+        results[name] = {
+            'fetch': round(fetch * scale, 1),
+            'serialize': round(serialize * scale, 1),
+            'render': round(render * scale, 1),
+            'total': round((fetch + serialize + render) * scale, 1),
+            'bytes_per_message': round(len(body) / count),
+        }
+    results['fast']['same_results'] = json.loads(bodies['fast'])['results'] == json.loads(bodies['current'])['results']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=PER)
+    parser.add_argument('--repeat', type=int, default=5, help='best of this many rounds per step')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'serialization_bench.sqlite3'))
+    args = parser.parse_args()
+    _django.setup(args.db)
+    print(json.dumps(run(args.messages, args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
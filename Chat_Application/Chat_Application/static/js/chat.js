@@ -8,11 +8,28 @@ let reactionOptions, activeConversation, groupForm, groupMembersContainer;
 let groupNameInput, currentEditId, loginModal, signupModal;
 let attachmentPreview = null;
 let currentAttachment = null;
+let socket = null;
+let socketRetryDelay = 1000;
+let socketHasConnected = false;
+let cursorsCache = {};
+let recentList, inbox = [];
+let watermarksCache = {};
+let pendingAcks = {};
+let ackTimer = null;
+const ACK_DELAY = 500;
+const PAGE_SIZE = 50;
+// Everyone seen so far (directory pages, inbox, history), by id
+let knownUsers = {};
+let peopleSearch, contactsOnly, searchTimer = null;
+let people = { q: '', contacts: false, cursor: null, hasMore: true, loading: false, generation: 0 };
 
 // Initialize variables from DOM
 function initializeVars() {
     contactsList = document.getElementById('list');
+    peopleSearch = document.getElementById('peopleSearch');
+    contactsOnly = document.getElementById('contactsOnly');
     groupList = document.getElementById('groupList');
+    recentList = document.getElementById('recentList');
     chatSection = document.getElementById('chat_section');
     chatTitle = document.getElementById('chatTitle');
     chatSubtitle = document.getElementById('chatSubtitle');
@@ -124,9 +141,9 @@ function bootstrapApp() {
         if (logoutBtn) logoutBtn.classList.remove('d-none');
         if (loginBtn) loginBtn.classList.add('d-none');
         if (signupBtn) signupBtn.classList.add('d-none');
-        renderContacts();
+        loadPeople(true);
         renderGroups();
-        renderGroupMembers();
+        loadConversations();
     } else {
         const loginBtn = document.getElementById('loginBtn');
         const signupBtn = document.getElementById('signupBtn');
@@ -138,20 +155,145 @@ function bootstrapApp() {
     }
 }
 
-async function loadMessages(conversation) {
-    if (!conversation) return;
-    const key = conversation.type === 'user' ? `user-${conversation.id}` : `group-${conversation.id}`;
+function conversationKey(conversation) {
+    return conversation.type === 'user' ? `user-${conversation.id}` : `group-${conversation.id}`;
+}
+
+function messagesUrl(conversation) {
     let url = API_BASE + 'messages/?';
     url += conversation.type === 'user' ? 'user_id=' + conversation.id : 'group_id=' + conversation.id;
+    return url + '&limit=' + PAGE_SIZE + '&compact=1';
+}
+
+// Compact pages name each sender by id and list them once in `users`; put them back on the messages.
+async function fetchHistory(url) {
+    const data = await api(url);
+    rememberUsers(Object.values(data.users));
+    data.results.forEach(m => { m.sender = data.users[m.sender]; });
+    return data;
+}
+
+async function loadMessages(conversation) {
+    if (!conversation) return;
+    const key = conversationKey(conversation);
     try {
-        const data = await api(url);
-        messagesCache[key] = data;
+        const data = await fetchHistory(messagesUrl(conversation));
+        messagesCache[key] = data.results;
+        cursorsCache[key] = { before: data.before_cursor, sync: data.sync_cursor, loading: false };
+        watermarksCache[key] = data.watermarks || {};
         renderMessages(conversation);
+        const last = data.results[data.results.length - 1];
+        if (last) queueAck(conversation, { read: last.id });
     } catch (e) {
         console.error('Error loading messages:', e);
     }
 }
 
+// Fetch the next page of older history when the user scrolls to the top.
+async function loadOlderMessages() {
+    if (!activeConversation) return;
+    const conversation = activeConversation;
+    const key = conversationKey(conversation);
+    const cursors = cursorsCache[key];
+    if (!cursors || !cursors.before || cursors.loading) return;
+    cursors.loading = true;
+    try {
+        const data = await fetchHistory(messagesUrl(conversation) + '&before=' + encodeURIComponent(cursors.before));
+        messagesCache[key] = data.results.concat(messagesCache[key] || []);
+        cursors.before = data.before_cursor;
+        if (activeConversation && conversationKey(activeConversation) === key) {
+            renderMessages(conversation, { keepScroll: true });
+        }
+    } catch (e) {
+        console.error('Error loading older messages:', e);
+    } finally {
+        cursors.loading = false;
+    }
+}
+
+// Pull only what changed since the last sync cursor (e.g. after a reconnect).
+async function syncMessages(conversation) {
+    if (!conversation) return;
+    const key = conversationKey(conversation);
+    const cursors = cursorsCache[key];
+    if (!cursors || !cursors.sync) return loadMessages(conversation);
+    try {
+        let data;
+        do {
+            data = await fetchHistory(messagesUrl(conversation) + '&since=' + encodeURIComponent(cursors.sync));
+            data.results.forEach(m => applyMessageEvent(m.is_deleted ? 'message.deleted' : 'message.updated', m));
+            cursors.sync = data.sync_cursor;
+        } while (data.has_more);
+    } catch (e) {
+        console.error('Error syncing messages:', e);
+    }
+}
+
+function rememberUsers(list) {
+    list.forEach(user => { knownUsers[user.id] = user; });
+}
+
+function findUser(id) {
+    return knownUsers[id];
+}
+
+// The People list is the user directory, a page at a time: `reset` starts over
+// (new search or filter), otherwise the next page is appended.
+async function loadPeople(reset) {
+    if (reset) {
+        people.generation += 1;
+        people.cursor = null;
+        people.hasMore = true;
+        people.loading = false;
+        users = [];
+    }
+    if (people.loading || !people.hasMore) return;
+    const generation = people.generation;
+    people.loading = true;
+    let url = API_BASE + 'users/?limit=' + PAGE_SIZE;
+    if (people.q) url += '&q=' + encodeURIComponent(people.q);
+    if (people.contacts) url += '&contacts=1';
+    if (people.cursor) url += '&after=' + encodeURIComponent(people.cursor);
+    try {
+        const data = await api(url);
+        // A newer search started while this page was on its way
+        if (generation !== people.generation) return;
+        rememberUsers(data.results);
+        users = users.concat(data.results);
+        people.cursor = data.next_cursor;
+        people.hasMore = data.has_more;
+        renderContacts();
+        renderGroupMembers();
+    } catch (e) {
+        console.error('Error loading people:', e);
+    } finally {
+        if (generation === people.generation) people.loading = false;
+    }
+}
+
+function hookPeopleDirectory() {
+    if (peopleSearch) {
+        peopleSearch.addEventListener('input', function () {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(function () {
+                people.q = peopleSearch.value.trim();
+                loadPeople(true);
+            }, 250);
+        });
+    }
+    if (contactsOnly) {
+        contactsOnly.addEventListener('change', function () {
+            people.contacts = contactsOnly.checked;
+            loadPeople(true);
+        });
+    }
+    if (contactsList) {
+        contactsList.addEventListener('scroll', function () {
+            if (contactsList.scrollTop + contactsList.clientHeight >= contactsList.scrollHeight - 40) loadPeople(false);
+        });
+    }
+}
+
 function renderContacts() {
     if (!contactsList) return;
     contactsList.innerHTML = '';
@@ -180,6 +322,184 @@ function renderContacts() {
     });
 }
 
+// Recent conversations, newest activity first, from the precomputed inbox
+async function loadConversations() {
+    try {
+        const data = await api(API_BASE + 'conversations/');
+        inbox = data.results;
+        rememberUsers(inbox.filter(entry => entry.peer).map(entry => entry.peer));
+        renderConversations();
+    } catch (e) {
+        console.error('Error loading conversations:', e);
+    }
+}
+
+function conversationPreview(entry) {
+    const m = entry.last_message;
+    if (!m) return 'No messages yet';
+    const body = m.text || m.file_name || '';
+    if (entry.type === 'group' && m.sender) {
+        return (m.sender.id === currentUserId ? 'You' : displayName(m.sender)) + ': ' + body;
+    }
+    return (m.sender && m.sender.id === currentUserId ? 'You: ' : '') + body;
+}
+
+function renderConversations() {
+    if (!recentList) return;
+    recentList.innerHTML = '';
+    inbox.forEach(function (entry) {
+        const button = document.createElement('button');
+        button.className = 'list-group-item list-group-item-action d-flex align-items-center justify-content-between contact-btn';
+        const infoWrap = document.createElement('div');
+        infoWrap.className = 'd-flex align-items-center overflow-hidden';
+        const avatar = document.createElement('div');
+        avatar.className = 'avatar';
+        if (entry.peer) renderAvatar(avatar, entry.peer);
+        else avatar.textContent = entry.name.charAt(0).toUpperCase();
+        const textWrap = document.createElement('div');
+        textWrap.className = 'overflow-hidden';
+        const nameEl = document.createElement('div');
+        nameEl.textContent = entry.name;
+        const previewEl = document.createElement('small');
+        previewEl.className = 'text-muted d-block text-truncate conversation-preview';
+        previewEl.textContent = conversationPreview(entry);
+        textWrap.appendChild(nameEl);
+        textWrap.appendChild(previewEl);
+        infoWrap.appendChild(avatar);
+        infoWrap.appendChild(textWrap);
+        button.appendChild(infoWrap);
+
+        if (entry.unread_count) {
+            const badge = document.createElement('span');
+            badge.className = 'badge rounded-pill unread-badge';
+            badge.textContent = entry.unread_count > 99 ? '99+' : entry.unread_count;
+            button.appendChild(badge);
+        }
+
+        button.dataset.type = entry.type;
+        if (entry.type === 'group') button.dataset.groupId = entry.id;
+        else button.dataset.contactId = entry.id;
+        button.addEventListener('click', function () {
+            setActiveConversation({ type: entry.type, id: entry.id });
+            loadMessages({ type: entry.type, id: entry.id });
+        });
+        recentList.appendChild(button);
+    });
+    if (activeConversation) highlightActive(activeConversation);
+}
+
+function findInboxEntry(conversation) {
+    return inbox.find(e => e.type === conversation.type && String(e.id) === String(conversation.id));
+}
+
+function markConversationRead(conversation) {
+    const entry = findInboxEntry(conversation);
+    if (!entry || !entry.unread_count) return;
+    entry.unread_count = 0;
+    renderConversations();
+    if (entry.last_message) queueAck(conversation, { read: entry.last_message.id });
+}
+
+// Receipts are "read/delivered up to id" watermarks; a burst of acks collapses into one per conversation
+function queueAck(conversation, marks) {
+    const key = conversationKey(conversation);
+    const ack = pendingAcks[key] || { conversation: conversation, read: 0, delivered: 0 };
+    ack.read = Math.max(ack.read, marks.read || 0);
+    ack.delivered = Math.max(ack.delivered, marks.delivered || 0, ack.read);
+    pendingAcks[key] = ack;
+    if (!ackTimer) ackTimer = setTimeout(flushAcks, ACK_DELAY);
+}
+
+function flushAcks() {
+    ackTimer = null;
+    const acks = Object.values(pendingAcks);
+    pendingAcks = {};
+    acks.forEach(function (ack) {
+        const body = ack.conversation.type === 'group' ? { group_id: ack.conversation.id } : { user_id: ack.conversation.id };
+        body.read = ack.read;
+        body.delivered = ack.delivered;
+        if (isRealtimeConnected()) {
+            socket.send(JSON.stringify(Object.assign({ type: 'ack' }, body)));
+        } else {
+            api(API_BASE + 'conversations/read/', { method: 'POST', body: JSON.stringify(body) })
+                .catch(e => console.error('Error sending receipt:', e));
+        }
+    });
+}
+
+// Someone's watermarks moved: recount the ticks of the conversation if it is loaded
+function applyReceipts(conversationId, receipts) {
+    const parts = conversationId.split(':');
+    let key;
+    if (parts[0] === 'g') {
+        key = 'group-' + parts[1];
+    } else {
+        const other = parts.slice(1).find(id => Number(id) !== currentUserId);
+        key = 'user-' + (other || currentUserId);
+    }
+    const marks = watermarksCache[key];
+    if (!marks) return;
+    receipts.forEach(r => { marks[r.user_id] = { delivered: r.delivered, read: r.read }; });
+    if (activeConversation && conversationKey(activeConversation) === key) {
+        renderMessages(activeConversation, { keepScroll: true });
+    }
+}
+
+function receiptFor(key, m) {
+    const marks = watermarksCache[key];
+    if (!marks) return m.receipt;
+    let recipients = 0, delivered = 0, read = 0;
+    Object.keys(marks).forEach(function (userId) {
+        if (String(userId) === String(m.sender.id)) return;
+        recipients++;
+        if (marks[userId].delivered >= m.id) delivered++;
+        if (marks[userId].read >= m.id) read++;
+    });
+    return { recipients: recipients, delivered: delivered, read: read };
+}
+
+function receiptHtml(conversation, m) {
+    if (!m.sender || m.sender.id !== currentUserId) return '';
+    const r = receiptFor(conversationKey(conversation), m);
+    if (!r || !r.recipients) return '';
+    if (conversation.type === 'user') {
+        if (r.read) return '<small class="receipt receipt-read" title="Read">✓✓</small>';
+        if (r.delivered) return '<small class="receipt" title="Delivered">✓✓</small>';
+        return '<small class="receipt" title="Sent">✓</small>';
+    }
+    const title = 'Delivered to ' + r.delivered + ' of ' + r.recipients;
+    const cls = r.read === r.recipients ? 'receipt receipt-read' : 'receipt';
+    return '<small class="' + cls + '" title="' + title + '">Read by ' + r.read + '</small>';
+}
+
+// Keep the sidebar in step with a realtime message event without refetching it
+function applyInboxEvent(type, message) {
+    const conversation = message.to_group
+        ? { type: 'group', id: message.to_group }
+        : { type: 'user', id: message.sender && message.sender.id === currentUserId ? message.to_user : message.sender.id };
+    const entry = findInboxEntry(conversation);
+    if (!entry) {
+        if (type === 'message.created') loadConversations();
+        return;
+    }
+    const isActive = activeConversation && conversationKey(activeConversation) === conversationKey(conversation);
+    if (type === 'message.created') {
+        entry.last_message = message;
+        entry.last_activity_at = message.created_at;
+        if (message.sender && message.sender.id !== currentUserId && !isActive) entry.unread_count += 1;
+        inbox.splice(inbox.indexOf(entry), 1);
+        inbox.unshift(entry);
+    } else if (entry.last_message && String(entry.last_message.id) === String(message.id)) {
+        if (type === 'message.deleted') {
+            // The server knows which message is now the latest
+            loadConversations();
+            return;
+        }
+        entry.last_message = message;
+    }
+    renderConversations();
+}
+
 async function loadGroups() {
     try {
         const data = await api(API_BASE + 'groups/');
@@ -226,6 +546,15 @@ function renderGroups() {
 
 function setActiveConversation(conv) {
     activeConversation = conv;
+    highlightActive(conv);
+    currentEditId = null;
+    if (sendBtn) sendBtn.innerHTML = '<span class="me-1">➤</span>Send';
+    if (messageInput) messageInput.value = '';
+    clearAttachmentPreview();
+    if (conv) markConversationRead(conv);
+}
+
+function highlightActive(conv) {
     var buttons = document.querySelectorAll('.contact-btn');
     buttons.forEach(btn => {
         var type = btn.dataset.type;
@@ -236,10 +565,6 @@ function setActiveConversation(conv) {
             btn.classList.remove('active');
         }
     });
-    currentEditId = null;
-    if (sendBtn) sendBtn.innerHTML = '<span class="me-1">➤</span>Send';
-    if (messageInput) messageInput.value = '';
-    clearAttachmentPreview();
 }
 
 function formatFileSize(bytes) {
@@ -270,11 +595,19 @@ function renderAttachment(message) {
     const isImage = message.is_image || false;
     const isVideo = message.is_video || false;
     
+    // Thumbnails are rendered in the background; until they exist fall back to the original
+    const thumbUrl = message.thumbnail_url || attachmentUrl;
+    const sizeAttrs = message.attachment_width && message.attachment_height
+        ? ` width="${message.attachment_width}" height="${message.attachment_height}"` : '';
+    const videoType = message.attachment_content_type || 'video/mp4';
+
     let previewHtml = '';
     if (isImage) {
-        previewHtml = `<img src="${attachmentUrl}" class="attachment-thumbnail" alt="${escapeHtml(fileName)}" style="max-width:100%;max-height:200px;border-radius:8px;">`;
+        const webpSource = message.thumbnail_webp_url ? `<source srcset="${message.thumbnail_webp_url}" type="image/webp">` : '';
+        previewHtml = `<picture>${webpSource}<img src="${thumbUrl}" class="attachment-thumbnail" alt="${escapeHtml(fileName)}" loading="lazy" decoding="async"${sizeAttrs} style="max-width:100%;max-height:200px;width:auto;height:auto;border-radius:8px;"></picture>`;
     } else if (isVideo) {
-        previewHtml = `<video controls class="attachment-thumbnail" style="max-width:100%;max-height:200px;border-radius:8px;"><source src="${attachmentUrl}" type="video/mp4">Your browser does not support the video tag.</video>`;
+        const poster = message.thumbnail_url ? ` poster="${message.thumbnail_url}"` : '';
+        previewHtml = `<video controls preload="none"${poster} class="attachment-thumbnail" style="max-width:100%;max-height:200px;border-radius:8px;"><source src="${attachmentUrl}" type="${videoType}">Your browser does not support the video tag.</video>`;
     } else {
         previewHtml = `<div class="attachment-icon" style="font-size:2rem;">${getFileIcon(fileName)}</div>`;
     }
@@ -306,15 +639,17 @@ window.downloadAttachment = function(url, fileName) {
     document.body.removeChild(a);
 };
 
-function renderMessages(conversation) {
-    const key = conversation.type === 'user' ? `user-${conversation.id}` : `group-${conversation.id}`;
+function renderMessages(conversation, options = {}) {
+    const key = conversationKey(conversation);
     const messages = messagesCache[key] || [];
     if (!chatSection) return;
+    const messagesEl = document.querySelector('.messages');
+    const previousHeight = messagesEl ? messagesEl.scrollHeight : 0;
     chatSection.innerHTML = '';
     if (downloadCsvBtn) downloadCsvBtn.disabled = false;
 
     if (conversation.type === 'user') {
-        const u = users.find(u => u.id === conversation.id);
+        const u = findUser(conversation.id);
         if (chatTitle) chatTitle.textContent = u ? displayName(u) : 'User';
         if (chatSubtitle) chatSubtitle.textContent = 'Chatting with ' + (u ? displayName(u) : 'user');
     } else {
@@ -338,8 +673,8 @@ function renderMessages(conversation) {
                 <button class="msg-btn" onclick="editMessage('${m.id}')">✏️</button>
                 <button class="msg-btn" onclick="deleteMessage('${m.id}')">🗑️</button>
             </div>`;
-        var reaction = m.reaction ? '<span class="reaction-badge mt-1">' + m.reaction + '</span>' : '';
-        var sender = users.find(u => u.id === m.sender.id) || m.sender;
+        var reaction = renderReactions(m);
+        var sender = findUser(m.sender.id) || m.sender;
         var senderLabel = (conversation.type === 'group') ? '<div class="small text-muted">' + displayName(sender) + '</div>' : '';
         const timeStr = formatTime(m.created_at);
         
@@ -349,10 +684,14 @@ function renderMessages(conversation) {
             attachmentHtml = renderAttachment(m);
         }
         
-        div.innerHTML = '<div class="d-flex justify-content-between align-items-start gap-2"><div class="flex-grow-1"><div class="msg-text">' + escapeHtml(m.text) + '</div>' + attachmentHtml + senderLabel + '</div>' + actions + '</div><div class="d-flex align-items-center gap-2 mt-1"><small class="time-badge">' + timeStr + '</small>' + reaction + '</div>';
+        div.innerHTML = '<div class="d-flex justify-content-between align-items-start gap-2"><div class="flex-grow-1"><div class="msg-text">' + escapeHtml(m.text) + '</div>' + attachmentHtml + senderLabel + '</div>' + actions + '</div><div class="d-flex align-items-center gap-2 mt-1"><small class="time-badge">' + timeStr + '</small>' + receiptHtml(conversation, m) + reaction + '</div>';
         chatSection.appendChild(div);
     });
-    scrollToBottom();
+    if (options.keepScroll && messagesEl) {
+        messagesEl.scrollTop = messagesEl.scrollHeight - previousHeight;
+    } else {
+        scrollToBottom();
+    }
 }
 
 function clearAttachmentPreview() {
@@ -444,6 +783,66 @@ function showAttachmentPreview(file) {
     };
 }
 
+// Chunked, resumable uploads for large attachments
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+
+function uploadResumeKey(file) {
+    return 'upload:' + [file.name, file.size, file.lastModified].join(':');
+}
+
+async function startOrResumeUpload(file) {
+    // An upload interrupted earlier (even by a reload) picks up where the server left off
+    const saved = localStorage.getItem(uploadResumeKey(file));
+    if (saved) {
+        try {
+            return await api(API_BASE + 'uploads/' + saved + '/');
+        } catch (e) {
+            localStorage.removeItem(uploadResumeKey(file));
+        }
+    }
+    const upload = await api(API_BASE + 'uploads/', {
+        method: 'POST',
+        body: JSON.stringify({ file_name: file.name, content_type: file.type || '', size: file.size })
+    });
+    localStorage.setItem(uploadResumeKey(file), upload.id);
+    return upload;
+}
+
+async function uploadInChunks(file, fields) {
+    const upload = await startOrResumeUpload(file);
+    let offset = upload.received;
+    let failures = 0;
+    while (offset < file.size) {
+        const end = Math.min(offset + UPLOAD_CHUNK_SIZE, file.size);
+        try {
+            const state = await api(API_BASE + 'uploads/' + upload.id + '/', {
+                method: 'PUT',
+                body: file.slice(offset, end),
+                isFormData: true,
+                headers: {
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Range': 'bytes ' + offset + '-' + (end - 1) + '/' + file.size
+                }
+            });
+            offset = state.received;
+            failures = 0;
+        } catch (e) {
+            if (++failures > UPLOAD_RETRIES) throw e;
+            await new Promise(resolve => setTimeout(resolve, 500 * failures));
+            // Ask the server how far it got before resending
+            offset = (await api(API_BASE + 'uploads/' + upload.id + '/')).received;
+        }
+    }
+    const created = await api(API_BASE + 'uploads/' + upload.id + '/complete/', {
+        method: 'POST',
+        body: JSON.stringify(fields)
+    });
+    localStorage.removeItem(uploadResumeKey(file));
+    return created;
+}
+
 function hookMessageForm() {
     if (!messageForm) return;
     messageForm.addEventListener('submit', async function (event) {
@@ -453,29 +852,38 @@ function hookMessageForm() {
         
         try {
             if (currentEditId) {
-                await api(API_BASE + 'messages/' + currentEditId + '/', {
+                const updated = await api(API_BASE + 'messages/' + currentEditId + '/', {
                     method: 'PATCH',
                     body: JSON.stringify({ text: text })
                 });
+                applyMessageEvent('message.updated', updated);
                 currentEditId = null;
                 if (sendBtn) sendBtn.innerHTML = '<span class="me-1">➤</span>Send';
             } else {
-                const formData = new FormData();
-                formData.append('text', text);
-                if (activeConversation.type === 'user') formData.append('to_user', activeConversation.id);
-                if (activeConversation.type === 'group') formData.append('to_group', activeConversation.id);
-                if (currentAttachment) {
-                    formData.append('attachment', currentAttachment);
+                const target = {};
+                if (activeConversation.type === 'user') target.to_user = activeConversation.id;
+                if (activeConversation.type === 'group') target.to_group = activeConversation.id;
+                let created;
+                if (currentAttachment && currentAttachment.size > CHUNKED_UPLOAD_THRESHOLD) {
+                    created = await uploadInChunks(currentAttachment, Object.assign({ text: text }, target));
+                } else {
+                    const formData = new FormData();
+                    formData.append('text', text);
+                    Object.keys(target).forEach(key => formData.append(key, target[key]));
+                    if (currentAttachment) {
+                        formData.append('attachment', currentAttachment);
+                    }
+
+                    created = await api(API_BASE + 'messages/', {
+                        method: 'POST',
+                        body: formData,
+                        isFormData: true
+                    });
                 }
-                
-                await api(API_BASE + 'messages/', {
-                    method: 'POST',
-                    body: formData,
-                    isFormData: true
-                });
+                applyMessageEvent('message.created', created);
             }
             clearAttachmentPreview();
-            await loadMessages(activeConversation);
+            if (!isRealtimeConnected()) await loadMessages(activeConversation);
             if (messageInput) {
                 messageInput.value = '';
                 messageInput.focus();
@@ -489,19 +897,48 @@ function hookMessageForm() {
 
 // typing indicator removed per requirements
 
+function hookHistoryScroll() {
+    const messagesEl = document.querySelector('.messages');
+    if (!messagesEl) return;
+    messagesEl.addEventListener('scroll', function () {
+        if (messagesEl.scrollTop < 40) loadOlderMessages();
+    });
+}
+
 function scrollToBottom() {
     var messagesEl = document.querySelector('.messages');
     if (messagesEl) messagesEl.scrollTop = messagesEl.scrollHeight;
 }
 
-// Message actions
+function renderReactions(m) {
+    return (m.reactions || []).map(function (r) {
+        const cls = r.me ? 'reaction-badge reaction-mine mt-1' : 'reaction-badge mt-1';
+        return '<span class="' + cls + '" role="button" onclick="reactMessage(\'' + m.id + '\',\'' + r.emoji + '\')">' +
+            escapeHtml(r.emoji) + ' ' + r.count + '</span>';
+    }).join('');
+}
+
+// A reaction event carries everyone's counts, but "me" only holds for whoever reacted
+function mergeReactions(previous, message) {
+    const change = message.reaction_change;
+    const mine = {};
+    ((previous && previous.reactions) || []).forEach(r => { mine[r.emoji] = r.me; });
+    if (change && change.user_id === currentUserId) mine[change.emoji] = change.added;
+    message.reactions = (message.reactions || []).map(r => Object.assign({}, r, { me: !!mine[r.emoji] }));
+    delete message.reaction_change;
+    return message;
+}
+
+// Message actions: clicking an emoji toggles the caller's reaction
 window.reactMessage = async function (msgId, emoji) {
+    const info = findMessageInCache(msgId);
+    const mine = info && (info.reactions || []).some(r => r.emoji === emoji && r.me);
+    const url = API_BASE + 'messages/' + msgId + '/reactions/';
     try {
-        await api(API_BASE + 'messages/' + msgId + '/', {
-            method: 'PATCH',
-            body: JSON.stringify({ reaction: emoji })
-        });
-        await loadMessages(activeConversation);
+        const updated = mine
+            ? await api(url + '?emoji=' + encodeURIComponent(emoji), { method: 'DELETE' })
+            : await api(url, { method: 'POST', body: JSON.stringify({ emoji: emoji }) });
+        applyMessageEvent('message.reacted', updated);
     } catch (e) { console.error(e); }
 };
 
@@ -519,10 +956,86 @@ window.editMessage = function (msgId) {
 window.deleteMessage = async function (msgId) {
     try {
         await api(API_BASE + 'messages/' + msgId + '/', { method: 'DELETE' });
-        if (activeConversation) await loadMessages(activeConversation);
+        const info = findMessageInCache(msgId);
+        if (info) applyMessageEvent('message.deleted', info);
     } catch (e) { console.error(e); }
 };
 
+// Real-time updates: the server pushes message events over a WebSocket so the
+// open conversation is patched in place instead of being re-fetched.
+function isRealtimeConnected() {
+    return socket !== null && socket.readyState === WebSocket.OPEN;
+}
+
+function conversationKeyForMessage(m) {
+    if (m.to_group) return 'group-' + m.to_group;
+    const senderId = m.sender ? m.sender.id : null;
+    return 'user-' + (senderId === currentUserId ? m.to_user : senderId);
+}
+
+function applyMessageEvent(type, message) {
+    if (!message) return;
+    if (message.sender) rememberUsers([message.sender]);
+    applyInboxEvent(type, message);
+    const key = conversationKeyForMessage(message);
+    if (type === 'message.created' && message.sender && message.sender.id !== currentUserId) {
+        const conversation = message.to_group ? { type: 'group', id: message.to_group } : { type: 'user', id: message.sender.id };
+        const isActive = activeConversation && conversationKey(activeConversation) === key;
+        queueAck(conversation, isActive ? { read: message.id } : { delivered: message.id });
+    }
+    const list = messagesCache[key];
+    if (list) {
+        const idx = list.findIndex(m => String(m.id) === String(message.id));
+        const cursors = cursorsCache[key];
+        const olderThanLoaded = list.length && cursors && cursors.before &&
+            new Date(message.created_at) < new Date(list[0].created_at);
+        if (type === 'message.deleted') {
+            if (idx !== -1) list.splice(idx, 1);
+        } else if (idx !== -1) {
+            list[idx] = message.reaction_change ? mergeReactions(list[idx], message) : message;
+        } else if (!olderThanLoaded) {
+            list.push(message);
+            list.sort((a, b) => new Date(a.created_at) - new Date(b.created_at) || a.id - b.id);
+        }
+    }
+    if (activeConversation && conversationKey(activeConversation) === key) {
+        renderMessages(activeConversation);
+    }
+}
+
+function connectRealtime() {
+    if (!window.WebSocket || !currentUserId) return;
+    const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    let url = scheme + window.location.host + '/ws/chat/';
+    const token = localStorage.getItem('access');
+    if (token) url += '?token=' + encodeURIComponent(token);
+
+    socket = new WebSocket(url);
+    socket.onopen = function () {
+        socketRetryDelay = 1000;
+        // Catch up on anything missed while disconnected
+        if (socketHasConnected && activeConversation) syncMessages(activeConversation);
+        socketHasConnected = true;
+    };
+    socket.onmessage = function (e) {
+        let data;
+        try { data = JSON.parse(e.data); } catch (_) { return; }
+        if (data.type === 'group.joined' || data.type === 'group.left') {
+            loadGroups();
+            loadConversations();
+        }
+        else if (data.type === 'receipts.updated') applyReceipts(data.conversation, data.receipts);
+        else if (data.message) applyMessageEvent(data.type, data.message);
+    };
+    socket.onclose = function (e) {
+        socket = null;
+        // 4401/4403: not authenticated or no chat profile, retrying won't help
+        if (e.code === 4401 || e.code === 4403) return;
+        setTimeout(connectRealtime, socketRetryDelay);
+        socketRetryDelay = Math.min(socketRetryDelay * 2, 30000);
+    };
+}
+
 function findMessageInCache(msgId) {
     const keys = Object.keys(messagesCache);
     for (let k of keys) {
@@ -534,28 +1047,26 @@ function findMessageInCache(msgId) {
 
 function hookCsvDownload() {
     if (!downloadCsvBtn) return;
-    downloadCsvBtn.addEventListener('click', async function () {
+    downloadCsvBtn.addEventListener('click', function () {
         if (!activeConversation || !currentUserId) return;
         let url = API_BASE + 'messages/export/?';
         url += activeConversation.type === 'user' ? 'user_id=' + activeConversation.id : 'group_id=' + activeConversation.id;
-        try {
-            const res = await fetch(url, { 
-                headers: { 'X-CSRFToken': getCSRFToken() },
-                credentials: 'same-origin'
-            });
-            const blob = await res.blob();
-            const a = document.createElement('a');
-            const fileLabel = activeConversation.type === 'user' ? 'chat-with-' + activeConversation.id : 'group-' + activeConversation.id;
-            a.href = URL.createObjectURL(blob);
-            a.download = fileLabel + '.csv';
-            a.click();
-            URL.revokeObjectURL(a.href);
-        } catch (e) { console.error(e); }
+        // Let the browser stream the export straight to disk instead of
+        // buffering the whole file in a Blob first.
+        const a = document.createElement('a');
+        const fileLabel = activeConversation.type === 'user' ? 'chat-with-' + activeConversation.id : 'group-' + activeConversation.id;
+        a.href = url;
+        a.download = fileLabel + '.csv';
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
     });
 }
 
 function renderGroupMembers() {
     if (!groupMembersContainer) return;
+    // Keep what was ticked while the list follows the directory search
+    const checked = new Set(Array.from(groupMembersContainer.querySelectorAll('input:checked'), cb => cb.value));
     groupMembersContainer.innerHTML = '';
     users.forEach(function (user) {
         var col = document.createElement('div');
@@ -566,7 +1077,7 @@ function renderGroupMembers() {
             '<span style="width:20px;height:20px;display:inline-block;text-align:center;line-height:20px;margin-right:8px;background:#6366f1;color:white;border-radius:50%;font-size:10px;">' + (displayName(user).charAt(0).toUpperCase()) + '</span>';
         col.innerHTML = `
             <div class="form-check">
-                <input class="form-check-input" type="checkbox" value="${user.id}" id="member-${user.id}">
+                <input class="form-check-input" type="checkbox" value="${user.id}" id="member-${user.id}"${checked.has(String(user.id)) ? ' checked' : ''}>
                 <label class="form-check-label d-flex align-items-center" for="member-${user.id}">
                     ${avatarHtml} ${displayName(user)} <span class="text-muted small">(${user.email})</span>
                 </label>
@@ -650,5 +1161,8 @@ document.addEventListener('DOMContentLoaded', function() {
     hookMessageForm();
     hookCsvDownload();
     hookGroupForm();
+    hookPeopleDirectory();
+    hookHistoryScroll();
+    connectRealtime();
 });
 